@@ -1,97 +1,191 @@
 #!/usr/bin/env python3
-from datetime import datetime
-from utils import formatTime, formatAlert, formatError
-from dbutils import queryValues, initDatabase
+import heapq
+from itertools import repeat
+from utils import formatAlert, formatError
+from storage import openBackend, ALERT_TYPES
 import threading
 
 
+def alertTime(alert):
+    """Returns a sortable representation of the timestamp of a notification.
+
+    Args:
+        alert (tuple): Notification with its id (see StorageBackend.pageAlerts).
+
+    Returns:
+        The timestamp of the notification, in the YYYYmmddHH:MM:SS format.
+
+    """
+
+    timestamp = alert[1]
+    return timestamp[6:10] + timestamp[3:5] + timestamp[0:2] + timestamp[11:]
+
 class AlertWatcher():
     """Class whose goal is to notify about the alerts / recoveries of the monitored websites.
-    It checks periodically the monitoring database to see if there are new alerts or recoveries.
+    It prints the most recent notifications, then checks periodically the monitoring databases to see
+    if there are new alerts or recoveries. Older notifications are printed page by page, on request.
+
+    With several storages (for example one database per monitoring instance), the notifications of all
+    the storages are merged in a single feed, in time order: each storage has its own cursors, and the
+    notifications read from each storage (already in time order) are merged with a heap, so that a check
+    only costs the new notifications.
 
     Attributes:
-        dbName (str): Name of the database to use.
+        storages (list of StorageBackend): Storage backends to use,
+        pageSize (int): Number of notifications printed at a time from the history,
+        host (str): Only the notifications about this website are printed (None for all the websites),
+        since (datetime.datetime): Only the notifications from this date are printed (None for no limit),
+        until (datetime.datetime): Only the notifications before this date are printed (None for no limit),
+        oldestIds (list of int): Id of the oldest notification printed from the history of each storage (None
+            if no notification of the storage was printed from the history yet),
+        lastIds (list of int): Id of the most recent notification printed from each storage,
+        stopped (threading.Event): Set to stop checking for new notifications.
 
     """
 
-    def __init__(self, dbName="monitoring.db"):
-        """Sets the database name as speficied in the parameters.
+    def __init__(self, storage="monitoring.db", pageSize=20, host=None, since=None, until=None):
+        """Sets the storages and the notifications filters as speficied in the parameters.
 
         Args:
-            dbName (str, optional): Name of the database to use.
+            storage (str or list, optional): URI of the storage to use, or name of the database file (see
+                storage.openBackend), or a list of them to watch several storages,
+            pageSize (int, optional): Number of notifications printed at a time from the history,
+            host (str, optional): Only print the notifications about this website,
+            since (datetime.datetime, optional): Only print the notifications from this date,
+            until (datetime.datetime, optional): Only print the notifications before this date (the new
+                notifications are then not checked).
 
         """
 
-        self.dbName = dbName
+        self.storages = [openBackend(uri) for uri in ([storage] if isinstance(storage, str) else storage)]
+        self.pageSize = pageSize
+        self.host = host
+        self.since = since
+        self.until = until
+        self.oldestIds = [None] * len(self.storages)
+        self.lastIds = [0] * len(self.storages)
+        self.stopped = threading.Event()
 
     def __printData(self, data):
-        """Takes the relevant data from the database queries and prints notification lines
+        """Takes the relevant data from the database queries and prints notification lines.
+        The data is consumed as a stream: each line is printed as soon as its row is read.
 
         Args:
-            data (array): Array of arrays each containing one event data.
+            data (iterable): Iterable of (<index of the storage (int)>, <event data (tuple)>) pairs.
 
-        An element of data should always have the following format:
-        (<timestamp>, <websiteURL>, <type>, <startDate>, <endDate>, <availability>)
+        An event data should always have the following format:
+        (<id>, <timestamp>, <websiteURL>, <type>, <startDate>, <endDate>, <availability>)
         since this is the format imposed by the sql query we made.
         If it doesn't, that means that the database was modified or that
         the query (or its result) was tampered with.
 
+        Returns:
+            A dictionary (int: int) containing the id of the last printed event of each storage with printed events.
+
         """
 
-        for elt in data:
+        lastIds = {}
+        for source, elt in data:
             # For each data point, print the correspnding alert or recovery notification
             try:
                 lineData = {
-                    "URL": elt[1],
-                    "type": elt[2],
-                    "startDate": elt[3],
-                    "endDate": elt[4],
-                    "availability": elt[5]
+                    "URL": elt[2],
+                    "type": elt[3],
+                    "startDate": elt[4],
+                    "endDate": elt[5],
                 }
+                # The last column of the latency notifications is the response time instead of the availability
+                lineData["responseTime" if elt[3] in ALERT_TYPES['latency'] else "availability"] = elt[6]
                 print(formatAlert(lineData))
+                lastIds[source] = elt[0]
             except:
                 print(formatError('Error while reading data', 'critical'))
                 raise
 
-    def __check(self, startDate=None):
+        return lastIds
+
+    def printPage(self):
+        """Prints the previous page of the notifications history (the most recent notifications on the first call).
+
+        Returns:
+            The number of notifications printed.
+
+        """
+
+        # Merge the previous page of each storage (in descending time order), and keep the most recent notifications
+        pages = [
+            zip(repeat(source), storage.pageAlerts(self.pageSize, self.oldestIds[source], self.host, self.since, self.until))
+            for source, storage in enumerate(self.storages)
+        ]
+        page = list(heapq.merge(*pages, key=lambda item: alertTime(item[1]), reverse=True))[:self.pageSize]
+
+        # The next page of each storage starts before its oldest printed notification
+        for source, alert in page:
+            self.oldestIds[source] = alert[0]
+
+        # The page is in descending time order: print it in ascending order
+        self.__printData(reversed(page))
+        return len(page)
+
+    def printNew(self):
         """Checks if there are any new notifications to take into account and prints them.
 
-        Args:
-            startDate (str, optional): Limits the search to notifications after this date.
+        """
+
+        # Print the new events as they are streamed from the storages: only the notifications after
+        # the last printed one of each storage are queried. The queries return events in ascending time
+        # order, and are merged in time order, so the id of the last printed event of each storage is
+        # the starting point for next check
+        streams = [
+            zip(repeat(source), storage.iterAlertsAfter(self.lastIds[source], self.host))
+            for source, storage in enumerate(self.storages)
+        ]
+        lastIds = self.__printData(heapq.merge(*streams, key=lambda item: alertTime(item[1])))
+        self.lastIds = [lastIds.get(source, lastId) for source, lastId in enumerate(self.lastIds)]
+
+    def __watch(self):
+        """Checks for new notifications every 10 seconds, until the watcher is stopped.
 
         """
 
-        if startDate is not None:
-            # If a startDate was given (typically, after the first check), only query about notifications after this date.
-            queryData = {
-                "startDate": startDate
-            }
-        else:
-            # Query the database about all the notifications
-            queryData = {}
-        data = queryValues(self.dbName, 'website_alerts', queryData)
-
-        if len(data) > 0:
-            # If there is new data available, print it
-            self.__printData(data)
-
-            # The query returns events in ascending time order.
-            # Take the last timestamp as the starting point for next check
-            currentDate = data[-1][0]
-        else:
-            # There were no new events, keep the previous starting point as the next start date
-            currentDate = startDate
-
-        # Schedule the next check
-        newCheck = threading.Timer(10, self.__check, args=[currentDate])
-        newCheck.start()
-        return 0;
+        while not self.stopped.wait(10):
+            self.printNew()
 
     def run(self):
-        """Launches the first check which retrieves all notification history.
+        """Prints the most recent notifications, then checks for new notifications in the background
+        (unless an end date was given), while older notifications are printed on request.
 
         """
 
-        initDatabase(self.dbName)
-        self.__check()
-
+        for source, storage in enumerate(self.storages):
+            storage.initStorage()
+
+            # The new notifications are the ones after the most recent one (whatever the date filters)
+            latest = storage.pageAlerts(1, host=self.host)
+            self.lastIds[source] = latest[0][0] if latest else 0
+
+        if self.printPage() == 0:
+            print('\033[93mNo notifications found\033[0m')
+
+        if self.until is None:
+            # A single thread checks for the new notifications
+            watcher = threading.Thread(target=self.__watch, daemon=True)
+            watcher.start()
+
+        try:
+            # Print the older notifications on request (when Enter is pressed), one page at a time
+            while True:
+                try:
+                    input()
+                except EOFError:
+                    # Without input (for example if the app runs in the background), only check for the new notifications
+                    if self.until is None:
+                        watcher.join()
+                    break
+                print('\033[37m---- Older notifications ----\033[0m')
+                if self.printPage() == 0:
+                    print('\033[93mNo older notifications\033[0m')
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.stopped.set()
@@ -2,32 +2,61 @@ import os
 import threading
 import json
 from retriever import Retriever
-from monitor import Monitor
-from datetime import datetime
-from utils import formatTime, formatStats, formatAlert, formatError
-from dbutils import initDatabase
+from monitor import Monitor, CONNECT_TIMEOUT, READ_TIMEOUT
+from probe import dnsCache, ConcurrencyLimiter
+from datetime import datetime, timedelta
+from utils import formatTime, formatStats, formatAlert, formatError, formatDNSCache, formatStatsCache, formatNotifications, formatSummary, formatSiteSummary
+from summary import RANKINGS, summarize, worstSites
+from statsCache import CachedBackend
+from storage import SAMPLE_TIMESTAMP_FORMAT
+from scheduling import CheckSchedule
+from latency import LatencyDetector
+from notifications import createDispatcher
 
 class App():
     """Main class of the application. Handles configuration retrieval, and results printing.
 
     Attributes:
-        dbName (str): Name of the database to use,
-        monitors (dict of str:(Monitor, int)): Stores the monitor and check interval for each website,
-        retrievers (dict of str:Retriever): Stores the data retriever for each website.
+        storage (statsCache.CachedBackend): Storage backend to use, behind a cache of the window stats,
+        monitors (dict of str:(Monitor, CheckSchedule)): Stores the monitor and check schedule for each website,
+        retrievers (dict of str:Retriever): Stores the data retriever for each website,
+        detectors (dict of str:LatencyDetector): Stores the latency alerts detector for each website,
+        maxConcurrentChecks (int): Maximum number of checks in progress at the same time,
+        maxConcurrentChecksPerHost (int): Maximum number of checks of the same host in progress at the same time,
+        dispatcher (notifications.Dispatcher): Dispatcher of the notifications to external receivers (None if there is none),
+        top (int): Number of websites printed in summary mode (None to print the stats of every website),
+        ranking (str): Way of ranking the websites in summary mode (one of summary.RANKINGS),
+        summaryMinutes (int): Timeframe of the summary, in minutes.
 
     """
 
-    def __init__(self, dbName="monitoring.db"):
-        """Sets the database file to use and initializes the monitors and retrievers dictionaries.
+    def __init__(self, storage="monitoring.db", top=None, ranking='availability', summaryMinutes=10):
+        """Sets the storage to use and the printing mode, and initializes the monitors and retrievers dictionaries.
 
             Args:
-                dbName (str, optional): Name of the database to use.
+                storage (str, optional): URI of the storage to use, or name of the database file (see storage.openBackend),
+                top (int, optional): If given, only print a summary of all the websites and the stats of the top
+                    worst websites (this number of them), instead of the stats of every website,
+                ranking (str, optional): Way of ranking the websites in summary mode: "availability" (lowest first),
+                    "p95" (highest 95th percentile of the response times first) or "5xx" (most 5xx responses first),
+                summaryMinutes (int, optional): Timeframe of the summary, in minutes.
 
         """
 
-        self.dbName = dbName
+        if ranking not in RANKINGS:
+            raise ValueError('Unknown ranking {}'.format(ranking))
+
+        # The stats of each website are computed several times per print cycle (stats printing and alert check)
+        self.storage = CachedBackend(storage)
+        self.top = top
+        self.ranking = ranking
+        self.summaryMinutes = summaryMinutes
         self.monitors = {}
         self.retrievers = {}
+        self.detectors = {}
+        self.maxConcurrentChecks = 64
+        self.maxConcurrentChecksPerHost = 4
+        self.dispatcher = None
 
     def __loadJSONConfig(self, fileName):
         """Loads the configuration file provided in argument.
@@ -36,22 +65,48 @@ class App():
             "websites": [
                 {
                     "URL": <urlOfWebsite1 (str)>,
-                    "checkInterval": <checkIntervalOfWebsite1 (int/float)>
+                    "checkInterval": <checkIntervalOfWebsite1 (int/float)>,
+                    "maxCheckInterval": <maxCheckIntervalOfWebsite1 (int/float)>,
+                    "probeMethod": <probeMethodOfWebsite1 (str)>,
+                    "maxBodyBytes": <maxBodyBytesOfWebsite1 (int)>,
+                    "connectTimeout": <connectTimeoutOfWebsite1 (int/float)>,
+                    "readTimeout": <readTimeoutOfWebsite1 (int/float)>,
+                    "content": {
+                        "contains": <stringInTheBodyOfWebsite1 (str)>,
+                        "matches": <regularExpressionMatchingTheBodyOfWebsite1 (str)>,
+                        "maxBodySize": <maxBodySizeOfWebsite1 (int)>
+                    }
                 },
                 {
                     "URL": <urlOfWebsite2 (str)>
                 }
                 ...
             ],
-            "defaultCheckInterval": <defaultCheckInterval (int/float)>
+            "defaultCheckInterval": <defaultCheckInterval (int/float)>,
+            "defaultMaxCheckInterval": <defaultMaxCheckInterval (int/float)>,
+            "maxConcurrentChecks": <maxConcurrentChecks (int)>,
+            "maxConcurrentChecksPerHost": <maxConcurrentChecksPerHost (int)>,
+            "notifications": <notificationsConfig (dict)>
         }
-        The check intervals are expressed in seconds.
+        The check intervals are expressed in seconds. If the maximum check interval of a website is greater than
+        its check interval, the website is checked at an adaptive interval (see scheduling.CheckSchedule).
+        The probe method is one of "get" (default), "head", "headers" or "capped" (see monitor.PROBE_METHODS),
+        maxBodyBytes is the number of bytes of body read by the "capped" method (65536 by default).
+        The timeouts are expressed in seconds (see monitor.CONNECT_TIMEOUT and monitor.READ_TIMEOUT for the defaults).
+        The content assertions are optional (see contentCheck.ContentCheck): a website whose response fails them is
+        unavailable (with a content failure), even with a successful status code.
+        The maximum numbers of checks in progress at the same time, in total and to the same host, are stored in
+        the maxConcurrentChecks and maxConcurrentChecksPerHost attributes (64 and 4 by default).
+        If the notifications are delivered to external receivers (see notifications.createDispatcher), their
+        dispatcher is stored in the dispatcher attribute.
 
         Args:
             fileName (str): Path to the configuration file.
 
         Returns:
-            A dictionary (str: int/float) containing websiteURL: checkInterval key-value pairs.
+            A dictionary (str: dict) containing websiteURL: websiteConfig key-value pairs, websiteConfig containing
+            the checkInterval (int/float), maxCheckInterval (int/float), probeMethod (str), maxBodyBytes (int),
+            connectTimeout (int/float), readTimeout (int/float) and content (dict, None if the body isn't checked) of the website.
 
         """
 
@@ -64,6 +119,16 @@ class App():
 
             # Get the defaultCheckInterval if there is one (defaults to 2 seconds)
             defaultCheckInterval = loadedJSON.get('defaultCheckInterval', 2)
+            # The maximum check intervals default to the check intervals (i.e. fixed intervals)
+            defaultMaxCheckInterval = loadedJSON.get('defaultMaxCheckInterval')
+
+            # Get the limits of the concurrent checks
+            self.maxConcurrentChecks = loadedJSON.get('maxConcurrentChecks', 64)
+            self.maxConcurrentChecksPerHost = loadedJSON.get('maxConcurrentChecksPerHost', 4)
+
+            # Create the dispatcher of the notifications to external receivers, if there are any
+            if loadedJSON.get('notifications'):
+                self.dispatcher = createDispatcher(loadedJSON['notifications'])
             try:
                 # Try to get the websites config
                 websites = loadedJSON['websites']
@@ -77,13 +142,21 @@ class App():
             for website in websites:
                 try:
                     # For each website, add the URL as a key in res, the value associated to it
-                    # being the checkInterval (defaults to defaultCheckInterval)
-                    res[website['URL']] = website.get("checkInterval", defaultCheckInterval)
+                    # being the website configuration (checkInterval defaults to defaultCheckInterval)
+                    res[website['URL']] = {
+                        "checkInterval": website.get("checkInterval", defaultCheckInterval),
+                        "maxCheckInterval": website.get("maxCheckInterval", defaultMaxCheckInterval),
+                        "probeMethod": website.get("probeMethod", "get"),
+                        "maxBodyBytes": website.get("maxBodyBytes", 65536),
+                        "connectTimeout": website.get("connectTimeout", CONNECT_TIMEOUT),
+                        "readTimeout": website.get("readTimeout", READ_TIMEOUT),
+                        "content": website.get("content"),
+                    }
                 except KeyError:
                     # If the website is misconfigured (no URL), print an error notification
                     print(formatError('Error while reading the configuration file: missing URL for a website.', 'warning'))
 
-            # Return the dictionary of websiteURL: checkInterval
+            # Return the dictionary of websiteURL: websiteConfig
             return res
 
         except FileNotFoundError:
@@ -96,25 +169,35 @@ class App():
             print(formatError('\033[1;91mError while decoding configuration file\033[0m', 'critical'))
             raise
 
-    def __getResults(self, monitor, checkInterval):
-        """Launches a website check and schedules the next check.
+    def __getResults(self, monitor, schedule, detector):
+        """Launches a website check if it is due, and schedules the next tick.
+        Ticks happen every base check interval of the website: with an adaptive schedule, the
+        website is only checked at the ticks where its current interval has elapsed.
         Args:
             monitor (Monitor): Monitor of the website we want to check
-            checkInterval (int/float): Check interval between two checks for this website
+            schedule (CheckSchedule): Schedule giving the interval between two checks for this website
+            detector (LatencyDetector): Detector of the latency alerts of this website
 
         """
-        periodicCheck = threading.Timer(checkInterval, self.__getResults, args=[monitor, checkInterval])
+        periodicCheck = threading.Timer(schedule.checkInterval, self.__getResults, args=[monitor, schedule, detector])
         periodicCheck.start()
-        monitor.get()
+
+        if schedule.isDue():
+            # The check is skipped (and stored as a failure) if the previous check is still in progress
+            sample = monitor.get()
+            schedule.next(sample)
+            # The latency alerts are computed from the data point itself, without querying the storage
+            detector.add(sample)
         return;
 
-    def __printResults(self, retrievers, printInterval, countdownToNextMinute):
+    def __printResults(self, retrievers, printInterval, countdownToNextMinute, now=None):
         """Prints the stats aggregates for defined timeframes for each website.
 
         Args:
             retrievers (dict of Retriever): Retrievers of the website we want to check,
             printInterval (int/float): Interval between two stat prints,
-            countdownToNextMinute (int): Number of checks to go before the next printing of hourly stats.
+            countdownToNextMinute (int): Number of checks to go before the next printing of hourly stats,
+            now (datetime.datetime, optional): End of the timeframes of the stats (now by default).
 
         """
 
@@ -133,19 +216,46 @@ class App():
         os.system('clear')
         resString = '\n\033[37;1;4m#### Periodic stat check: ' + formatTime(datetime.now().strftime("%d/%m/%Y %H:%M:%S")) + ' ####\033[0m'
 
+        # Add the counters of the DNS cache shared by the monitors, of the stats and notifications caches, and of the notifications dispatcher
+        resString += formatDNSCache(dnsCache.stats())
+        resString += formatStatsCache(self.storage.cache.stats())
+        resString += formatStatsCache(self.storage.alertCache.stats(), 'Last notifications cache')
+        if self.dispatcher is not None:
+            resString += formatNotifications(self.dispatcher.stats())
+
+        if self.top is not None:
+            # In summary mode, only print the summary of the websites
+            print(resString + self.__summary(retrievers))
+            return;
+
+        # Get the stats (and whether there are any stats) of all the websites for the 2 and 10 minutes
+        # timeframes, with one query per timeframe. If printHourlyCheck is True, also get the stats
+        # for the 60 minutes timeframe.
+        now = now or datetime.utcnow()
+        stats2mByWebsite = self.storage.bulkWindowAggregate(retrievers, 2, now)
+        stats10mByWebsite = self.storage.bulkWindowAggregate(retrievers, 10, now)
+        if printHourlyCheck:
+            stats1hByWebsite = self.storage.bulkWindowAggregate(retrievers, 60, now)
+
         for website, retriever in retrievers.items():
-            # For each website, get from the retrievers the stats (and whether there are any stats)
-            # for the 2 and 10 minutes timeframes. If printHourlyCheck is True, also get the stats
-            # for the 60 minutes timeframe.
+            # For each website, check the alert status and get its stats
             alertStatus = retriever.checkAlert()
-            availableStats2m, stats2m = retriever.getStats(2)
-            availableStats10m, stats10m = retriever.getStats(10)
+            availableStats2m, stats2m = stats2mByWebsite[website]
+            availableStats10m, stats10m = stats10mByWebsite[website]
             if printHourlyCheck:
-                availableStats1h, stats1h = retriever.getStats(60)
+                availableStats1h, stats1h = stats1hByWebsite[website]
 
             # Add the website header to the result string
             resString += '\n\n\033[94;1m---- Stats for website ' + retriever.URL + ' ----\033[0m'
 
+            monitor, schedule = self.monitors[website]
+            if monitor.skippedChecks > 0:
+                # Add the number of checks skipped because the previous check of the website was still in progress
+                resString += '\n\033[93mSkipped checks (previous check still in progress): {}\033[0m'.format(monitor.skippedChecks)
+            if schedule.isAdaptive():
+                # Add the current check interval of the website if it is adaptive
+                resString += '\n\033[37mCurrent check interval: {:.1f}s (between {}s and {}s)\033[0m'.format(schedule.interval, schedule.checkInterval, schedule.maxInterval)
+
             if availableStats2m:
                 # If there are available stats for the past 2 minutes, add them to the result string
                 resString += formatStats(2, stats2m)
@@ -155,8 +265,9 @@ class App():
             if printHourlyCheck and availableStats1h:
                 # Same for the last hour (if printHourlyCheck is True)
                 resString += formatStats(60, stats1h)
-            # Finally, add the alert status
+            # Finally, add the alert status and the latency alert status
             resString += formatAlert(alertStatus)
+            resString += formatAlert(self.detectors[website].status())
 
             if not (availableStats10m and availableStats2m and (not printHourlyCheck or availableStats1h)):
                 # If there are no stats available, add a notification to the string"
@@ -167,9 +278,88 @@ class App():
         return;
 
 
+    def __summary(self, retrievers):
+        """Checks the alert status of every website, and summarizes the stats of all the websites.
+        The data points of all the websites are streamed with a single query, and only the worst
+        websites are selected and formatted, so that the length of the summary doesn't depend on the
+        number of websites.
+        The alert status of the websites is computed from their last notifications, loaded with a single
+        query, and from the data points streamed for the summary: the alert of a website is only checked
+        on its own (see Retriever.checkAlert) when a notification may have to be sent.
+
+        Args:
+            retrievers (dict of Retriever): Retrievers of the websites.
+
+        Returns:
+            A string containing the totals over all the websites, and the stats and alert status of the worst websites.
+
+        """
+
+        # The availability over the timeframe of the alerts (the last 2 minutes) is counted while streaming
+        # the data points, unless the summary covers a shorter timeframe
+        now = datetime.utcnow()
+        alertSince = (now - timedelta(minutes=2)).strftime(SAMPLE_TIMESTAMP_FORMAT)
+        sites, totals = summarize(self.storage.bulkIterSamples(retrievers, self.summaryMinutes, now), alertSince)
+        if self.summaryMinutes >= 2:
+            availabilities = { website: stats['recentAvailability'] for website, stats in sites.items() }
+        else:
+            availabilities = { website: stats['availability'] for website, (availableStats, stats)
+                in self.storage.bulkWindowAggregate(retrievers, 2, now).items() if availableStats }
+
+        lastAlerts = self.storage.bulkLastAlert(retrievers)
+        alertStatuses = {}
+        for website, retriever in retrievers.items():
+            alertStatus = retriever.alertStatus(lastAlerts.get(website), availabilities.get(website))
+            alertStatuses[website] = alertStatus if alertStatus is not None else retriever.checkAlert()
+        onAlert = sum(1 for alertStatus in alertStatuses.values() if alertStatus['type'] == 'alert')
+
+        resString = formatSummary(self.summaryMinutes, totals, len(retrievers), onAlert)
+        resString += '\n\n\033[94;1m---- Top {} websites by {} ----\033[0m'.format(self.top, self.ranking)
+        for rank, (website, stats) in enumerate(worstSites(sites, self.ranking, self.top), 1):
+            resString += formatSiteSummary(rank, website, stats)
+            if alertStatuses[website]['type'] is not None:
+                resString += formatAlert(alertStatuses[website])
+            resString += formatAlert(self.detectors[website].status())
+        return resString
+
+    def __warmStart(self, now):
+        """Restores the alert state of the retrievers and detectors and the state of the check schedules from the storage,
+        so that a restarted app carries on where it stopped instead of starting from scratch.
+        The notifications and the stats of all the websites over each printed timeframe are loaded with a single
+        query each, and the stats are kept in the stats cache for the first print.
+
+        Args:
+            now (datetime.datetime): End of the timeframes of the stats (the stats cache keeps them for this date).
+
+        Returns:
+            The number of websites on alert.
+
+        """
+
+        lastAlerts = self.storage.bulkLastAlert(self.retrievers)
+        for website, retriever in self.retrievers.items():
+            retriever.restore(lastAlerts.get(website))
+        lastLatencyAlerts = self.storage.bulkLastAlert(self.detectors, 'latency')
+        for website, detector in self.detectors.items():
+            detector.restore(lastLatencyAlerts.get(website))
+
+        # Load the stats of the last 2 minutes, and outside of summary mode (which streams the data points instead)
+        # the stats of the last 10 and 60 minutes printed at startup
+        recentStats = self.storage.bulkWindowAggregate(self.retrievers, 2, now)
+        if self.top is None:
+            self.storage.bulkWindowAggregate(self.retrievers, 10, now)
+            self.storage.bulkWindowAggregate(self.retrievers, 60, now)
+
+        # Only the adaptive schedules have a state
+        for website, (_, schedule) in self.monitors.items():
+            if schedule.isAdaptive():
+                schedule.restore(recentStats[website])
+
+        return sum(retriever.isOnAlert for retriever in self.retrievers.values())
+
     def run(self, configFile="config.json"):
         """Main part of the app.
-        Loads the configuration and creates Monitors and Retrievers for each website.
+        Loads the configuration and creates Monitors, Retrievers and LatencyDetectors for each website.
         Prints aggregated data and current errors at constant intervals.
 
         Args:
@@ -178,25 +368,42 @@ class App():
         """
 
         # Print a waiting message
-        print("Initializing monitoring mode... first stats printing expected in 10 seconds.")
+        print("Initializing monitoring mode...")
 
         # Load the configuration file
         websites = self.__loadJSONConfig(configFile)
 
-        # Initialize the database
-        initDatabase(self.dbName)
+        # Initialize the storage
+        self.storage.initStorage()
 
-        # Instanciate a Retriever and a Monitor for each website in the configuration file
-        for websiteURL, checkInterval in websites.items():
-            self.monitors[websiteURL] = Monitor(websiteURL, self.dbName), checkInterval
-            self.retrievers[websiteURL] = Retriever(websiteURL, self.dbName)
+        # The limiter of the concurrent checks is shared by all the Monitors
+        limiter = ConcurrencyLimiter(self.maxConcurrentChecks, self.maxConcurrentChecksPerHost)
 
-        # Start a thread dedicated to printing results
-        resultsPrinting = threading.Timer(10, self.__printResults, args=[self.retrievers, 10, 5])
+        # Instanciate a Retriever and a Monitor for each website in the configuration file
+        for websiteURL, websiteConfig in websites.items():
+            monitor = Monitor(websiteURL, self.storage, websiteConfig['probeMethod'], websiteConfig['maxBodyBytes'],
+                websiteConfig['connectTimeout'], websiteConfig['readTimeout'], limiter=limiter, content=websiteConfig['content'])
+            schedule = CheckSchedule(websiteConfig['checkInterval'], websiteConfig['maxCheckInterval'])
+            self.monitors[websiteURL] = monitor, schedule
+            self.retrievers[websiteURL] = Retriever(websiteURL, self.storage, dispatcher=self.dispatcher)
+            self.detectors[websiteURL] = LatencyDetector(websiteURL, self.storage, dispatcher=self.dispatcher)
+
+        # Restore the state of the websites from the storage before probing resumes
+        startDate = datetime.utcnow().replace(microsecond=0)
+        onAlert = self.__warmStart(startDate)
+        print("Restored the state of {} websites ({} on alert).".format(len(self.retrievers), onAlert))
+
+        # Start delivering the notifications (including the ones not delivered before the app stopped)
+        if self.dispatcher is not None:
+            self.dispatcher.start()
+
+        # Start a thread dedicated to printing results (the first results, including the hourly stats, are printed
+        # right away from the data stored before the app started, which the warm start loaded in the stats cache)
+        resultsPrinting = threading.Timer(0, self.__printResults, args=[self.retrievers, 10, 0, startDate])
         resultsPrinting.start()
 
-        for (monitor, checkI) in self.monitors.values():
+        for websiteURL, (monitor, schedule) in self.monitors.items():
             # Start a thread dedicated to get stats for each website
-            periodicCheck = threading.Timer(checkI, self.__getResults, args=[monitor, checkI])
+            periodicCheck = threading.Timer(schedule.checkInterval, self.__getResults, args=[monitor, schedule, self.detectors[websiteURL]])
             periodicCheck.start()
 
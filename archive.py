@@ -0,0 +1,290 @@
+import os
+import json
+import math
+import zlib
+import struct
+from array import array
+from datetime import datetime, timedelta
+import dbutils
+
+"""Module dedicated to the archival of the old monitoring data out of the sqlite database.
+
+    The data points and notifications older than a date are streamed out of the database, in time order,
+    to compressed archive files partitioned by day, then deleted from the database. They can be imported
+    back (into the same or another database) for investigations.
+
+    Each table has its own directory in the archive, containing one file per day (named after the day,
+    YYYY-MM-DD.arc). An archive file is a sequence of blocks of at most BLOCK_ROWS rows, each block being
+    stored by column and compressed with zlib:
+        - the text columns (host, failure, type...) are dictionary encoded,
+        - the timestamps (seconds since epoch) are delta encoded,
+        - the numeric columns are stored as arrays of fixed-width numbers.
+    Files are only appended to, so an archival which runs several times a day appends blocks to the file of the day.
+
+"""
+
+# Encodings of the columns of each archived table, in the order of the rows returned by
+# dbutils.iterExpiredSamples and dbutils.iterExpiredAlerts:
+#   - text: dictionary encoded strings (or None),
+#   - time: delta encoded seconds since epoch,
+#   - int: integers (or None),
+#   - real: floats (or None).
+# Columns are only added at the end: the columns missing from the blocks written by a previous version of the
+# app are decoded as None.
+TABLES = {
+    'website_monitoring': ['text', 'time', 'int', 'int', 'real', 'real', 'real', 'real', 'real', 'real', 'real', 'text', 'int', 'text'],
+    'website_alerts': ['text', 'time', 'text', 'text', 'text', 'real'],
+}
+
+# Maximum number of rows in a block (also the number of rows inserted per transaction by the import)
+BLOCK_ROWS = 65536
+
+# Value of the None integers in the int columns
+NULL_INT = -2 ** 63
+
+# Header of a block: number of rows, and size of the compressed block
+BLOCK_HEADER = struct.Struct('<II')
+
+def encodeBlock(encodings, rows):
+    """Encodes rows into a compressed columnar block.
+
+    Args:
+        encodings (list): Encodings of the columns (see TABLES),
+        rows (list): Rows to encode.
+
+    Returns:
+        The block, as bytes (header included).
+
+    """
+
+    meta = []
+    parts = []
+    for i, encoding in enumerate(encodings):
+        column = [row[i] for row in rows]
+        if encoding == 'text':
+            # The values are replaced by their index in the dictionary of the column
+            dictionary = {}
+            indexes = array('I', (dictionary.setdefault(value, len(dictionary)) for value in column))
+            meta.append(list(dictionary))
+            parts.append(indexes.tobytes())
+        elif encoding == 'time':
+            # The first timestamp, followed by the differences between consecutive timestamps
+            parts.append(array('q', (value - previous for value, previous in zip(column, [0] + column[:-1]))).tobytes())
+        elif encoding == 'int':
+            parts.append(array('q', (int(value) if value is not None else NULL_INT for value in column)).tobytes())
+        else:
+            parts.append(array('d', (value if value is not None else math.nan for value in column)).tobytes())
+
+    # The dictionaries are stored in a JSON header, followed by the arrays
+    header = json.dumps(meta).encode()
+    payload = zlib.compress(struct.pack('<I', len(header)) + header + b''.join(parts), 6)
+    return BLOCK_HEADER.pack(len(rows), len(payload)) + payload
+
+def decodeBlock(encodings, n, payload):
+    """Decodes a compressed columnar block into rows.
+
+    Args:
+        encodings (list): Encodings of the columns (see TABLES),
+        n (int): Number of rows of the block,
+        payload (bytes): Compressed block (without header).
+
+    Returns:
+        A list of rows (tuples).
+
+    """
+
+    data = zlib.decompress(payload)
+    headerSize = struct.unpack_from('<I', data)[0]
+    meta = iter(json.loads(data[4:4 + headerSize]))
+    offset = 4 + headerSize
+
+    columns = []
+    for encoding in encodings:
+        if offset >= len(data):
+            # Column added after the block was written
+            columns.append([None] * n)
+            continue
+
+        values = array('I' if encoding == 'text' else 'q' if encoding in ('time', 'int') else 'd')
+        size = n * values.itemsize
+        values.frombytes(data[offset:offset + size])
+        offset += size
+
+        if encoding == 'text':
+            dictionary = next(meta)
+            columns.append([dictionary[index] for index in values])
+        elif encoding == 'time':
+            timestamps = []
+            timestamp = 0
+            for delta in values:
+                timestamp += delta
+                timestamps.append(timestamp)
+            columns.append(timestamps)
+        elif encoding == 'int':
+            columns.append([value if value != NULL_INT else None for value in values])
+        else:
+            columns.append([value if not math.isnan(value) else None for value in values])
+
+    return list(zip(*columns))
+
+def iterBlocks(path, encodings):
+    """Reads the blocks of an archive file.
+
+    Args:
+        path (str): Path of the archive file,
+        encodings (list): Encodings of the columns of the archived table (see TABLES).
+
+    Yields:
+        Lists of rows, one for each block.
+
+    """
+
+    with open(path, 'rb') as archiveFile:
+        while True:
+            header = archiveFile.read(BLOCK_HEADER.size)
+            if len(header) < BLOCK_HEADER.size:
+                return
+            n, size = BLOCK_HEADER.unpack(header)
+            yield decodeBlock(encodings, n, archiveFile.read(size))
+
+def writePartitions(directory, table, rows):
+    """Writes a stream of rows, in time order, to the daily archive files of a table.
+
+    Args:
+        directory (str): Directory of the archive,
+        table (str): Name of the table (one of TABLES),
+        rows (iterable): Rows to archive, in time order (the timestamp being their second column).
+
+    Returns:
+        The number of rows written.
+
+    """
+
+    encodings = TABLES[table]
+    os.makedirs(os.path.join(directory, table), exist_ok=True)
+
+    count = 0
+    day = None
+    block = []
+
+    def flush():
+        # Append the current block to the file of its day
+        name = '{}.arc'.format(datetime.utcfromtimestamp(day * 86400).strftime('%Y-%m-%d'))
+        with open(os.path.join(directory, table, name), 'ab') as archiveFile:
+            archiveFile.write(encodeBlock(encodings, block))
+            archiveFile.flush()
+            os.fsync(archiveFile.fileno())
+
+    for row in rows:
+        # Number of the day of the row since epoch
+        rowDay = row[1] // 86400
+        if block and (rowDay != day or len(block) >= BLOCK_ROWS):
+            flush()
+            block = []
+        day = rowDay
+        block.append(row)
+        count += 1
+
+    if block:
+        flush()
+    return count
+
+def exportArchive(dbName, directory, before):
+    """Moves the data points and notifications recorded before a date from a database to an archive.
+    The rows are deleted from the database once they are written (and synced) to the archive, so an
+    interrupted export at worst archives some rows twice, and never loses rows.
+
+    Args:
+        dbName (str): Name of the database to use,
+        directory (str): Directory of the archive (created if it does not exist),
+        before (datetime.datetime): Archive the rows recorded before this date (UTC).
+
+    Returns:
+        A tuple containing the numbers of data points and notifications archived.
+
+    """
+
+    # The data points of a previous version of the app are only read once converted (see dbutils.migrateDatabase)
+    dbutils.checkLayout(dbName)
+
+    # Notifications inserted during the export are left in the database (the data points inserted
+    # during the export are recorded after the date)
+    lastAlertRowid = dbutils.maxRowid(dbName, 'website_alerts')
+
+    samples = writePartitions(directory, 'website_monitoring', dbutils.iterExpiredSamples(dbName, before))
+    alerts = writePartitions(directory, 'website_alerts', dbutils.iterExpiredAlerts(dbName, before, lastAlertRowid))
+    dbutils.deleteExpired(dbName, before, lastAlertRowid)
+    return samples, alerts
+
+def iterPartitions(directory, table, since=None, until=None):
+    """Lists the archive files of a table, in time order, optionally only the ones of a date range.
+
+    Args:
+        directory (str): Directory of the archive,
+        table (str): Name of the table (one of TABLES),
+        since (datetime.datetime, optional): Only list the files of the days from this date,
+        until (datetime.datetime, optional): Only list the files of the days before this date.
+
+    Yields:
+        Paths of the archive files.
+
+    """
+
+    tableDirectory = os.path.join(directory, table)
+    if not os.path.isdir(tableDirectory):
+        return
+
+    for name in sorted(os.listdir(tableDirectory)):
+        if not name.endswith('.arc'):
+            continue
+        day = datetime.strptime(name[:-4], '%Y-%m-%d')
+        if (since is not None and day + timedelta(days=1) <= since) or (until is not None and day >= until):
+            continue
+        yield os.path.join(tableDirectory, name)
+
+def importArchive(dbName, directory, since=None, until=None):
+    """Loads archived data points and notifications back into a database, one transaction per block.
+    Whole days are imported: the date range only selects the archive files.
+
+    The notifications of a database are sorted by rowid, so the imported notifications are inserted before the
+    ones of the database, which must all be more recent than them (an archive is imported before the
+    notifications left in the database by its export, or into another database).
+
+    Args:
+        dbName (str): Name of the database to use (its tables are created if they do not exist),
+        directory (str): Directory of the archive,
+        since (datetime.datetime, optional): Only import the days from this date,
+        until (datetime.datetime, optional): Only import the days before this date.
+
+    Returns:
+        A tuple containing the numbers of data points and notifications imported.
+
+    Raises:
+        ValueError: If the database has notifications older than the last imported one (nothing is imported).
+
+    """
+
+    dbutils.initDatabase(dbName)
+
+    def blocks(table):
+        for path in iterPartitions(directory, table, since, until):
+            yield from iterBlocks(path, TABLES[table])
+
+    # Count the notifications to import, and find the last one (the notifications are archived in time order)
+    count = 0
+    last = None
+    for block in blocks('website_alerts'):
+        count += len(block)
+        last = block[-1][1] if block else last
+
+    # The imported notifications take the rowids before the oldest notification of the database
+    firstRowid = None
+    oldest = dbutils.oldestAlert(dbName)
+    if oldest is not None and last is not None:
+        if last > oldest[1]:
+            raise ValueError('The database has notifications older than the archived ones: import the archive into another database')
+        firstRowid = oldest[0] - count
+
+    samples = dbutils.importSamples(dbName, blocks('website_monitoring'))
+    alerts = dbutils.importAlerts(dbName, blocks('website_alerts'), firstRowid)
+    return samples, alerts
@@ -0,0 +1,133 @@
+import re
+
+"""Module dedicated to the content checks of the monitored websites.
+
+    A website can serve an error page with a successful status code: a content check verifies that
+    the body of its responses contains a required string, matches a regular expression, and/or isn't
+    larger than a maximum size. The body is checked chunk by chunk, as it is streamed by the Monitor,
+    and the reading stops as soon as the result is known (the required string and pattern were found,
+    or the body is too large), so the body is never buffered.
+
+"""
+
+# Results of a content check:
+#   - ok: the body passed all the assertions,
+#   - missing: the body doesn't contain the required string,
+#   - mismatch: the body doesn't match the regular expression,
+#   - tooLarge: the body is larger than the maximum size.
+CONTENT_RESULTS = ('ok', 'missing', 'mismatch', 'tooLarge')
+
+# Number of bytes of the end of the body read so far kept to search the regular expression in the next
+# chunk, so that a match spanning two chunks is found (a match longer than this may be missed)
+PATTERN_OVERLAP = 4096
+
+class ContentCheck():
+    """Assertions on the body of the responses of a website, set in the configuration file:
+    {
+        "contains": <string which must be in the body (str, optional)>,
+        "matches": <regular expression which must match a part of the body (str, optional)>,
+        "maxBodySize": <maximum size of the body, in bytes (int, optional)>
+    }
+    The string and the regular expression are encoded in UTF-8, and searched in the raw body.
+
+    Attributes:
+        contains (bytes): String which must be in the body (None for no assertion),
+        pattern (re.Pattern): Regular expression which must match a part of the body (None for no assertion),
+        maxBodySize (int): Maximum size of the body, in bytes (None for no limit).
+
+    """
+
+    def __init__(self, contains=None, matches=None, maxBodySize=None):
+        """Sets the assertions as speficied in the parameters.
+
+        Args:
+            contains (str, optional): String which must be in the body,
+            matches (str, optional): Regular expression which must match a part of the body,
+            maxBodySize (int, optional): Maximum size of the body, in bytes.
+
+        """
+
+        self.contains = contains.encode() if contains else None
+        self.pattern = re.compile(matches.encode()) if matches is not None else None
+        self.maxBodySize = maxBodySize
+
+    def start(self):
+        """Starts checking the body of a response.
+
+        Returns:
+            A ContentEvaluation, to be fed with the chunks of the body.
+
+        """
+
+        return ContentEvaluation(self)
+
+class ContentEvaluation():
+    """Incremental evaluation of a content check over the body of a response, fed chunk by chunk.
+    Only the end of the body read so far is kept, to find the matches spanning two chunks.
+
+    Attributes:
+        check (ContentCheck): Content check evaluated,
+        bodyBytes (int): Number of bytes of the body read so far,
+        found (bool): Whether the required string was found (True if there is none),
+        matched (bool): Whether the regular expression matched (True if there is none),
+        tail (bytes): End of the body read so far, not searched yet for the required string,
+        patternTail (bytes): End of the body read so far, not searched yet for the regular expression.
+
+    """
+
+    def __init__(self, check):
+        self.check = check
+        self.bodyBytes = 0
+        self.found = check.contains is None
+        self.matched = check.pattern is None
+        self.tail = b''
+        self.patternTail = b''
+
+    def feed(self, chunk):
+        """Checks the next chunk of the body.
+
+        Args:
+            chunk (bytes): Next chunk of the body.
+
+        Returns:
+            The result of the check (one of CONTENT_RESULTS) if it is known without reading the rest of the body, None otherwise.
+
+        """
+
+        self.bodyBytes += len(chunk)
+        if self.check.maxBodySize is not None and self.bodyBytes > self.check.maxBodySize:
+            return 'tooLarge'
+
+        if not self.found:
+            data = self.tail + chunk
+            self.found = self.check.contains in data
+            # A match spanning this chunk and the next ones starts in the last len(contains) - 1 bytes read (which
+            # may span several chunks shorter than the string)
+            keep = len(self.check.contains) - 1
+            self.tail = data[-keep:] if not self.found and keep > 0 else b''
+
+        if not self.matched:
+            data = self.patternTail + chunk
+            self.matched = self.check.pattern.search(data) is not None
+            self.patternTail = data[-PATTERN_OVERLAP:] if not self.matched else b''
+
+        # The size of the body is only known at its end
+        if self.found and self.matched and self.check.maxBodySize is None:
+            return 'ok'
+        return None
+
+    def result(self):
+        """Returns the result of the check, at the end of the body (or of the part of the body read).
+
+        Returns:
+            The result of the check (one of CONTENT_RESULTS).
+
+        """
+
+        if self.check.maxBodySize is not None and self.bodyBytes > self.check.maxBodySize:
+            return 'tooLarge'
+        if not self.found:
+            return 'missing'
+        if not self.matched:
+            return 'mismatch'
+        return 'ok'
@@ -1,4 +1,5 @@
 import sqlite3
+from datetime import datetime
 
 """Module dedicated to the interaction with a sqlite database.
 
@@ -6,8 +7,51 @@ import sqlite3
     but as sqlite connections are only usable by a single thread, we would have
     to create an instance of DatabaseConnection for each thread.
 
+    The data points are stored in a compact layout: the host names are stored once, in the website_hosts
+    dictionary table, and the website_samples table stores the id of the host and the timestamp as integers
+    (seconds since epoch). website_samples is a WITHOUT ROWID table clustered on (hostId, timestamp, seq), so
+    that the data points of a host are stored together, in time order. The website_monitoring view gives
+    the data points in the format of the previous versions of the app (host name and text timestamp).
+
 """
 
+# Number of rows fetched at a time by the streaming queries
+BATCH_SIZE = 500
+
+# Columns of the website_monitoring view (and of the website_monitoring table of the previous versions of
+# the app, which is converted by migrateDatabase), with their types
+SAMPLE_COLUMNS = [
+    ('host', 'text'),
+    ('timestamp', 'text'),
+    ('available', 'integer'),
+    ('status', 'integer'),
+    ('responseTime', 'real'),
+    ('transferTime', 'real'),
+    ('dnsTime', 'real'),
+    ('connectTime', 'real'),
+    ('tlsTime', 'real'),
+    ('firstByteTime', 'real'),
+    ('downloadTime', 'real'),
+    ('failure', 'text'),
+    ('bodyBytes', 'integer'),
+    ('contentCheck', 'text'),
+]
+
+# Columns of the data points containing the durations of the phases of the requests
+PHASE_COLUMNS = ['dnsTime', 'connectTime', 'tlsTime', 'firstByteTime', 'downloadTime']
+
+# Columns of the data points stored in the website_samples table after the host id, timestamp and seq
+# (seq numbers the data points of a host recorded during the same second, usually 0)
+VALUE_COLUMNS = SAMPLE_COLUMNS[2:]
+
+# Values of a data point selected from website_samples (aliased s) joined with website_hosts (aliased h),
+# in the order of SAMPLE_COLUMNS
+SAMPLE_SELECT = "h.host, datetime(s.timestamp, 'unixepoch'), {}".format(', '.join('s.' + name for name, _ in VALUE_COLUMNS))
+
+# Timestamp of a notification ("%d/%m/%Y %H:%M:%S") rewritten in the sortable "%Y-%m-%d %H:%M:%S" format,
+# used to filter the notifications by date (with an index on this expression)
+ALERT_TIME = "substr(timestamp, 7, 4) || '-' || substr(timestamp, 4, 2) || '-' || substr(timestamp, 1, 2) || substr(timestamp, 11)"
+
 def initConnection(dbName):
     """Creates a connection and cursor object for the the given database.
 
@@ -25,14 +69,39 @@ def initConnection(dbName):
     cursor = connection.cursor()
     return connection, cursor
 
+def checkLayout(dbName):
+    """Checks that the data points of a database are stored in the compact layout.
+    The data points stored by a previous version of the app are only converted on request (see migrateDatabase),
+    as the conversion locks the database for a long time.
+
+    Args:
+        dbName (str): Name of the database to use.
+
+    Raises:
+        ValueError: If the database still has the website_monitoring table of a previous version of the app.
+
+    """
+
+    connection, cursor = initConnection(dbName)
+    cursor.execute("SELECT type FROM sqlite_master WHERE name = 'website_monitoring'")
+    legacy = cursor.fetchone() == ('table',)
+    connection.close()
+    if legacy:
+        raise ValueError('The database {} was created by a previous version of the app, convert it first with --migrate'.format(dbName))
+
 def initDatabase(dbName):
-    """Creates the database tables website_alerts and website_monitoring (if they do not exist).
+    """Creates the database tables website_alerts, website_hosts and website_samples (if they do not exist).
 
     Args:
         dbName (str): Name of the database to use.
 
+    Raises:
+        ValueError: If the data points of the database need to be converted first (see checkLayout).
+
     """
 
+    checkLayout(dbName)
+
     # Initialize the database connection
     connection, cursor = initConnection(dbName)
 
@@ -40,16 +109,103 @@ def initDatabase(dbName):
     cursor.execute("CREATE TABLE IF NOT EXISTS website_alerts \
          (host text, timestamp text, type text, startDate text, endDate text, availability real)")
 
-    # Create the website_monitoring table
-    cursor.execute("CREATE TABLE IF NOT EXISTS website_monitoring \
-         (host text, timestamp text, available integer, status integer, responseTime real)")
+    # Create the data points tables and view
+    createSampleTables(cursor)
+
+    # Create the indexes used by the notifications queries (see queryLastAlerts and pageAlerts)
+    cursor.execute("CREATE INDEX IF NOT EXISTS website_alerts_host ON website_alerts (host)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS website_alerts_host_type ON website_alerts (host, type)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS website_alerts_time ON website_alerts ({})".format(ALERT_TIME))
 
     # Save the changes to the database
     connection.commit()
     connection.close()
 
+def createSampleTables(cursor):
+    """Creates the website_hosts and website_samples tables and the website_monitoring view (if they do not exist).
+    The columns missing from a website_samples table created by a previous version of the app are added (and the
+    view is rebuilt with them). The view is not created if the database still has the website_monitoring table
+    of a previous version of the app.
+
+    Args:
+        cursor (sqlite3.Cursor): Cursor of the database to use.
+
+    """
+
+    cursor.execute("CREATE TABLE IF NOT EXISTS website_hosts (id integer PRIMARY KEY, host text UNIQUE)")
+    cursor.execute("CREATE TABLE IF NOT EXISTS website_samples (hostId integer, timestamp integer, seq integer, {}, \
+            PRIMARY KEY (hostId, timestamp, seq)) WITHOUT ROWID".format(
+        ', '.join('{} {}'.format(name, columnType) for name, columnType in VALUE_COLUMNS)))
+
+    # Index used by the queries over all the hosts (see aggregateAllSamples)
+    cursor.execute("CREATE INDEX IF NOT EXISTS website_samples_timestamp ON website_samples (timestamp)")
+
+    existingColumns = [column[1] for column in cursor.execute("PRAGMA table_info(website_samples)")]
+    missingColumns = [(name, columnType) for name, columnType in VALUE_COLUMNS if name not in existingColumns]
+    for name, columnType in missingColumns:
+        cursor.execute("ALTER TABLE website_samples ADD COLUMN {} {}".format(name, columnType))
+
+    cursor.execute("SELECT type FROM sqlite_master WHERE name = 'website_monitoring'")
+    existing = cursor.fetchone()
+    if existing == ('view',) and missingColumns:
+        cursor.execute("DROP VIEW website_monitoring")
+        existing = None
+    if existing is None:
+        cursor.execute("CREATE VIEW website_monitoring ({}) AS SELECT {} \
+                FROM website_samples s JOIN website_hosts h ON h.id = s.hostId".format(
+            ', '.join(name for name, _ in SAMPLE_COLUMNS), SAMPLE_SELECT))
+
+def migrateDatabase(dbName, vacuum=True):
+    """Converts the website_monitoring table of a previous version of the app to the compact layout, in a single
+    transaction (the table is then replaced by the website_monitoring view).
+    The data points without a valid timestamp are dropped.
+
+    Args:
+        dbName (str): Name of the database to convert,
+        vacuum (bool, optional): Whether to rebuild the database file afterwards, to give the freed space back.
+
+    Returns:
+        The number of data points converted (None if the database doesn't need to be converted).
+
+    """
+
+    connection, cursor = initConnection(dbName)
+    try:
+        cursor.execute("SELECT type FROM sqlite_master WHERE name = 'website_monitoring'")
+        if cursor.fetchone() != ('table',):
+            return None
+
+        # Add the columns missing from a table created by an even older version of the app
+        existingColumns = [column[1] for column in cursor.execute("PRAGMA table_info(website_monitoring)")]
+        for name, columnType in SAMPLE_COLUMNS:
+            if name not in existingColumns:
+                cursor.execute("ALTER TABLE website_monitoring ADD COLUMN {} {}".format(name, columnType))
+
+        createSampleTables(cursor)
+        cursor.execute("INSERT OR IGNORE INTO website_hosts (host) SELECT DISTINCT host FROM website_monitoring")
+
+        # The data points are inserted in the order of the primary key, so that the table is written sequentially
+        cursor.execute("INSERT INTO website_samples (hostId, timestamp, seq, {0}) \
+                SELECT hostId, timestamp, ROW_NUMBER() OVER (PARTITION BY hostId, timestamp ORDER BY rowid) - 1, {0} \
+                FROM (SELECT h.id AS hostId, CAST(strftime('%s', m.timestamp) AS INTEGER) AS timestamp, m.rowid AS rowid, {1} \
+                    FROM website_monitoring m JOIN website_hosts h ON h.host = m.host \
+                    WHERE strftime('%s', m.timestamp) IS NOT NULL) \
+                ORDER BY hostId, timestamp, rowid".format(
+            ', '.join(name for name, _ in VALUE_COLUMNS), ', '.join('m.' + name for name, _ in VALUE_COLUMNS)))
+        count = cursor.rowcount
+
+        cursor.execute("DROP TABLE website_monitoring")
+        createSampleTables(cursor)
+        connection.commit()
+
+        if vacuum:
+            cursor.execute("VACUUM")
+        return count
+    finally:
+        connection.close()
+
 def dropTables(dbName):
-    """Drop the database tables website_alerts and website_monitoring.
+    """Drop the database tables website_alerts, website_hosts and website_samples.
 
     Args:
         dbName (str): Name of the database to use.
@@ -62,181 +218,601 @@ def dropTables(dbName):
     # Drop the website_alerts table
     cursor.execute("DROP TABLE IF EXISTS website_alerts")
 
-    # Drop the website_monitoring table
-    cursor.execute("DROP TABLE IF EXISTS website_monitoring")
+    # Drop the data points view and tables (or the website_monitoring table of a previous version of the app)
+    cursor.execute("SELECT type FROM sqlite_master WHERE name = 'website_monitoring'")
+    legacy = cursor.fetchone()
+    if legacy is not None:
+        cursor.execute("DROP {} website_monitoring".format(legacy[0].upper()))
+    cursor.execute("DROP TABLE IF EXISTS website_samples")
+    cursor.execute("DROP TABLE IF EXISTS website_hosts")
 
     # Save the changes to the database
     connection.commit()
     connection.close()
 
-def insertValue(dbName, table, data):
-    """Insert given value set into a given table.
+def hostId(cursor, host):
+    """Get the id of a host in the website_hosts table, adding the host to the table if it is new.
+
+    Args:
+        cursor (sqlite3.Cursor): Cursor of the database to use,
+        host (str): Name of the website.
+
+    Returns:
+        The id of the host.
+
+    """
+
+    cursor.execute("INSERT OR IGNORE INTO website_hosts (host) VALUES (?)", (host,))
+    cursor.execute("SELECT id FROM website_hosts WHERE host = ?", (host,))
+    return cursor.fetchone()[0]
+
+def sampleInsertion(timestamp):
+    """Returns the statement inserting a data point into website_samples, from its host id, its timestamp and its
+    VALUE_COLUMNS. The seq of the data point is the number of data points of the host stored for the same second.
+
+    Args:
+        timestamp (str): SQL expression of the timestamp of the data point in seconds since epoch, from the ?2 parameter.
+
+    Returns:
+        The statement.
+
+    """
+
+    return "INSERT INTO website_samples (hostId, timestamp, seq, {1}) \
+            SELECT ?1, {0}, (SELECT COUNT(*) FROM website_samples WHERE hostId = ?1 AND timestamp = {0}), {2}".format(
+        timestamp, ', '.join(name for name, _ in VALUE_COLUMNS), ', '.join('?' for _ in VALUE_COLUMNS))
+
+# Inserts a data point with a text timestamp (see insertSample)
+INSERT_SAMPLE = sampleInsertion("CAST(strftime('%s', ?2) AS INTEGER)")
+
+# Inserts a data point with a timestamp in seconds since epoch (see importSamples)
+INSERT_ARCHIVED_SAMPLE = sampleInsertion('?2')
+
+def insertSample(dbName, data):
+    """Insert a data point into the website_samples table.
 
     Args:
         dbName (str): Name of the database to use,
-        table (str): Name of the table to modify,
-        data (dict): Dictionary containing the data to insert. The data itself depends on what table is modified:
-            - if table == "website_monitoring":
-                timestamp (str): String representing the date at which the measurement was taken,
-                host (str): Name of the monitored website,
-                available (bool): Stores whether the site is available or not,
-                status (int): Response status code of the site,
-                responseTime (float): Time the site took to answer a request.
-            - if table == "website_alerts":
-                timestamp (str): String representing the date at which the measurement was taken,
-                host (str): Name of the monitored website,
-                type (str): Type of notification,
-                startDate (str): String representing the date of start of the alert,
-                endDate (str, optional): String representing the date of end of the alert,
-                availability (float): Availability of the website.
+        data (dict): Dictionary containing the data to insert:
+            timestamp (str): String representing the date at which the measurement was taken,
+            host (str): Name of the monitored website,
+            available (bool): Stores whether the site is available or not,
+            status (int): Response status code of the site,
+            responseTime (float): Time the site took to answer a request (time to first byte),
+            transferTime (float, optional): Time the site took to answer a request and send the (read part of the) body,
+            dnsTime, connectTime, tlsTime, firstByteTime, downloadTime (float, optional): Durations of the phases of the request,
+            failure (str, optional): Class of the failure of the request, if it didn't get a response.
 
     """
 
     # Initialize the database connection
     connection, cursor = initConnection(dbName)
 
-    if table == 'website_alerts':
-        # If the insertion concerns the website_alerts table
-        # Get the relevant fields in order
-        fields = (data['host'], data['timestamp'], data['type'], data['startDate'], data['endDate'], data['availability'])
+    # Get the relevant fields in order (the optional ones default to None)
+    fields = (hostId(cursor, data['host']), data['timestamp']) + tuple(data.get(name) for name, _ in VALUE_COLUMNS)
 
-        # Insert the data in the database
-        cursor.execute("INSERT INTO website_alerts VALUES (?, ?, ?, ?, ?, ?)", fields)
+    # Insert the data in the database and save the changes
+    cursor.execute(INSERT_SAMPLE, fields)
+    connection.commit()
+    connection.close()
 
-        # Save the changes to the database
-        connection.commit()
+def insertAlert(dbName, data):
+    """Insert a notification into the website_alerts table.
 
-    if table == 'website_monitoring':
-        # If the insertion concerns the website_monitoring table
-        # Get the relevant fields in order
-        fields = (data['host'], data['timestamp'], data['available'], data['status'], data['responseTime'])
+    Args:
+        dbName (str): Name of the database to use,
+        data (dict): Dictionary containing the data to insert:
+            timestamp (str): String representing the date at which the measurement was taken,
+            host (str): Name of the monitored website,
+            type (str): Type of notification,
+            startDate (str): String representing the date of start of the alert,
+            endDate (str, optional): String representing the date of end of the alert,
+            availability (float): Availability of the website.
 
-        # Insert the data in the database
-        cursor.execute("INSERT INTO website_monitoring VALUES (?, ?, ?, ?, ?)", fields)
+    """
 
-        # Save the changes to the database
-        connection.commit()
+    # Initialize the database connection
+    connection, cursor = initConnection(dbName)
+
+    # Get the relevant fields in order
+    fields = (data['host'], data['timestamp'], data['type'], data['startDate'], data['endDate'], data['availability'])
+
+    # Insert the data in the database and save the changes
+    cursor.execute("INSERT INTO website_alerts VALUES (?, ?, ?, ?, ?, ?)", fields)
+    connection.commit()
     connection.close()
 
-def queryLastValue(dbName, table, queryData):
-    """Get the most recent value in a table for a host.
+def queryLastAlert(dbName, host, types=('alert', 'recovery')):
+    """Get the most recent notification of some types about a host.
 
     Args:
         dbName (str): Name of the database to use,
-        table (str): Name of the table to query,
-        data (dict): Dictionary containing the parameters of the query:
-            host (str): Name of the website the query is about.
+        host (str): Name of the website the query is about,
+        types (tuple, optional): Types of the notifications to consider.
 
     Returns:
-        A tuple containing the retrieved data (which may be empty). Its content depends on the queried table:
-            - if table == "website_alerts":
-                (<timestamp (str)>, <host (str)>, <type (str)>, <startDate (str)>, <endDate (str)>, <availability (float)>)
-            - if table == "website_monitoring":
-                (<timestamp (str)>, <available (bool)>, <status (int)>, <responseTime (float)>)
+        A tuple (<timestamp (str)>, <host (str)>, <type (str)>, <startDate (str)>, <endDate (str)>, <availability (float)>),
+        or None if there is no notification about the host.
 
     """
 
     # Initialize the database connection
     connection, cursor = initConnection(dbName)
 
-    if table == 'website_alerts':
-        # If the query concerns the website_alerts table
-        # Get the host
-        fields = (queryData['host'],)
+    # Query the database
+    cursor.execute('SELECT timestamp, host, type, startDate, endDate, availability FROM website_alerts \
+            WHERE host = ? AND type IN ({}) \
+            ORDER BY rowid DESC LIMIT 1'.format(', '.join('?' for _ in types)), (host,) + tuple(types))
 
-        # Query the database
-        cursor.execute('SELECT timestamp, host, type, startDate, endDate, availability FROM website_alerts \
-                WHERE host = ? \
-                ORDER BY timestamp DESC LIMIT 1', fields)
+    # Returns the gathered data (which is only one row)
+    result = cursor.fetchone()
+    connection.close()
+    return result
 
-        # Returns the gathered data (which is only one row)
-        result = cursor.fetchone()
-        connection.close()
-        return result
+def queryLastAlerts(dbName, types=('alert', 'recovery')):
+    """Get the most recent notification of some types about each host, with a single query.
 
-    if table == 'website_monitoring':
-        # If the query concerns the website_monitoring table
-        # Get the host
-        fields = (queryData['host'],)
+    Args:
+        dbName (str): Name of the database to use,
+        types (tuple, optional): Types of the notifications to consider.
 
-        # Query the database
-        cursor.execute("SELECT timestamp, available, status, responseTime FROM website_monitoring \
-                WHERE host = ? \
-                ORDER BY timestamp DESC LIMIT 1", fields)
+    Returns:
+        An iterator over tuples (<timestamp (str)>, <host (str)>, <type (str)>, <startDate (str)>, <endDate (str)>,
+        <availability (float)>), one for each host having notifications.
+
+    """
+
+    # The notifications are sorted by rowid, so the most recent one about a host is the one with the greatest
+    # rowid. The hosts are listed by skipping from one host to the next in the host index, and the greatest rowid
+    # of each host is found in the (host, type) index, so the query does a few index lookups per host instead of
+    # reading the whole history
+    return iterRows(dbName, 'WITH RECURSIVE hosts(host) AS ( \
+                SELECT MIN(host) FROM website_alerts \
+                UNION ALL SELECT (SELECT MIN(host) FROM website_alerts WHERE host > hosts.host) FROM hosts WHERE hosts.host IS NOT NULL) \
+            SELECT timestamp, host, type, startDate, endDate, availability FROM website_alerts \
+            WHERE rowid IN (SELECT (SELECT MAX(rowid) FROM website_alerts WHERE host = hosts.host AND type IN ({})) \
+                FROM hosts WHERE hosts.host IS NOT NULL)'.format(', '.join('?' for _ in types)), tuple(types))
+
+def iterRows(dbName, query, fields=(), batchSize=BATCH_SIZE):
+    """Executes a query and returns its results as a stream of rows.
+    Rows are fetched from the database in batches of batchSize rows, so that the memory used
+    does not depend on the number of rows matched by the query.
+
+    Args:
+        dbName (str): Name of the database to use,
+        query (str): SQL query to execute,
+        fields (tuple, optional): Parameters of the query,
+        batchSize (int, optional): Number of rows fetched from the database at a time.
 
-        # Returns the gathered data (which is only one row)
-        result = cursor.fetchone()
+    Yields:
+        Tuples containing the retrieved data.
+
+    """
+
+    # Initialize the database connection
+    connection, cursor = initConnection(dbName)
+
+    try:
+        # Query the database
+        cursor.execute(query, fields)
+
+        # Yield the results batch by batch, until the cursor is exhausted
+        rows = cursor.fetchmany(batchSize)
+        while rows:
+            yield from rows
+            rows = cursor.fetchmany(batchSize)
+    finally:
+        # Close the connection even if the consumer stops iterating before the end
         connection.close()
-        return result
 
-def queryValues(dbName, table, queryData):
-    """Get the values in a table.
-    The query can be global or for a host, optionally only for the past few minutes or since a given date.
+def sqlDate(date):
+    """Converts a date to a time value usable by the sqlite date functions.
+
+    Args:
+        date (datetime.datetime): UTC date to convert, or None for the current date.
+
+    Returns:
+        A string representing the date.
+
+    """
+
+    if date is None:
+        return 'now'
+    return date.strftime('%Y-%m-%d %H:%M:%S')
+
+def windowStart(minutes):
+    """Returns the SQL expression of the start of a window of data points (in seconds since epoch), from its end
+    (the date parameter of the query, see sqlDate).
+
+    Args:
+        minutes (int): Duration of the window, in minutes.
+
+    Returns:
+        The SQL expression, to compare with the timestamp column of the website_samples table.
+
+    """
+
+    return "CAST(strftime('%s', ?, '-{:d} minutes') AS INTEGER)".format(minutes)
+
+def iterSamples(dbName, host, minutes, now=None, batchSize=BATCH_SIZE):
+    """Get the data points of a host recorded during the past few minutes, as a stream of rows.
 
     Args:
         dbName (str): Name of the database to use,
-        table (str): Name of the table to query,
-        data (dict): Dictionary containing the parameters of the query:
-            host (str, optional): Name of the website the query is about,
-            startDate (str, optional): Restricts the query to results which timestamp are after this date,
-            minutes (int, optional): Restricts the query to results which timestamp is less than this number of minutes old.
+        host (str): Name of the website the query is about,
+        minutes (int): Restricts the query to results which timestamp is less than this number of minutes old,
+        now (datetime.datetime, optional): Current UTC date (defaults to the database's current date),
+        batchSize (int, optional): Number of rows fetched from the database at a time.
 
     Returns:
-        An array of tuples containing the retrieved data (which may be empty). Its content depends on the queried table:
-            - if table == "website_alerts":
-                [(<timestamp (str)>, <host (str)>, <type (str)>, <startDate (str)>, <endDate (str)>, <availability (float)>)]
-            - if table == "website_monitoring":
-                [(<timestamp (str)>, <available (bool)>, <status (int)>, <responseTime (float)>)]
+        An iterator over tuples (<timestamp (str)>, <available (bool)>, <status (int)>, <responseTime (float)>,
+        <transferTime (float)>, <dnsTime (float)>, <connectTime (float)>, <tlsTime (float)>, <firstByteTime (float)>,
+        <downloadTime (float)>, <failure (str)>), in ascending timestamp order.
+
+    """
+
+    # The data points of the host are read in order from the primary key
+    return iterRows(dbName, "SELECT datetime(timestamp, 'unixepoch'), {} FROM website_samples \
+            WHERE hostId = (SELECT id FROM website_hosts WHERE host = ?) AND timestamp > {} \
+            ORDER BY timestamp ASC, seq ASC".format(', '.join(name for name, _ in VALUE_COLUMNS), windowStart(minutes)),
+        (host, sqlDate(now)), batchSize)
+
+def iterAllSamples(dbName, minutes, now=None, batchSize=BATCH_SIZE):
+    """Get the data points of every host recorded during the past few minutes, as a stream of rows, with a single query.
+
+    Args:
+        dbName (str): Name of the database to use,
+        minutes (int): Restricts the query to results which timestamp is less than this number of minutes old,
+        now (datetime.datetime, optional): Current UTC date (defaults to the database's current date),
+        batchSize (int, optional): Number of rows fetched from the database at a time.
+
+    Returns:
+        An iterator over tuples (<host (str)>, <timestamp (str)>, <available (bool)>, <status (int)>, <responseTime (float)>,
+        <transferTime (float)>, <dnsTime (float)>, <connectTime (float)>, <tlsTime (float)>, <firstByteTime (float)>,
+        <downloadTime (float)>, <failure (str)>), in ascending timestamp order.
+
+    """
+
+    # The window is found with the timestamp index
+    return iterRows(dbName, "SELECT {} FROM website_samples s JOIN website_hosts h ON h.id = s.hostId \
+            WHERE s.timestamp > {} \
+            ORDER BY s.timestamp ASC".format(SAMPLE_SELECT, windowStart(minutes)), (sqlDate(now),), batchSize)
+
+def iterSamplesBetween(dbName, since=None, until=None, batchSize=BATCH_SIZE):
+    """Get the data points of every host recorded between two dates, as a stream of rows, with a single query.
+
+    Args:
+        dbName (str): Name of the database to use,
+        since (datetime.datetime, optional): Only get the data points recorded from this date,
+        until (datetime.datetime, optional): Only get the data points recorded before this date,
+        batchSize (int, optional): Number of rows fetched from the database at a time.
+
+    Returns:
+        An iterator over tuples in the format of iterAllSamples, in ascending timestamp order.
+
+    """
+
+    conditions = []
+    fields = []
+    if since is not None:
+        conditions.append("s.timestamp >= CAST(strftime('%s', ?) AS INTEGER)")
+        fields.append(sqlDate(since))
+    if until is not None:
+        conditions.append("s.timestamp < CAST(strftime('%s', ?) AS INTEGER)")
+        fields.append(sqlDate(until))
+
+    return iterRows(dbName, "SELECT {} FROM website_samples s JOIN website_hosts h ON h.id = s.hostId \
+            {} ORDER BY s.timestamp ASC".format(SAMPLE_SELECT, 'WHERE ' + ' AND '.join(conditions) if conditions else ''),
+        tuple(fields), batchSize)
+
+# Aggregates computed by the database over a group of data points (see aggregateSamples)
+AGGREGATE_COLUMNS = 'available, status, failure, COUNT(*), COUNT(responseTime), TOTAL(responseTime), \
+        MIN(responseTime), MAX(responseTime), {}'.format(', '.join('COUNT({0}), TOTAL({0})'.format(column) for column in PHASE_COLUMNS))
+
+def groupPhases(row):
+    """Groups the phases columns of an aggregated row by (count, sum) pairs.
+
+    Args:
+        row (tuple): Row of AGGREGATE_COLUMNS.
+
+    Returns:
+        A tuple (<available (bool)>, <status (int)>, <failure (str)>, <count (int)>, <number of response times (int)>,
+        <sum of response times (float)>, <min response time (float)>, <max response time (float)>, <phases (tuple)>).
+
+    """
+
+    return row[:8] + (tuple(zip(row[8::2], row[9::2])),)
+
+def aggregateSamples(dbName, host, minutes, now=None):
+    """Get the aggregates of the data points of a host recorded during the past few minutes.
+    The aggregation is done by the database, which only returns one row per (available, status) pair.
+
+    Args:
+        dbName (str): Name of the database to use,
+        host (str): Name of the website the query is about,
+        minutes (int): Restricts the query to results which timestamp is less than this number of minutes old,
+        now (datetime.datetime, optional): Current UTC date (defaults to the database's current date).
+
+    Returns:
+        An array of tuples (<available (bool)>, <status (int)>, <failure (str)>, <count (int)>, <number of response times (int)>,
+        <sum of response times (float)>, <min response time (float)>, <max response time (float)>,
+        <phases (tuple)>), phases being a (<number of durations (int)>, <sum of durations (float)>) tuple
+        for each of the PHASE_COLUMNS.
+
+    """
+
+    rows = iterRows(dbName, "SELECT {} FROM website_samples \
+            WHERE hostId = (SELECT id FROM website_hosts WHERE host = ?) AND timestamp > {} \
+            GROUP BY available, status, failure".format(AGGREGATE_COLUMNS, windowStart(minutes)), (host, sqlDate(now)))
+
+    # Group the phases columns by pairs
+    return [groupPhases(row) for row in rows]
+
+def aggregateAllSamples(dbName, minutes, now=None):
+    """Get the aggregates of the data points of every host recorded during the past few minutes, with a single query.
+    The window is found with the timestamp index, and the aggregation is done by the database.
+
+    Args:
+        dbName (str): Name of the database to use,
+        minutes (int): Restricts the query to results which timestamp is less than this number of minutes old,
+        now (datetime.datetime, optional): Current UTC date (defaults to the database's current date).
+
+    Returns:
+        An iterator over tuples (<host (str)>, <group (tuple)>), group being a tuple in the format returned by aggregateSamples.
+
+    """
+
+    # The data points are grouped by host id, and the names of the hosts are only looked up once per group
+    rows = iterRows(dbName, "SELECT h.host, g.* FROM (SELECT hostId, {} FROM website_samples \
+                WHERE timestamp > {} \
+                GROUP BY hostId, available, status, failure) g \
+            JOIN website_hosts h ON h.id = g.hostId".format(AGGREGATE_COLUMNS, windowStart(minutes)), (sqlDate(now),))
+
+    return ((row[0], groupPhases(row[2:])) for row in rows)
+
+def iterAlerts(dbName, startDate=None, batchSize=BATCH_SIZE):
+    """Get the notifications, optionally only the ones after a given date, as a stream of rows.
+
+    Args:
+        dbName (str): Name of the database to use,
+        startDate (str, optional): Restricts the query to results which timestamp are after this date
+            (in the "%d/%m/%Y %H:%M:%S" format),
+        batchSize (int, optional): Number of rows fetched from the database at a time.
+
+    Returns:
+        An iterator over tuples (<timestamp (str)>, <host (str)>, <type (str)>, <startDate (str)>, <endDate (str)>,
+        <availability (float)>), in ascending time order.
+
+    """
+
+    # The notifications are inserted in time order, so they are sorted by rowid
+    # (their timestamps, in the "%d/%m/%Y %H:%M:%S" format, do not sort chronologically: they are compared as ALERT_TIME)
+    if startDate is not None:
+        # If a startDate was defined (by an alertChecker, for example), only query the notifications after it
+        return iterRows(dbName, "SELECT timestamp, host, type, startDate, endDate, availability FROM website_alerts \
+                WHERE {} > ? \
+                ORDER BY rowid ASC".format(ALERT_TIME), (sqlDate(datetime.strptime(startDate, '%d/%m/%Y %H:%M:%S')),), batchSize)
+
+    # If nothing was precised, query the databse for all available data
+    return iterRows(dbName, "SELECT timestamp, host, type, startDate, endDate, availability FROM website_alerts \
+            ORDER BY rowid ASC", (), batchSize)
+
+def pageAlerts(dbName, limit, beforeId=None, host=None, since=None, until=None):
+    """Get a page of the most recent notifications, optionally filtered by host and date.
+    The page is read backwards from the end of the table (or from beforeId) with the rowid and the indexes,
+    so the time it takes doesn't depend on the size of the history.
+
+    Args:
+        dbName (str): Name of the database to use,
+        limit (int): Maximum number of notifications in the page,
+        beforeId (int, optional): Only get the notifications older than the one with this id (to get the next page),
+        host (str, optional): Only get the notifications about this host,
+        since (datetime.datetime, optional): Only get the notifications from this date,
+        until (datetime.datetime, optional): Only get the notifications before this date.
+
+    Returns:
+        An array of tuples (<id (int)>, <timestamp (str)>, <host (str)>, <type (str)>, <startDate (str)>, <endDate (str)>,
+        <availability (float)>), in descending time order.
+
+    """
+
+    # Build the filters of the query
+    conditions = []
+    fields = []
+    if beforeId is not None:
+        conditions.append('rowid < ?')
+        fields.append(beforeId)
+    if host is not None:
+        conditions.append('host = ?')
+        fields.append(host)
+    if since is not None:
+        conditions.append('{} >= ?'.format(ALERT_TIME))
+        fields.append(sqlDate(since))
+    if until is not None:
+        conditions.append('{} < ?'.format(ALERT_TIME))
+        fields.append(sqlDate(until))
+
+    return list(iterRows(dbName, "SELECT rowid, timestamp, host, type, startDate, endDate, availability FROM website_alerts \
+            {} ORDER BY rowid DESC LIMIT ?".format('WHERE ' + ' AND '.join(conditions) if conditions else ''),
+            tuple(fields) + (limit,)))
+
+def iterAlertsAfter(dbName, afterId, host=None, batchSize=BATCH_SIZE):
+    """Get the notifications recorded after a given notification, as a stream of rows.
+
+    Args:
+        dbName (str): Name of the database to use,
+        afterId (int): Only get the notifications more recent than the one with this id (0 for all of them),
+        host (str, optional): Only get the notifications about this host,
+        batchSize (int, optional): Number of rows fetched from the database at a time.
+
+    Returns:
+        An iterator over tuples (<id (int)>, <timestamp (str)>, <host (str)>, <type (str)>, <startDate (str)>,
+        <endDate (str)>, <availability (float)>), in ascending time order.
+
+    """
+
+    if host is not None:
+        return iterRows(dbName, "SELECT rowid, timestamp, host, type, startDate, endDate, availability FROM website_alerts \
+                WHERE rowid > ? AND host = ? \
+                ORDER BY rowid ASC", (afterId, host), batchSize)
+
+    return iterRows(dbName, "SELECT rowid, timestamp, host, type, startDate, endDate, availability FROM website_alerts \
+            WHERE rowid > ? \
+            ORDER BY rowid ASC", (afterId,), batchSize)
+
+def maxRowid(dbName, table):
+    """Get the greatest rowid of a table.
+
+    Args:
+        dbName (str): Name of the database to use,
+        table (str): Name of the table (website_alerts).
+
+    Returns:
+        The greatest rowid (0 if the table is empty).
 
     """
 
-    # Initialize the database connection
     connection, cursor = initConnection(dbName)
+    cursor.execute('SELECT MAX(rowid) FROM {}'.format(table))
+    result = cursor.fetchone()[0]
+    connection.close()
+    return result or 0
 
-    if table == 'website_alerts':
-        # If the query concerns the website_alerts table
+def oldestAlert(dbName):
+    """Get the rowid and date of the oldest notification.
 
-        if 'startDate' in queryData.keys():
-            # If a startDate was defined (by an alertChecker, for example), get it
-            fields = (queryData['startDate'],)
+    Args:
+        dbName (str): Name of the database to use.
 
-            # Query the database
-            cursor.execute("SELECT timestamp, host, type, startDate, endDate, availability FROM website_alerts \
-                WHERE timestamp > ? \
-                ORDER BY timestamp ASC", fields)
+    Returns:
+        A tuple (<rowid (int)>, <timestamp (int)>), the timestamp being in seconds since epoch, or None if there is no notification.
 
-        elif 'host' in queryData.keys():
-            # If an hist was defined (by a Retriever, for example), get it
-            fields = (queryData['host'],)
+    """
 
-            # Query the database
-            cursor.execute("SELECT timestamp, host, type, startDate, endDate, availability FROM website_alerts \
-                WHERE host = ? \
-                ORDER BY timestamp ASC", fields)
+    # The notifications are sorted by rowid, so the oldest one is the one with the smallest rowid
+    connection, cursor = initConnection(dbName)
+    cursor.execute("SELECT rowid, CAST(strftime('%s', {}) AS INTEGER) FROM website_alerts ORDER BY rowid ASC LIMIT 1".format(ALERT_TIME))
+    result = cursor.fetchone()
+    connection.close()
+    return result
 
-        else:
-            # If nothing was precised, query the databse for all available data
-            cursor.execute("SELECT timestamp, host, type, startDate, endDate, availability FROM website_alerts \
-                ORDER BY timestamp ASC")
+def iterExpiredSamples(dbName, before, batchSize=BATCH_SIZE):
+    """Get the data points recorded before a date, as a stream of rows in time order.
+    The data points are recorded in time order, so the rows inserted during an export are not exported.
 
-        # Return all results in an array
-        result = cursor.fetchall()
-        connection.close()
-        return result
+    Args:
+        dbName (str): Name of the database to use,
+        before (datetime.datetime): Only get the data points recorded before this date,
+        batchSize (int, optional): Number of rows fetched from the database at a time.
 
-    if table == 'website_monitoring':
-        # If the query concerns the website_alerts table
-        # Get the host and the number of minutes for the search
-        minutes = queryData['minutes']
-        fields = (queryData['host'],)
+    Returns:
+        An iterator over tuples (<host (str)>, <timestamp (int)>, <available (bool)>, <status (int)>, <responseTime (float)>,
+        <transferTime (float)>, <dnsTime (float)>, <connectTime (float)>, <tlsTime (float)>, <firstByteTime (float)>,
+        <downloadTime (float)>, <failure (str)>), in ascending timestamp order.
 
-        # Query the database
-        cursor.execute("SELECT timestamp, available, status, responseTime FROM website_monitoring \
-                WHERE host = ? AND datetime(timestamp) > datetime('now', '-{:d} minutes') \
-                ORDER BY timestamp ASC".format(minutes), fields)
+    """
+
+    return iterRows(dbName, "SELECT h.host, s.timestamp, {} FROM website_samples s JOIN website_hosts h ON h.id = s.hostId \
+            WHERE s.timestamp < CAST(strftime('%s', ?) AS INTEGER) \
+            ORDER BY s.timestamp ASC".format(', '.join('s.' + name for name, _ in VALUE_COLUMNS)), (sqlDate(before),), batchSize)
+
+def iterExpiredAlerts(dbName, before, lastRowid, batchSize=BATCH_SIZE):
+    """Get the notifications recorded before a date, as a stream of rows in time order.
+    The timestamps are converted to seconds since epoch by the database.
+
+    Args:
+        dbName (str): Name of the database to use,
+        before (datetime.datetime): Only get the notifications recorded before this date,
+        lastRowid (int): Only get the notifications up to this rowid (see maxRowid),
+        batchSize (int, optional): Number of rows fetched from the database at a time.
 
-        # Return all results in an array
-        result = cursor.fetchall()
+    Returns:
+        An iterator over tuples (<host (str)>, <timestamp (int)>, <type (str)>, <startDate (str)>, <endDate (str)>,
+        <availability (float)>), in ascending time order.
+
+    """
+
+    return iterRows(dbName, "SELECT host, CAST(strftime('%s', {0}) AS INTEGER), type, startDate, endDate, availability FROM website_alerts \
+            WHERE {0} < ? AND rowid <= ? \
+            ORDER BY rowid ASC".format(ALERT_TIME), (sqlDate(before), lastRowid), batchSize)
+
+def deleteExpired(dbName, before, lastAlertRowid):
+    """Delete the data points and notifications recorded before a date (once they are archived).
+
+    Args:
+        dbName (str): Name of the database to use,
+        before (datetime.datetime): Delete the rows recorded before this date,
+        lastAlertRowid (int): Only delete the notifications up to this rowid.
+
+    Returns:
+        A tuple containing the numbers of data points and notifications deleted.
+
+    """
+
+    connection, cursor = initConnection(dbName)
+    cursor.execute("DELETE FROM website_samples WHERE timestamp < CAST(strftime('%s', ?) AS INTEGER)", (sqlDate(before),))
+    samples = cursor.rowcount
+    cursor.execute("DELETE FROM website_alerts WHERE {} < ? AND rowid <= ?".format(ALERT_TIME), (sqlDate(before), lastAlertRowid))
+    alerts = cursor.rowcount
+    connection.commit()
+    connection.close()
+    return samples, alerts
+
+def importSamples(dbName, batches):
+    """Insert batches of data points into the website_samples table, one transaction per batch.
+
+    Args:
+        dbName (str): Name of the database to use,
+        batches (iterable): Iterable of lists of rows in the format returned by iterExpiredSamples.
+
+    Returns:
+        The number of data points inserted.
+
+    """
+
+    connection, cursor = initConnection(dbName)
+    hostIds = {}
+    count = 0
+    try:
+        for batch in batches:
+            for row in batch:
+                if row[0] not in hostIds:
+                    hostIds[row[0]] = hostId(cursor, row[0])
+
+            # The timestamps of the rows are already in seconds since epoch
+            cursor.executemany(INSERT_ARCHIVED_SAMPLE, ((hostIds[row[0]],) + tuple(row[1:]) for row in batch))
+            connection.commit()
+            count += len(batch)
+    finally:
         connection.close()
-        return result
+    return count
+
+def importAlerts(dbName, batches, firstRowid=None):
+    """Insert batches of notifications into the website_alerts table, one transaction per batch.
+    The timestamps are converted from seconds since epoch by the database.
+
+    Args:
+        dbName (str): Name of the database to use,
+        batches (iterable): Iterable of lists of rows in the format returned by iterExpiredAlerts, in time order,
+        firstRowid (int, optional): Rowid of the first notification inserted, the next ones having the next rowids
+            (defaults to the rowids following the ones of the table).
+
+    Returns:
+        The number of notifications inserted.
 
+    """
+
+    connection, cursor = initConnection(dbName)
+    count = 0
+    try:
+        for batch in batches:
+            # The rowids of the notifications give their time order (see queryLastAlert and pageAlerts)
+            rowids = range(firstRowid + count, firstRowid + count + len(batch)) if firstRowid is not None else [None] * len(batch)
+            cursor.executemany("INSERT INTO website_alerts (rowid, host, timestamp, type, startDate, endDate, availability) \
+                    VALUES (?, ?, strftime('%d/%m/%Y %H:%M:%S', ?, 'unixepoch'), ?, ?, ?, ?)",
+                ((rowid,) + tuple(row) for rowid, row in zip(rowids, batch)))
+            connection.commit()
+            count += len(batch)
+    finally:
+        connection.close()
+    return count
@@ -0,0 +1,17 @@
+"""Module dedicated to the classes of the failures of the checks.
+
+    They are shared by the Monitors, which classify the failed requests, and by the storage engines,
+    which store the class of the failure of each data point (the segment files as an index in this tuple).
+
+"""
+
+# Classes of the failures of the checks:
+#   - dns: the host name couldn't be resolved,
+#   - timeout: the request timed out,
+#   - connection: the connection couldn't be established or was lost,
+#   - invalidURL: the URL is invalid,
+#   - error: any other error,
+#   - content: the website answered, but the body of the response failed its content check,
+#   - skipped: the check was skipped, as the previous check of the website was still in progress.
+# The segment files store the index of the class: new classes are added at the end.
+FAILURE_CLASSES = ('dns', 'timeout', 'connection', 'invalidURL', 'error', 'content', 'skipped')
@@ -0,0 +1,214 @@
+import math
+from datetime import datetime
+from storage import openBackend, ALERT_TIMESTAMP_FORMAT, SAMPLE_TIMESTAMP_FORMAT
+
+"""Module dedicated to the latency alerts of the monitored websites.
+
+    The response times of a website are compared to a baseline learned from its own history: an
+    exponentially weighted average and variance of the logarithm of its response times (response
+    times are skewed, their logarithm much less). The baseline is updated with each data point in
+    constant time and memory, from the data points returned by the checks, so that raising an alert
+    needs no query to the storage: the storage is only written to when an alert is raised or ends.
+
+"""
+
+# Weight of the last response time in the baseline
+SMOOTHING = 0.05
+
+# Weight of the last response time in the baseline average while it is anomalous, so that a lasting change
+# of the response time slowly becomes the new baseline (after about 1600 checks) instead of staying on alert
+# forever (the anomalous response times don't change the variance, which would hide the anomaly)
+ANOMALY_SMOOTHING = 0.001
+
+# Number of response times learned before the response times are compared to the baseline
+WARMUP = 20
+
+# Number of minutes of stored response times before a restored alert from which the baseline is learned again
+BASELINE_MINUTES = 60
+
+# A response time is anomalous if it is more than this number of standard deviations above the baseline...
+THRESHOLD = 3
+
+# ...and more than this factor times the baseline (so that a very stable website isn't on alert for a few milliseconds)
+MIN_RATIO = 2
+
+# Number of consecutive anomalous response times raising an alert, and of consecutive normal ones ending it
+ALERT_COUNT = 3
+RECOVERY_COUNT = 5
+
+class LatencyDetector():
+    """Detects the anomalous response times of a website, and raises latency alerts (and recoveries).
+    The data points without a response (unavailable website) are ignored: they are the concern of the
+    availability alerts (see Retriever.checkAlert).
+
+    Attributes:
+        URL (str): URL of the monitored website,
+        storage (StorageBackend): Storage backend the notifications are stored in,
+        clock (callable): Function returning the current UTC date,
+        dispatcher (notifications.Dispatcher): Dispatcher the new notifications are submitted to (None if there is none),
+        count (int): Number of response times learned,
+        mean (float): Exponentially weighted average of the logarithm of the response times,
+        variance (float): Exponentially weighted variance of the logarithm of the response times,
+        streak (int): Number of consecutive anomalous (on alert: normal) response times,
+        isOnAlert (bool): Whether the website is on latency alert,
+        startDate (str): Date of the current alert (None if the website isn't on alert),
+        responseTime (float): Response time which raised the current alert, in milliseconds.
+
+    """
+
+    def __init__(self, URL, storage, clock=datetime.utcnow, dispatcher=None):
+        """Sets the URL and storage as speficied in the parameters.
+
+        Args:
+            URL (str): URL of the monitored website,
+            storage (str or StorageBackend): Storage backend to use, or its URI (see storage.openBackend),
+            clock (callable, optional): Function returning the current UTC date (datetime.datetime),
+            dispatcher (notifications.Dispatcher, optional): Dispatcher the new notifications are submitted to, to be
+                delivered to external receivers.
+
+        """
+
+        self.URL = URL
+        self.storage = openBackend(storage)
+        self.clock = clock
+        self.dispatcher = dispatcher
+        self.count = 0
+        self.mean = 0
+        self.variance = 0
+        self.streak = 0
+        self.isOnAlert = False
+        self.startDate = None
+        self.responseTime = None
+
+    def restore(self, lastAlert):
+        """Restores the alert state from the most recent latency notification about the website, so that
+        a restarted app ends the alerts raised before it stopped.
+        The baseline is not stored: it is learned again from the response times stored before the alert, so that
+        the response times which are still slow are not taken for normal ones. Until the baseline is learned (if
+        the storage doesn't have enough of them), the response times don't count towards the end of the alert.
+
+        Args:
+            lastAlert (tuple): Most recent latency notification about the website (see StorageBackend.lastAlert),
+                or None if there is none.
+
+        """
+
+        if lastAlert is not None and lastAlert[2] == 'latencyAlert':
+            self.isOnAlert = True
+            self.startDate = lastAlert[3]
+            self.responseTime = lastAlert[5]
+
+            start = datetime.strptime(self.startDate, ALERT_TIMESTAMP_FORMAT)
+            end = start.strftime(SAMPLE_TIMESTAMP_FORMAT)
+            for sample in self.storage.iterSamples(self.URL, BASELINE_MINUTES, start):
+                if sample[0] >= end:
+                    break
+                if sample[3] is not None:
+                    self.__learn(sample[3])
+
+    def baseline(self):
+        """Returns the baseline response time of the website, in milliseconds (None before any response).
+
+        """
+
+        return math.exp(self.mean) if self.count > 0 else None
+
+    def add(self, sample):
+        """Compares the response time of a data point to the baseline, and updates the baseline and the alert state.
+
+        Args:
+            sample (dict): Data point stored by the check (see Monitor.get), with at least its response time
+                (responseTime (float)).
+
+        Returns:
+            A dictionary composed of:
+                - type (str): Type of notification, if the data point raised or ended an alert ("latencyAlert" or
+                  "latencyRecovery", or None if there is no new notification; in that case, the following fields
+                  do not exist),
+                - URL (str): Website URL,
+                - responseTime (float): Response time which raised or ended the alert,
+                - startDate (str): Date of alert,
+                - endDate (str, optional): Date of recovery (only in case of a recovery).
+
+        """
+
+        responseTime = sample.get('responseTime')
+        if responseTime is None:
+            return { 'type': None }
+
+        # The response times are neither anomalous nor normal until the baseline is learned
+        anomalous = self.__learn(responseTime)
+        if anomalous is None:
+            return { 'type': None }
+
+        # An alert is raised (or ended) after a few consecutive anomalous (or normal) response times
+        self.streak = self.streak + 1 if anomalous != self.isOnAlert else 0
+        if self.streak < (RECOVERY_COUNT if self.isOnAlert else ALERT_COUNT):
+            return { 'type': None }
+        self.streak = 0
+
+        currentDate = self.clock().strftime('%d/%m/%Y %H:%M:%S')
+        if self.isOnAlert:
+            self.isOnAlert = False
+            notification = { 'type': 'latencyRecovery', 'URL': self.URL, 'responseTime': responseTime,
+                'startDate': self.startDate, 'endDate': currentDate }
+        else:
+            self.isOnAlert = True
+            self.startDate = currentDate
+            self.responseTime = responseTime
+            notification = { 'type': 'latencyAlert', 'URL': self.URL, 'responseTime': responseTime,
+                'startDate': currentDate }
+
+        # The availability column of the latency notifications contains the response time
+        queryData = {
+            'host': self.URL,
+            'timestamp': currentDate,
+            'type': notification['type'],
+            'startDate': notification['startDate'],
+            'endDate': notification.get('endDate'),
+            'availability': responseTime,
+        }
+        self.storage.appendAlert(queryData)
+        if self.dispatcher is not None:
+            self.dispatcher.submit(queryData)
+        return notification
+
+    def __learn(self, responseTime):
+        """Compares a response time to the baseline, and updates the baseline.
+
+        Args:
+            responseTime (float): Response time, in milliseconds.
+
+        Returns:
+            Whether the response time is anomalous, or None if the baseline isn't learned yet (see WARMUP).
+
+        """
+
+        value = math.log(max(responseTime, 1))
+        deviation = value - self.mean
+        warm = self.count >= WARMUP
+        anomalous = warm and deviation > THRESHOLD * math.sqrt(self.variance) and deviation > math.log(MIN_RATIO)
+
+        # Update the baseline (the first response time is the initial baseline)
+        if self.count == 0:
+            self.mean = value
+        elif anomalous:
+            self.mean += ANOMALY_SMOOTHING * deviation
+        else:
+            self.mean += SMOOTHING * deviation
+            self.variance = (1 - SMOOTHING) * (self.variance + SMOOTHING * deviation * deviation)
+        self.count += 1
+        return anomalous if warm else None
+
+    def status(self):
+        """Returns the current latency alert of the website.
+
+        Returns:
+            A dictionary in the format of add: the current alert ("latencyAlert"), or a type None if the website
+            isn't on latency alert.
+
+        """
+
+        if not self.isOnAlert:
+            return { 'type': None }
+        return { 'type': 'latencyAlert', 'URL': self.URL, 'responseTime': self.responseTime, 'startDate': self.startDate }
@@ -1,77 +1,287 @@
+import time
+import threading
 import requests
-from dbutils import insertValue
-from datetime import timedelta, datetime
+import probe
+from contentCheck import ContentCheck
+from storage import openBackend
+from datetime import datetime
+from urllib.parse import urlsplit
+
+# Ways of probing a website:
+#   - get: GET request, the body is read entirely (but not kept in memory),
+#   - head: HEAD request, no body is transferred,
+#   - headers: GET request, the connection is closed as soon as the headers are received,
+#   - capped: GET request, the connection is closed after maxBodyBytes bytes of body.
+PROBE_METHODS = ('get', 'head', 'headers', 'capped')
+
+# Size of the chunks in which the bodies are read
+CHUNK_SIZE = 8192
+
+# Default timeouts of the requests, in seconds: time to establish the connection, and time to wait for
+# the response (also the maximum time spent reading the body)
+CONNECT_TIMEOUT = 5
+READ_TIMEOUT = 10
+
+def iterBody(response, limit=None):
+    """Reads the body of a streamed response in chunks of at most CHUNK_SIZE bytes, without reading past a limit.
+
+    Args:
+        response (requests.Response): Streamed response,
+        limit (int, optional): Maximum number of bytes of body to read (None for the whole body).
+
+    Yields:
+        The chunks of the body (bytes).
+
+    """
+
+    if limit is None:
+        yield from response.iter_content(CHUNK_SIZE)
+        return
+
+    while limit > 0:
+        # The size of the chunks of iter_content is fixed: a new iterator is started for each chunk, so that the
+        # last one stops at the limit (the stream is only marked as consumed when an iterator reaches its end)
+        chunk = next(response.iter_content(min(CHUNK_SIZE, limit)), b'')
+        if not chunk:
+            return
+        limit -= len(chunk)
+        yield chunk
 
 class Monitor():
     """Class whose goal is to check the monitored website's availability and performance.
 
     Attributes:
         URL (str): URL of the monitored website,
-        dbName (str): Name of the database to use.
+        storage (StorageBackend): Storage backend to use,
+        probeMethod (str): Way of probing the website (one of PROBE_METHODS),
+        maxBodyBytes (int): Maximum number of bytes of body read with the capped probe method,
+        content (contentCheck.ContentCheck): Content check of the body of the responses (None for no check),
+        connectTimeout (float): Time allowed to establish the connection, in seconds,
+        readTimeout (float): Time allowed to wait for the response, and to read the body, in seconds,
+        clock (callable): Function returning the current UTC date,
+        transport (callable): Function sending a request to a URL and returning the response,
+        limiter (probe.ConcurrencyLimiter): Limiter of the concurrent requests (None for no limit),
+        inFlight (threading.Lock): Held while a check is in progress,
+        skippedChecks (int): Number of checks skipped because the previous check was still in progress.
 
     """
 
-    def __init__(self, URL, dbName="monitoring.db"):
-        """Sets the URL and database name as speficied in the parameters.
+    def __init__(self, URL, storage="monitoring.db", probeMethod='get', maxBodyBytes=65536, connectTimeout=CONNECT_TIMEOUT,
+            readTimeout=READ_TIMEOUT, clock=datetime.utcnow, transport=probe.request, limiter=None, content=None):
+        """Sets the URL and storage as speficied in the parameters.
 
         Args:
             URL (str): URL of the monitored website,
-            dbName (str): Name of the database to use.
+            storage (str or StorageBackend): Storage backend to use, or its URI (see storage.openBackend),
+            probeMethod (str, optional): Way of probing the website (one of PROBE_METHODS),
+            maxBodyBytes (int, optional): Maximum number of bytes of body read with the capped probe method,
+            connectTimeout (float, optional): Time allowed to establish the connection, in seconds,
+            readTimeout (float, optional): Time allowed to wait for the response, and to read the body, in seconds,
+            clock (callable, optional): Function returning the current UTC date (datetime.datetime),
+            transport (callable, optional): Function with the signature of probe.request, returning a
+                requests.Response-like object (with status_code, elapsed, iter_content and close),
+            limiter (probe.ConcurrencyLimiter, optional): Limiter of the concurrent requests, shared by the Monitors,
+            content (dict, optional): Assertions on the body of the responses (see contentCheck.ContentCheck).
 
         """
 
+        if probeMethod not in PROBE_METHODS:
+            raise ValueError('Unknown probe method {} for {}'.format(probeMethod, URL))
+        if content is not None and probeMethod in ('head', 'headers'):
+            raise ValueError('The content of {} can not be checked with the {} probe method'.format(URL, probeMethod))
+
         self.URL = URL
-        self.dbName = dbName
+        self.storage = openBackend(storage)
+        self.probeMethod = probeMethod
+        self.maxBodyBytes = maxBodyBytes
+        self.content = ContentCheck(**content) if content is not None else None
+        self.connectTimeout = connectTimeout
+        self.readTimeout = readTimeout
+        self.clock = clock
+        self.transport = transport
+        self.limiter = limiter
+        self.inFlight = threading.Lock()
+        self.skippedChecks = 0
+
+    def __probe(self):
+        """Sends a request to the monitored website according to the probe method.
+        The body of the response (if any) is read by chunks and discarded, up to the limit set by the probe method,
+        or until the result of the content check of the website is known.
+
+        Returns:
+            A tuple containing:
+                - a requests.Response object containing data about the request,
+                - a dictionary containing the size of the body read and the result of the content check:
+                    bodyBytes (int): Number of bytes of body read,
+                    contentCheck (str): Result of the content check (one of contentCheck.CONTENT_RESULTS, None if
+                        the website has no content check),
+                  and the timings of the request, in milliseconds:
+                    transferTime (float): Total transfer time (time to first byte, plus the time spent reading the body),
+                        including the redirections like the other timings,
+                    dnsTime (float): Time spent resolving the host name,
+                    connectTime (float): Time spent establishing the TCP connection,
+                    tlsTime (float): Time spent in the TLS handshake,
+                    firstByteTime (float): Time between the end of the connection setup and the first byte of the response,
+                    downloadTime (float): Time spent reading the body.
+                  The phases of the connection setup are None if the transport doesn't time them.
+
+        """
+
+        # Durations of the connection setup phases, filled by the transport
+        phases = {}
+        bytesRead = 0
+        contentCheck = None
+        timeout = (self.connectTimeout, self.readTimeout)
+
+        if self.probeMethod == 'head':
+            # No body to read: the transfer ends with the headers
+            response = self.transport('HEAD', self.URL, allow_redirects=True, timeout=timeout, timings=phases)
+            response.close()
+            bodyTime = 0
+        else:
+            # Only get the headers for now, the body is read below if needed
+            response = self.transport('GET', self.URL, stream=True, timeout=timeout, timings=phases)
+            try:
+                bodyStart = time.perf_counter()
+                if self.probeMethod != 'headers':
+                    # The body is checked as it is read, and only read until the result of the check is known
+                    evaluation = self.content.start() if self.content is not None else None
+                    for chunk in iterBody(response, self.__bodyLimit()):
+                        bytesRead += len(chunk)
+                        if evaluation is not None and evaluation.feed(chunk) is not None:
+                            break
+                        # The read timeout only bounds each read: also bound the whole body,
+                        # so that a website sending its body slowly can't hold the check
+                        if time.perf_counter() - bodyStart > self.readTimeout:
+                            raise requests.Timeout('Reading the body of {} took more than {}s'.format(self.URL, self.readTimeout))
+                    if evaluation is not None:
+                        contentCheck = evaluation.result()
+                bodyTime = time.perf_counter() - bodyStart
+            finally:
+                # Release the connection (which aborts the transfer of the rest of the body)
+                response.close()
+
+        # The time to first byte of the response covers the connection setup (and all the redirections, whose
+        # connection setup phases are added up by the transport)
+        elapsed = response.elapsed.total_seconds() + sum(hop.elapsed.total_seconds() for hop in getattr(response, 'history', []))
+        setupTime = sum(phases.values())
+
+        return response, {
+            'bodyBytes': bytesRead,
+            'contentCheck': contentCheck,
+            'transferTime': (elapsed + bodyTime) * 1000,
+            'dnsTime': phases['dns'] * 1000 if 'dns' in phases else None,
+            'connectTime': phases['connect'] * 1000 if 'connect' in phases else None,
+            'tlsTime': phases['tls'] * 1000 if 'tls' in phases else None,
+            'firstByteTime': max(elapsed - setupTime, 0) * 1000,
+            'downloadTime': bodyTime * 1000,
+        }
+
+    def __bodyLimit(self):
+        """Gives the number of bytes of body after which the reading stops.
+
+        Returns:
+            maxBodyBytes with the capped probe method, one byte more than the maximum size of the content check
+            (enough to know that the body is too large) if it has one, the smallest of both if both apply,
+            None otherwise.
+
+        """
+
+        limits = []
+        if self.probeMethod == 'capped':
+            limits.append(self.maxBodyBytes)
+        if self.content is not None and self.content.maxBodySize is not None:
+            limits.append(self.content.maxBodySize + 1)
+        return min(limits) if limits else None
 
     def __availabilityCheck(self):
-        """Checks if the monitored website is available by sending it a GET request.
-        We define that a site is available if it responds to a GET request with a status code which
-        doesn't start with 4 or 5.
+        """Checks if the monitored website is available by sending it a request (see __probe).
+        We define that a site is available if it responds to the request with a status code which
+        doesn't start with 4 or 5, and with a body which passes its content check (if it has one).
 
         Returns:
             A tuple containing:
                 - a boolean (False if the site is not available, True if it is),
                 - a requests.Response object containing data about the requests, or None if the website
-                  didn't answer the request.
+                  didn't answer the request,
+                - a dictionary containing the details of the request (see __probe), with the class of the failure
+                  (failure (str), content) if the body failed the content check, or only the class of the failure
+                  (failure (str), one of failures.FAILURE_CLASSES) if the website didn't answer the request.
 
         """
 
         try:
-            # Send a request to the website, and verify that it doesn't respond with an error code
-            response = requests.get(self.URL)
-            if response.status_code < 400:
-                return True, response
+            # Send a request to the website (when a request slot is free), and verify that it doesn't respond with an error code
+            if self.limiter is not None:
+                with self.limiter.slot(urlsplit(self.URL).hostname):
+                    response, timings = self.__probe()
+            else:
+                response, timings = self.__probe()
+            if response.status_code >= 400:
+                return False, response, timings
+            elif timings['contentCheck'] not in (None, 'ok'):
+                timings['failure'] = 'content'
+                return False, response, timings
             else:
-                return False, response
+                return True, response, timings
 
-        # If the website doesn't respond, set that it is not available
+        # If the website doesn't respond, set that it is not available, and why
+        except probe.DNSError as e:
+            #print('Could not resolve the host name of {}'.format(self.URL))
+            return False, None, {'failure': 'dns'}
         except requests.Timeout as e:
             #print('The request at {} timed out'.format(self.URL))
-            return False, None
+            return False, None, {'failure': 'timeout'}
         except requests.ConnectionError as e:
             #print('Error while connecting to {}'.format(self.URL))
-            return False, None
+            return False, None, {'failure': 'connection'}
         except requests.InvalidURL as e:
             #print('Invalid URL for site {}'.format(self.URL))
-            return False, None
+            return False, None, {'failure': 'invalidURL'}
         except Exception as e:
             #print('There was an error while connecting to {}'.format(self.URL))
-            return False, None
+            return False, None, {'failure': 'error'}
 
 
     def get(self):
-        """Gets data about the monitored website and stores it into the database.
+        """Gets data about the monitored website and stores it into the storage.
+        Only one check of the website runs at a time: if the previous check is still in progress,
+        the check is skipped (and counted in skippedChecks), and stored as a failure of the skipped class.
+
+        Returns:
+            The data point stored (dict containing timestamp, host, available, status, responseTime, and
+            the details or class of failure of the request).
+
+        """
+
+        if not self.inFlight.acquire(blocking=False):
+            # The website didn't answer the previous check within the check interval: it is unavailable,
+            # even if that check ends up timing out after the next ones
+            self.skippedChecks += 1
+            return self.__store(self.clock().strftime('%Y-%m-%d %H:%M:%S'), False, None, None, {'failure': 'skipped'})
+
+        try:
+            return self.__check()
+        finally:
+            self.inFlight.release()
+
+    def __check(self):
+        """Checks the monitored website and stores the data point into the storage (see get).
+
+        Returns:
+            The data point stored.
 
         """
 
         # Get the current date to use it as a timestamp
-        currentDate = datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S')
+        currentDate = self.clock().strftime('%Y-%m-%d %H:%M:%S')
 
         # Query the website
-        available, response = self.__availabilityCheck()
+        available, response, details = self.__availabilityCheck()
 
         if response is not None:
             # If there was a response, get interesting fields about the response
+            # (the response time is the time to first byte, the timings detail it and the time to read the body)
             responseTime = response.elapsed.total_seconds() * 1000
             status = response.status_code
         else:
@@ -79,12 +289,31 @@ class Monitor():
             responseTime = None
             status = None
 
-        # Format data and write it to the database
+        return self.__store(currentDate, available, status, responseTime, details)
+
+    def __store(self, currentDate, available, status, responseTime, details):
+        """Writes a data point to the storage.
+
+        Args:
+            currentDate (str): Date of the check, in the "%Y-%m-%d %H:%M:%S" format,
+            available (bool): Whether the website is available,
+            status (int): Response status code (None if there was no response),
+            responseTime (float): Response time, in milliseconds (None if there was no response),
+            details (dict): Details or class of failure of the request (see __availabilityCheck).
+
+        Returns:
+            The data point stored.
+
+        """
+
+        # Format data and write it to the storage
         insertData = {
             "timestamp": currentDate,
             "host": self.URL,
             "available": available,
             "status": status,
-            "responseTime": responseTime
+            "responseTime": responseTime,
         }
-        insertValue(self.dbName, 'website_monitoring', insertData)
+        insertData.update(details)
+        self.storage.appendSample(insertData)
+        return insertData
@@ -1,43 +1,112 @@
 #!/usr/bin/env python3
 import argparse
-from app import App
-from alertWatcher import AlertWatcher
-from test import testServer
+import sys
+import glob
+from datetime import datetime, timedelta
+
+# The modules of each mode are only imported when the mode runs, so that a mode doesn't pay for the
+# dependencies of the others (requests for the monitoring mode, flask for the live test...)
 
 # Add the different possible args for the app
 parser = argparse.ArgumentParser(prog='main', usage='%(prog)s [options]')
 parser.add_argument('--monitor', '-m', action='store_true', help='start the app in monitoring mode')
 parser.add_argument('--alert', '-a', action='store_true', help='start the app in alert / recovery notification mode')
 parser.add_argument('--test', '-t', action='store_true', help='start the app in test mode')
+parser.add_argument('--live', action='store_true', help='run the test against a real local server (with -t only)')
+parser.add_argument('--startup', action='store_true', help='measure the import time and time to first output of each mode (with -t only)')
+parser.add_argument('--schema', action='store_true', help='measure the size and scan speed of the data points before and after the conversion to the compact layout (with -t only)')
+parser.add_argument('--alerts', action='store_true', help='measure the loading of the last notification of every website from a long notifications history (with -t only)')
 parser.add_argument('--config', '-c', action='store', help='give the configuration filename (with -m only)')
-parser.add_argument('--database', '-db', action='store', help='give the database filename (with -m only)')
+parser.add_argument('--database', '-db', action='store', nargs='+', help='give the database filename or storage URI (with -m or -a), or several of them or a glob pattern to watch several databases (with -a only)')
+parser.add_argument('--segments', '-s', action='store', help='store the monitoring data in segment files in the given directory (with -m or -a)')
+parser.add_argument('--top', action='store', type=int, help='only print a summary and the given number of worst websites (with -m only)')
+parser.add_argument('--rank', action='store', choices=['availability', 'p95', '5xx'], default='availability', help='ranking of the worst websites (with --top)')
+parser.add_argument('--window', action='store', type=int, default=10, help='timeframe of the summary, in minutes (with --top)')
+parser.add_argument('--number', '-n', action='store', type=int, default=20, help='number of notifications printed at a time from the history (with -a only)')
+parser.add_argument('--host', action='store', help='only print the notifications about the given website URL (with -a only)')
+parser.add_argument('--since', action='store', type=datetime.fromisoformat, help='only print the notifications from the given date, as YYYY-MM-DD[ HH:MM:SS] (with -a only)')
+parser.add_argument('--until', action='store', type=datetime.fromisoformat, help='only print the notifications before the given date, as YYYY-MM-DD[ HH:MM:SS] (with -a only)')
+parser.add_argument('--archive', action='store', help='move the old data points and notifications of the database to an archive in the given directory')
+parser.add_argument('--older-than', action='store', type=int, default=30, help='age, in days, of the data archived (with --archive only)')
+parser.add_argument('--replay', action='store', help='replay the data points recorded in the given database through the alerting logic, as fast as possible (with --since and --until to select the data)')
+parser.add_argument('--simulate', action='store', help='replay synthetic data points generated from the given specification file through the alerting logic, as fast as possible')
+parser.add_argument('--import', action='store', help='import the archive of the given directory into the database (with --since and --until to select the days)')
+parser.add_argument('--migrate', action='store_true', help='convert the data points of a database created by a previous version of the app to the compact layout')
 parser.add_argument
 
 # Parse the args
 args = vars(parser.parse_args())
 
+# Get the storage URI from the database and segments args (the patterns matching no file are kept as is,
+# for the storage URIs and the databases which don't exist yet)
+databases = [path for pattern in args['database'] or ['monitoring.db'] for path in sorted(glob.glob(pattern)) or [pattern]]
+storage = databases[0]
+if len(databases) > 1 and not args['alert']:
+    print('Several databases can only be given with -a')
+    sys.exit(1)
+if args['segments']:
+    # The notifications are stored in the given database, the monitoring data in segment files
+    storage = 'segments://{}?alerts={}'.format(args['segments'], storage)
+
 if args['monitor']:
-    # If the app is run in monitoring mode, initialize it
-    app = App()
+    # If the app is run in monitoring mode, initialize it with the corresponding storage and printing mode
+    from app import App
+    app = App(storage, args['top'], args['rank'], args['window'])
 
     # Run the app with the corresponding config
-    if args['database'] and args['config']:
-        app.run(dbName=args['database'], configFile=args['config'])
-    elif args['database']:
-        app.run(dbName=args['database'])
-    elif args['config']:
-        app.run(dbName=args['config'])
+    if args['config']:
+        app.run(configFile=args['config'])
     else:
         app.run()
 
 elif args['alert']:
-    # If the app is run in alert mode, initialize it
-    app = AlertWatcher()
+    # If the app is run in alert mode, initialize it with the corresponding storage and filters
+    from alertWatcher import AlertWatcher
+    app = AlertWatcher(databases if len(databases) > 1 else storage, args['number'], args['host'], args['since'], args['until'])
     app.run()
 
+elif args['archive']:
+    # Archiving only applies to the sqlite database
+    from archive import exportArchive
+    samples, alerts = exportArchive(databases[0], args['archive'], datetime.utcnow() - timedelta(days=args['older_than']))
+    print('Archived {} data points and {} notifications'.format(samples, alerts))
+
+elif args['import']:
+    from archive import importArchive
+    try:
+        samples, alerts = importArchive(databases[0], args['import'], args['since'], args['until'])
+    except ValueError as error:
+        print(error)
+        sys.exit(1)
+    print('Imported {} data points and {} notifications'.format(samples, alerts))
+
+elif args['migrate']:
+    # The conversion only applies to the sqlite database (the other modes refuse a database which isn't converted)
+    import dbutils
+    count = dbutils.migrateDatabase(databases[0])
+    print('Converted {} data points'.format(count) if count is not None else 'The database is already converted')
+
+elif args['replay'] or args['simulate']:
+    from replay import Replay, recordedSamples, syntheticSamples, loadSpec, printReport
+    if args['replay']:
+        samples = recordedSamples(args['replay'], args['since'], args['until'])
+    else:
+        samples = syntheticSamples(loadSpec(args['simulate']))
+    printReport(Replay().run(samples))
+
 elif args['test']:
     # If the app is run in test mode, launch the test script
-    testServer()
+    from test import liveTest, runTests, startupBenchmark, schemaBenchmark, alertsBenchmark
+    if args['live']:
+        sys.exit(0 if liveTest() else 1)
+    elif args['startup']:
+        startupBenchmark()
+    elif args['schema']:
+        schemaBenchmark()
+    elif args['alerts']:
+        alertsBenchmark()
+    else:
+        sys.exit(0 if runTests() else 1)
 
 else:
-    print('Missing argument: use -m, -a or -t')
+    print('Missing argument: use -m, -a, -t, --replay, --simulate, --archive, --import or --migrate')
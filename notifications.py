@@ -0,0 +1,468 @@
+import os
+import json
+import time
+import shlex
+import threading
+import subprocess
+from collections import OrderedDict
+import requests
+from storage import ALERT_KINDS
+
+"""Module dedicated to the delivery of the notifications (alerts and recoveries) to external receivers.
+
+    The notifications raised by the Retrievers and LatencyDetectors are submitted to a Dispatcher, which
+    only queues them: they are delivered in the background, by batches, to the configured sinks (webhooks
+    or commands), so that a slow or unreachable receiver never blocks the checks or the stats printing.
+
+    Each sink has its own queue, in which the pending notifications about the same website and kind of
+    alert are coalesced: a newer notification replaces the one not yet delivered (a recovery carries the
+    start date of its alert), so a receiver which was unreachable gets the current state of each website
+    rather than every flap. A failed delivery is retried after an exponentially growing delay, and the
+    number of deliveries in progress at the same time is limited for each sink.
+
+    The queues are journaled to a file, so that the notifications not yet delivered when the app stops
+    are delivered when it starts again. The journal is rewritten with only the notifications not yet
+    delivered when it is loaded, and whenever the delivered ones make up most of it.
+
+"""
+
+# Name of the journal file of the queues, in the queue directory
+JOURNAL_FILE = 'notifications.jsonl'
+
+# Number of notifications delivered (or coalesced) since the journal was written after which it is rewritten,
+# if they are at least as many as the notifications not yet delivered
+JOURNAL_COMPACTION = 1000
+
+class WebhookSink():
+    """Sink posting the notifications, as a JSON array, to a URL.
+
+    Attributes:
+        name (str): Name of the sink,
+        URL (str): URL the notifications are posted to,
+        timeout (int/float): Time allowed for a delivery, in seconds,
+        batchSize (int): Maximum number of notifications delivered at a time,
+        concurrency (int): Maximum number of deliveries in progress at the same time.
+
+    """
+
+    def __init__(self, name, URL, timeout=5, batchSize=50, concurrency=1):
+        self.name = name
+        self.URL = URL
+        self.timeout = timeout
+        self.batchSize = batchSize
+        self.concurrency = concurrency
+
+    def deliver(self, notifications):
+        """Posts a batch of notifications to the URL.
+
+        Args:
+            notifications (list): Notifications to deliver (see Dispatcher.submit).
+
+        Raises:
+            requests.RequestException: If the delivery failed (the receiver didn't answer, or answered with an error code).
+
+        """
+
+        response = requests.post(self.URL, json=notifications, timeout=self.timeout)
+        response.raise_for_status()
+
+class CommandSink():
+    """Sink running a command for each batch of notifications, with the notifications (a JSON array) on its standard input.
+
+    Attributes:
+        name (str): Name of the sink,
+        command (list): Command to run, and its arguments,
+        timeout (int/float): Time allowed for a delivery, in seconds,
+        batchSize (int): Maximum number of notifications delivered at a time,
+        concurrency (int): Maximum number of deliveries in progress at the same time.
+
+    """
+
+    def __init__(self, name, command, timeout=10, batchSize=50, concurrency=1):
+        self.name = name
+        self.command = shlex.split(command) if isinstance(command, str) else command
+        self.timeout = timeout
+        self.batchSize = batchSize
+        self.concurrency = concurrency
+
+    def deliver(self, notifications):
+        """Runs the command with a batch of notifications.
+
+        Args:
+            notifications (list): Notifications to deliver (see Dispatcher.submit).
+
+        Raises:
+            subprocess.SubprocessError: If the delivery failed (the command timed out or exited with an error).
+
+        """
+
+        subprocess.run(self.command, input=json.dumps(notifications), text=True, timeout=self.timeout, check=True,
+            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+def createSink(config):
+    """Creates a sink from its description in the configuration file:
+    {
+        "name": <name of the sink (str, defaults to the URL or command)>,
+        "webhook": <URL the notifications are posted to (str)>, or
+        "command": <command run for each batch (str or list)>,
+        "timeout": <time allowed for a delivery, in seconds (int/float, optional)>,
+        "batchSize": <maximum number of notifications delivered at a time (int, defaults to 50)>,
+        "concurrency": <maximum number of deliveries in progress at the same time (int, defaults to 1)>
+    }
+
+    Args:
+        config (dict): Description of the sink.
+
+    Returns:
+        A WebhookSink or a CommandSink.
+
+    """
+
+    options = { key: config[key] for key in ('timeout', 'batchSize', 'concurrency') if key in config }
+    if 'webhook' in config:
+        return WebhookSink(config.get('name', config['webhook']), config['webhook'], **options)
+    if 'command' in config:
+        return CommandSink(config.get('name', str(config['command'])), config['command'], **options)
+    raise ValueError('A notification sink needs a webhook or a command')
+
+class SinkQueue():
+    """Queue of the notifications not yet delivered to a sink, and state of the retries of the sink.
+
+    Attributes:
+        pending (collections.OrderedDict): Notifications waiting to be delivered, in submission order, by coalescing
+            key (<host (str)>, <kind of alert (str)>), as (<id (int)>, <notification (dict)>, <submission time (float)>) tuples,
+        inFlight (int): Number of notifications being delivered,
+        deliveries (int): Number of deliveries in progress,
+        failures (int): Number of consecutive failed deliveries,
+        retryAt (float): Time (time.monotonic) before which no delivery is attempted, after a failure,
+        lastError (str): Error of the last failed delivery (None if the last delivery succeeded).
+
+    """
+
+    def __init__(self):
+        self.pending = OrderedDict()
+        self.inFlight = 0
+        self.deliveries = 0
+        self.failures = 0
+        self.retryAt = 0
+        self.lastError = None
+
+class Dispatcher():
+    """Delivers the notifications to the sinks in the background, by batches, with coalescing and retries.
+
+    Attributes:
+        sinks (list): Sinks the notifications are delivered to (WebhookSink or CommandSink),
+        queues (dict of str:SinkQueue): Queue of each sink, by name,
+        batchDelay (int/float): Time a notification waits for others to be delivered in the same batch, in seconds,
+        retryDelay (int/float): Time before the first retry of a failed delivery, in seconds (doubled after each failure),
+        maxRetryDelay (int/float): Maximum time between two retries, in seconds,
+        journalPath (str): Path of the journal of the queues (None to keep the queues in memory only),
+        journal (file): Journal of the queues, open for appending (None to keep the queues in memory only),
+        undelivered (collections.OrderedDict): Journal records of the notifications not yet delivered (including
+            the ones being delivered), by id,
+        journalDone (int): Number of notifications delivered or coalesced since the journal was written,
+        nextId (int): Id of the next notification submitted,
+        counters (dict): Numbers of notifications delivered and coalesced, and of failed deliveries,
+        condition (threading.Condition): Guards the queues, and wakes the workers up,
+        stopped (bool): Set to stop the workers,
+        workers (list of threading.Thread): Workers delivering the notifications.
+
+    """
+
+    def __init__(self, sinks, queueDirectory=None, batchDelay=1, retryDelay=1, maxRetryDelay=300):
+        """Sets the sinks and the delivery parameters, and loads the notifications not yet delivered from the journal.
+
+        Args:
+            sinks (list): Sinks the notifications are delivered to,
+            queueDirectory (str, optional): Directory of the journal of the queues (None to keep the queues in memory only),
+            batchDelay (int/float, optional): Time a notification waits for others to be delivered in the same batch, in seconds,
+            retryDelay (int/float, optional): Time before the first retry of a failed delivery, in seconds,
+            maxRetryDelay (int/float, optional): Maximum time between two retries, in seconds.
+
+        """
+
+        self.sinks = sinks
+        self.queues = { sink.name: SinkQueue() for sink in sinks }
+        self.batchDelay = batchDelay
+        self.retryDelay = retryDelay
+        self.maxRetryDelay = maxRetryDelay
+        self.nextId = 0
+        self.counters = { 'delivered': 0, 'coalesced': 0, 'failures': 0 }
+        self.condition = threading.Condition()
+        self.stopped = False
+        self.workers = []
+
+        self.journalPath = None
+        self.journal = None
+        self.undelivered = OrderedDict()
+        self.journalDone = 0
+        if queueDirectory is not None:
+            os.makedirs(queueDirectory, exist_ok=True)
+            self.journalPath = os.path.join(queueDirectory, JOURNAL_FILE)
+            self.__loadJournal()
+
+    def __loadJournal(self):
+        """Loads the notifications not yet delivered from the journal, and rewrites the journal with only them.
+        The journal is a sequence of JSON lines: {"id", "sink", "key", "notification"} for a notification queued for
+        a sink, and {"done": [ids]} for notifications delivered or coalesced.
+
+        """
+
+        queued = OrderedDict()
+        if os.path.exists(self.journalPath):
+            with open(self.journalPath) as journal:
+                for line in journal:
+                    try:
+                        record = json.loads(line)
+                    except json.JSONDecodeError:
+                        # Last line cut by a crash
+                        continue
+                    if 'done' in record:
+                        for id in record['done']:
+                            queued.pop(id, None)
+                    else:
+                        queued[record['id']] = record
+
+        for record in queued.values():
+            if record['sink'] in self.queues:
+                self.queues[record['sink']].pending[tuple(record['key'])] = (record['id'], record['notification'], 0)
+                self.undelivered[record['id']] = record
+            self.nextId = max(self.nextId, record['id'] + 1)
+        self.__compactJournal()
+
+    def __compactJournal(self):
+        """Rewrites the journal atomically, with only the notifications not yet delivered (the condition must be held).
+
+        """
+
+        if self.journal is not None:
+            self.journal.close()
+        temporaryPath = self.journalPath + '.tmp'
+        with open(temporaryPath, 'w') as journal:
+            journal.write(''.join(json.dumps(record) + '\n' for record in self.undelivered.values()))
+        os.replace(temporaryPath, self.journalPath)
+        self.journal = open(self.journalPath, 'a')
+        self.journalDone = 0
+
+    def __writeJournal(self, records):
+        """Appends records to the journal, or rewrites it once the delivered notifications make up most of it
+        (the condition must be held).
+
+        Args:
+            records (list): Records to append (see __loadJournal).
+
+        """
+
+        if self.journal is None or not records:
+            return
+
+        for record in records:
+            if 'done' in record:
+                for id in record['done']:
+                    self.undelivered.pop(id, None)
+                self.journalDone += len(record['done'])
+            else:
+                self.undelivered[record['id']] = record
+
+        # The cost of a rewrite is proportional to the notifications not yet delivered: only rewrite the journal
+        # when at least as many delivered ones are dropped
+        if self.journalDone >= max(JOURNAL_COMPACTION, len(self.undelivered)):
+            self.__compactJournal()
+        else:
+            self.journal.write(''.join(json.dumps(record) + '\n' for record in records))
+            self.journal.flush()
+
+    def submit(self, data):
+        """Queues a notification for every sink, without waiting for its delivery.
+
+        Args:
+            data (dict): Notification, as stored (see StorageBackend.appendAlert): host (str), timestamp (str),
+                type (str), startDate (str), endDate (str) and availability (float, the response time for the latency
+                notifications).
+
+        """
+
+        # The last column of the latency notifications is the response time instead of the availability
+        kind = ALERT_KINDS.get(data['type'], data['type'])
+        notification = {
+            'URL': data['host'],
+            'timestamp': data['timestamp'],
+            'type': data['type'],
+            'startDate': data['startDate'],
+            'endDate': data.get('endDate'),
+            'responseTime' if kind == 'latency' else 'availability': data['availability'],
+        }
+        key = (data['host'], kind)
+
+        with self.condition:
+            records = []
+            for name, queue in self.queues.items():
+                replaced = queue.pending.pop(key, None)
+                if replaced is not None:
+                    # The notification not yet delivered is replaced by the newer one
+                    records.append({ 'done': [replaced[0]] })
+                    self.counters['coalesced'] += 1
+                queue.pending[key] = (self.nextId, notification, time.monotonic())
+                records.append({ 'id': self.nextId, 'sink': name, 'key': key, 'notification': notification })
+                self.nextId += 1
+            self.__writeJournal(records)
+            self.condition.notify_all()
+
+    def __nextBatch(self, sink):
+        """Waits until a batch of notifications can be delivered to a sink, and takes it from the queue of the sink.
+
+        Args:
+            sink (WebhookSink or CommandSink): Sink to deliver to.
+
+        Returns:
+            A list of (<key (tuple)>, <id (int)>, <notification (dict)>) tuples, or None if the dispatcher is stopped.
+
+        """
+
+        queue = self.queues[sink.name]
+        with self.condition:
+            while not self.stopped:
+                now = time.monotonic()
+                if queue.pending and queue.deliveries < sink.concurrency:
+                    # Wait for the end of the retry delay, and for more notifications to batch (unless the batch is full)
+                    oldest = next(iter(queue.pending.values()))[2]
+                    readyAt = max(queue.retryAt, oldest + self.batchDelay if len(queue.pending) < sink.batchSize else 0)
+                    if readyAt <= now:
+                        batch = []
+                        while queue.pending and len(batch) < sink.batchSize:
+                            key, (id, notification, _) = queue.pending.popitem(last=False)
+                            batch.append((key, id, notification))
+                        queue.inFlight += len(batch)
+                        queue.deliveries += 1
+                        return batch
+                    self.condition.wait(readyAt - now)
+                else:
+                    self.condition.wait()
+        return None
+
+    def __work(self, sink):
+        """Delivers the notifications to a sink, until the dispatcher is stopped (run by the workers of the sink).
+
+        Args:
+            sink (WebhookSink or CommandSink): Sink to deliver to.
+
+        """
+
+        queue = self.queues[sink.name]
+        while True:
+            batch = self.__nextBatch(sink)
+            if batch is None:
+                return
+
+            try:
+                sink.deliver([notification for _, _, notification in batch])
+                error = None
+            except Exception as e:
+                error = '{}: {}'.format(type(e).__name__, e)
+
+            with self.condition:
+                queue.inFlight -= len(batch)
+                queue.deliveries -= 1
+                if error is None:
+                    queue.failures = 0
+                    queue.retryAt = 0
+                    queue.lastError = None
+                    self.counters['delivered'] += len(batch)
+                    self.__writeJournal([{ 'done': [id for _, id, _ in batch] }])
+                else:
+                    # Retry later, after a delay doubled at each consecutive failure
+                    queue.failures += 1
+                    queue.retryAt = time.monotonic() + min(self.retryDelay * 2 ** (queue.failures - 1), self.maxRetryDelay)
+                    queue.lastError = error
+                    self.counters['failures'] += 1
+                    superseded = []
+                    for key, id, notification in reversed(batch):
+                        if key in queue.pending:
+                            # A newer notification was submitted during the delivery
+                            superseded.append(id)
+                            self.counters['coalesced'] += 1
+                        else:
+                            queue.pending[key] = (id, notification, 0)
+                            queue.pending.move_to_end(key, last=False)
+                    if superseded:
+                        self.__writeJournal([{ 'done': superseded }])
+                self.condition.notify_all()
+
+    def start(self):
+        """Starts the workers delivering the notifications (as many per sink as its concurrency).
+
+        """
+
+        for sink in self.sinks:
+            for _ in range(sink.concurrency):
+                worker = threading.Thread(target=self.__work, args=[sink], daemon=True)
+                worker.start()
+                self.workers.append(worker)
+
+    def flush(self, timeout=None):
+        """Waits until all the notifications are delivered.
+
+        Args:
+            timeout (int/float, optional): Maximum time to wait, in seconds.
+
+        Returns:
+            True if all the notifications were delivered, False if the timeout expired first.
+
+        """
+
+        with self.condition:
+            return self.condition.wait_for(lambda: all(not queue.pending and not queue.inFlight for queue in self.queues.values()), timeout)
+
+    def stop(self):
+        """Stops the workers once their deliveries in progress are over (the notifications not yet delivered
+        stay in the journal, to be delivered at the next start).
+
+        """
+
+        with self.condition:
+            self.stopped = True
+            self.condition.notify_all()
+        for worker in self.workers:
+            worker.join()
+        if self.journal is not None:
+            self.journal.close()
+            self.journal = None
+
+    def stats(self):
+        """Returns the counters of the dispatcher.
+
+        Returns:
+            A dictionary containing:
+                pending (int): Number of notifications not yet delivered (over all the sinks),
+                delivered (int): Number of notifications delivered,
+                coalesced (int): Number of notifications replaced by a newer one before being delivered,
+                failures (int): Number of failed deliveries,
+                failing (dict of str:str): Last error of each sink whose last delivery failed.
+
+        """
+
+        with self.condition:
+            return dict(self.counters,
+                pending=sum(len(queue.pending) + queue.inFlight for queue in self.queues.values()),
+                failing={ name: queue.lastError for name, queue in self.queues.items() if queue.lastError is not None })
+
+def createDispatcher(config):
+    """Creates a dispatcher from the notifications section of the configuration file:
+    {
+        "sinks": [ <description of a sink (see createSink)>, ... ],
+        "queueDirectory": <directory of the journal of the queues (str, optional)>,
+        "batchDelay": <time a notification waits for others to be delivered in the same batch, in seconds (int/float, defaults to 1)>,
+        "retryDelay": <time before the first retry of a failed delivery, in seconds (int/float, defaults to 1)>,
+        "maxRetryDelay": <maximum time between two retries, in seconds (int/float, defaults to 300)>
+    }
+
+    Args:
+        config (dict): Notifications section of the configuration file.
+
+    Returns:
+        A Dispatcher (not started).
+
+    """
+
+    options = { key: config[key] for key in ('queueDirectory', 'batchDelay', 'retryDelay', 'maxRetryDelay') if key in config }
+    return Dispatcher([createSink(sink) for sink in config.get('sinks', [])], **options)
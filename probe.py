@@ -0,0 +1,438 @@
+import socket
+import threading
+from contextlib import contextmanager
+from time import perf_counter, monotonic
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+from urllib3.util import connection
+from urllib3.exceptions import NewConnectionError, ConnectTimeoutError
+
+try:
+    # dnspython gives the TTLs of the DNS records, which the system resolver doesn't
+    import dns.resolver
+    import dns.exception
+except ImportError:
+    dns = None
+
+"""Module dedicated to the HTTP requests sent by the Monitors.
+
+    Requests are sent with requests, through connection classes which time the phases of the
+    connection setup: DNS resolution, TCP connect and TLS handshake. The timing itself is only
+    a few perf_counter calls per request.
+    As requests are synchronous, the timings of the request being sent by a thread are stored
+    in a thread-local variable while the request is sent.
+
+    Host names are resolved through a DNS cache shared by all the Monitors of the process.
+
+"""
+
+# Timings of the request being sent by the current thread
+current = threading.local()
+
+class DNSResolutionError(NewConnectionError):
+    """Raised by the connections when their host name can't be resolved.
+
+    """
+
+class DNSError(requests.ConnectionError):
+    """Raised by request when the host name of the URL can't be resolved.
+
+    """
+
+def systemLookup(host, port, timeout=None):
+    """Queries the system resolver about a host name.
+    socket.getaddrinfo can't be given a timeout: with a timeout, it is called in a separate thread, which
+    is left to finish on its own if it takes too long.
+
+    Args:
+        host (str): Host name to resolve,
+        port (int): Port of the addresses,
+        timeout (float, optional): Maximum duration of the lookup, in seconds (None for no limit).
+
+    Returns:
+        The addresses, in the socket.getaddrinfo format.
+
+    Raises:
+        socket.gaierror: If the name can't be resolved,
+        socket.timeout: If the lookup took more than timeout seconds.
+
+    """
+
+    if timeout is None:
+        return socket.getaddrinfo(host, port, 0, socket.SOCK_STREAM)
+
+    result = {}
+    def run():
+        try:
+            result['addresses'] = socket.getaddrinfo(host, port, 0, socket.SOCK_STREAM)
+        except Exception as e:
+            result['error'] = e
+
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+    thread.join(max(timeout, 0))
+    if thread.is_alive():
+        raise socket.timeout('Resolving {} took more than {}s'.format(host, timeout))
+    if 'error' in result:
+        raise result['error']
+    return result['addresses']
+
+def lookup(host, port, timeout=None):
+    """Queries the resolver about a host name.
+
+    Args:
+        host (str): Host name to resolve,
+        port (int): Port of the addresses,
+        timeout (float, optional): Maximum duration of the lookup, in seconds (None for no limit).
+
+    Returns:
+        A tuple containing the addresses (in the socket.getaddrinfo format) and their TTL in seconds
+        (None if it isn't known).
+
+    Raises:
+        socket.gaierror: If the name can't be resolved,
+        socket.timeout: If the lookup took more than timeout seconds.
+
+    """
+
+    deadline = monotonic() + timeout if timeout is not None else None
+
+    if dns is not None:
+        addresses = []
+        ttls = []
+        for recordType, family in (('A', socket.AF_INET), ('AAAA', socket.AF_INET6)):
+            try:
+                # The queries of both record types share the time allowed to the lookup
+                lifetime = max(deadline - monotonic(), 0) if deadline is not None else None
+                answer = dns.resolver.resolve(host, recordType, lifetime=lifetime)
+            except dns.exception.Timeout as e:
+                raise socket.timeout('Resolving {} took more than {}s'.format(host, timeout)) from e
+            except dns.exception.DNSException:
+                continue
+            ttls.append(answer.rrset.ttl)
+            for record in answer:
+                sockaddr = (record.address, port) if family == socket.AF_INET else (record.address, port, 0, 0)
+                addresses.append((family, socket.SOCK_STREAM, socket.IPPROTO_TCP, '', sockaddr))
+        if addresses:
+            return addresses, min(ttls)
+
+    # Without dnspython, or for the names it can't resolve (such as the ones of the hosts file),
+    # fall back to the system resolver
+    return systemLookup(host, port, max(deadline - monotonic(), 0) if deadline is not None else None), None
+
+class PendingLookup():
+    """Lookup of a host name in progress, which other threads asking for the same name wait for.
+
+    Attributes:
+        done (threading.Event): Set when the lookup is finished,
+        addresses (list): Result of the lookup (None if it failed),
+        error (OSError): Error of the lookup, socket.gaierror or socket.timeout (None if it succeeded).
+
+    """
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.addresses = None
+        self.error = None
+
+class DNSCache():
+    """Cache of host name resolutions, which respects the TTLs of the DNS records.
+    Concurrent lookups of the same name are deduplicated: only one thread queries the resolver,
+    the others wait for its answer. When the resolver fails, an expired answer is served instead
+    (during at most maxStale seconds after its expiration). A lookup is bounded by the timeout given by the
+    caller (the connect timeout of the request), also when it waits for the lookup of another thread.
+    The TTLs are only known if dnspython is installed: otherwise, names are resolved by the system
+    resolver and their answers are kept defaultTTL seconds.
+
+    Attributes:
+        defaultTTL (float): Time during which an answer is kept when its TTL isn't known, in seconds,
+        maxStale (float): Time during which an expired answer can be served when the resolver fails, in seconds,
+        resolver (callable): Function querying the resolver (with the signature of lookup),
+        clock (callable): Function returning the current time, in seconds,
+        entries (dict of tuple:tuple): (addresses, expiration time) of each (host, port) pair,
+        pending (dict of tuple:PendingLookup): Lookups in progress,
+        hits (int): Number of answers served from the cache (including deduplicated lookups),
+        misses (int): Number of lookups sent to the resolver,
+        stale (int): Number of expired answers served because the resolver failed,
+        failures (int): Number of failed lookups without any answer to serve,
+        lock (threading.Lock): Lock protecting the cache.
+
+    """
+
+    def __init__(self, defaultTTL=60, maxStale=3600, resolver=lookup, clock=monotonic):
+        self.defaultTTL = defaultTTL
+        self.maxStale = maxStale
+        self.resolver = resolver
+        self.clock = clock
+        self.entries = {}
+        self.pending = {}
+        self.hits = 0
+        self.misses = 0
+        self.stale = 0
+        self.failures = 0
+        self.lock = threading.Lock()
+
+    def resolve(self, host, port, timeout=None):
+        """Resolves a host name, from the cache if possible.
+
+        Args:
+            host (str): Host name to resolve,
+            port (int): Port of the addresses,
+            timeout (float, optional): Maximum duration of the lookup, in seconds (None for no limit).
+
+        Returns:
+            A list of addresses, in the socket.getaddrinfo format.
+
+        Raises:
+            socket.gaierror: If the name can't be resolved and there is no expired answer to serve,
+            socket.timeout: If the lookup took more than timeout seconds and there is no expired answer to serve.
+
+        """
+
+        key = (host, port)
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry[1] > self.clock():
+                self.hits += 1
+                return entry[0]
+
+            lookup = self.pending.get(key)
+            if lookup is not None:
+                # Another thread is already querying the resolver, wait for its answer
+                self.hits += 1
+                owner = False
+            else:
+                lookup = self.pending[key] = PendingLookup()
+                self.misses += 1
+                owner = True
+
+        if not owner:
+            if not lookup.done.wait(timeout):
+                raise socket.timeout('Resolving {} took more than {}s'.format(host, timeout))
+            if lookup.error is not None:
+                raise lookup.error
+            return lookup.addresses
+
+        try:
+            addresses, ttl = self.resolver(host, port, timeout)
+            with self.lock:
+                self.entries[key] = (addresses, self.clock() + (ttl if ttl is not None else self.defaultTTL))
+            lookup.addresses = addresses
+        except (socket.gaierror, socket.timeout) as e:
+            with self.lock:
+                if entry is not None and entry[1] + self.maxStale > self.clock():
+                    # Serve the expired answer rather than failing
+                    self.stale += 1
+                    lookup.addresses = entry[0]
+                else:
+                    self.failures += 1
+                    lookup.error = e
+        except Exception as e:
+            # Unexpected errors are also given to the waiting threads
+            lookup.error = e
+            raise
+        finally:
+            with self.lock:
+                del self.pending[key]
+            lookup.done.set()
+
+        if lookup.error is not None:
+            raise lookup.error
+        return lookup.addresses
+
+    def stats(self):
+        """Returns the counters of the cache.
+
+        Returns:
+            A dictionary containing the hits, misses, stale and failures counters, and the number of cached names (size).
+
+        """
+
+        with self.lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'stale': self.stale,
+                'failures': self.failures,
+                'size': len(self.entries),
+            }
+
+# DNS cache shared by all the requests of the process
+dnsCache = DNSCache()
+
+class ConcurrencyLimiter():
+    """Limits the number of requests sent at the same time, in total and to each host, so that the load stays
+    bounded when the monitored websites misbehave.
+
+    Attributes:
+        maxTotal (int): Maximum number of requests in progress (None for no limit),
+        maxPerHost (int): Maximum number of requests in progress to the same host (None for no limit),
+        total (threading.Semaphore): Slots of the requests in progress,
+        hosts (dict of str:threading.Semaphore): Slots of the requests in progress to each host,
+        lock (threading.Lock): Lock protecting the hosts dictionary.
+
+    """
+
+    def __init__(self, maxTotal=None, maxPerHost=None):
+        self.maxTotal = maxTotal
+        self.maxPerHost = maxPerHost
+        self.total = threading.Semaphore(maxTotal) if maxTotal is not None else None
+        self.hosts = {}
+        self.lock = threading.Lock()
+
+    @contextmanager
+    def slot(self, host):
+        """Context manager holding a request slot for a host during its block, waiting for a free slot if needed.
+
+        Args:
+            host (str): Host the request is sent to.
+
+        """
+
+        semaphores = []
+        if self.maxPerHost is not None:
+            with self.lock:
+                semaphores.append(self.hosts.setdefault(host, threading.Semaphore(self.maxPerHost)))
+        if self.total is not None:
+            semaphores.append(self.total)
+
+        # The host slot is taken first, so that requests waiting for a busy host don't hold a global slot
+        acquired = []
+        try:
+            for semaphore in semaphores:
+                semaphore.acquire()
+                acquired.append(semaphore)
+            yield
+        finally:
+            for semaphore in reversed(acquired):
+                semaphore.release()
+
+def recordTiming(phase, duration):
+    """Adds a duration to a phase of the timings of the request being sent by the current thread.
+
+    Args:
+        phase (str): Name of the phase (dns, connect or tls),
+        duration (float): Duration to add, in seconds.
+
+    """
+
+    timings = getattr(current, 'timings', None)
+    if timings is not None:
+        timings[phase] = timings.get(phase, 0) + duration
+
+class TimedHTTPConnection(HTTPConnection):
+    """HTTP connection which times the DNS resolution and the TCP connect of its socket.
+
+    Attributes:
+        setupTime (float): Time spent in the last DNS resolution and TCP connect, in seconds.
+
+    """
+
+    setupTime = 0
+
+    def _new_conn(self):
+        # Same as HTTPConnection._new_conn, with the resolution of the host name done separately
+        start = perf_counter()
+
+        try:
+            # Resolve the host name first (through the DNS cache), so that the resolution is timed separately;
+            # the resolution counts in the connect timeout
+            timeout = self.timeout if isinstance(self.timeout, (int, float)) else None
+            try:
+                addresses = dnsCache.resolve(self.host, self.port, timeout)
+            except socket.gaierror as e:
+                raise DNSResolutionError(self, 'Failed to resolve {}: {}'.format(self.host, e)) from e
+            except socket.timeout as e:
+                raise ConnectTimeoutError(self, 'Resolving {} timed out (connect timeout={})'.format(self.host, timeout)) from e
+            resolved = perf_counter()
+            recordTiming('dns', resolved - start)
+
+            # Then connect to the resolved addresses, in order, until one of them answers
+            for i, address in enumerate(addresses):
+                try:
+                    sock = connection.create_connection((address[4][0], self.port), self.timeout,
+                        source_address=self.source_address, socket_options=self.socket_options)
+                    break
+                except socket.timeout as e:
+                    raise ConnectTimeoutError(self, 'Connection to {} timed out (connect timeout={})'.format(self.host, self.timeout)) from e
+                except OSError as e:
+                    if i == len(addresses) - 1:
+                        raise NewConnectionError(self, 'Failed to establish a new connection: {}'.format(e)) from e
+            recordTiming('connect', perf_counter() - resolved)
+            return sock
+
+        finally:
+            self.setupTime = perf_counter() - start
+
+class TimedHTTPSConnection(TimedHTTPConnection, HTTPSConnection):
+    """HTTPS connection which also times the TLS handshake.
+
+    """
+
+    def connect(self):
+        start = perf_counter()
+        self.setupTime = 0
+        try:
+            super().connect()
+        finally:
+            # The TLS handshake is what connect does after the DNS resolution and TCP connect
+            recordTiming('tls', perf_counter() - start - self.setupTime)
+
+class TimedHTTPConnectionPool(HTTPConnectionPool):
+    ConnectionCls = TimedHTTPConnection
+
+class TimedHTTPSConnectionPool(HTTPSConnectionPool):
+    ConnectionCls = TimedHTTPSConnection
+
+class TimedAdapter(HTTPAdapter):
+    """Transport adapter using the timed connection classes.
+
+    """
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            'http': TimedHTTPConnectionPool,
+            'https': TimedHTTPSConnectionPool,
+        }
+
+def request(method, URL, timings=None, **kwargs):
+    """Sends a request, as requests.request, on a new connection whose setup phases are timed.
+
+    Args:
+        method (str): HTTP method of the request,
+        URL (str): URL of the request,
+        timings (dict, optional): Dictionary in which the durations (in seconds) of the setup phases of the request
+            are stored, under the keys dns, connect and tls (a phase which didn't happen is not stored),
+        kwargs: Other arguments of requests.request.
+
+    Returns:
+        A requests.Response object.
+
+    Raises:
+        DNSError: If the host name of the URL can't be resolved,
+        requests.RequestException: For the other errors, as requests.request.
+
+    """
+
+    # Use a new session for each request, as requests.request does, so that every probe goes through
+    # all the phases of a connection instead of reusing a pooled connection
+    with requests.Session() as session:
+        adapter = TimedAdapter()
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+
+        current.timings = timings
+        try:
+            return session.request(method, URL, **kwargs)
+        except requests.ConnectionError as e:
+            # Make the DNS failures distinguishable from the other connection errors
+            # (requests wraps the error of the connection in a urllib3 MaxRetryError)
+            reason = getattr(e.args[0], 'reason', None) if e.args else None
+            if isinstance(reason, DNSResolutionError):
+                raise DNSError(*e.args, request=e.request, response=e.response) from e
+            raise
+        finally:
+            current.timings = None
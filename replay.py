@@ -0,0 +1,260 @@
+import json
+import heapq
+import random
+from time import perf_counter
+from datetime import datetime, timedelta
+import dbutils
+from retriever import Retriever
+from latency import LatencyDetector
+from utils import formatAlert, formatReplay
+from storage import MemoryBackend, ALERT_TYPES, SAMPLE_FIELDS, SAMPLE_TIMESTAMP_FORMAT
+
+"""Module dedicated to the replay of data points through the aggregation and alerting logic of the app.
+
+    Recorded data points (read from a monitoring database) or synthetic ones (generated from a
+    specification) are fed, in time order, to the same pipeline as the monitoring mode: the data
+    points are stored in an in-memory storage, the latency alerts are computed for each data point,
+    and every 10 seconds (of data) the stats of all the websites are aggregated and their alert status
+    is checked. The pipeline runs under a virtual clock, set to the date of the data, so that weeks of
+    data are replayed as fast as the pipeline goes.
+
+"""
+
+class VirtualClock():
+    """Clock giving the date of the data being replayed, to be injected in the Retrievers and LatencyDetectors.
+
+    Attributes:
+        now (datetime.datetime): Current (virtual) UTC date.
+
+    """
+
+    def __init__(self, now=None):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+def recordedSamples(dbName, since=None, until=None):
+    """Reads the data points recorded in a monitoring database, in time order.
+
+    Args:
+        dbName (str): Name of the database to read,
+        since (datetime.datetime, optional): Only read the data points recorded from this date,
+        until (datetime.datetime, optional): Only read the data points recorded before this date.
+
+    Yields:
+        Data points, as dictionaries in the format of Monitor.get.
+
+    """
+
+    # The data points of a previous version of the app are only read once converted (see dbutils.migrateDatabase)
+    dbutils.checkLayout(dbName)
+    for row in dbutils.iterSamplesBetween(dbName, since, until):
+        sample = dict(zip(SAMPLE_FIELDS, row[1:]))
+        sample['host'] = row[0]
+        yield sample
+
+def syntheticSamples(spec):
+    """Generates data points from a specification, in time order.
+    The specification is a dictionary with the following format:
+    {
+        "start": <date of the first data points (str, YYYY-MM-DD[ HH:MM:SS])>,
+        "duration": <duration of the data, in seconds (int/float)>,
+        "seed": <seed of the random generator (int, optional)>,
+        "websites": [
+            {
+                "URL": <urlOfWebsite1 (str)>,
+                "checkInterval": <interval between two data points, in seconds (int/float, defaults to 2)>,
+                "responseTime": <median response time, in milliseconds (int/float, defaults to 100)>,
+                "jitter": <standard deviation of the logarithm of the response times (float, defaults to 0.2)>,
+                "copies": <number of websites generated from this description (int, defaults to 1)>,
+                "incidents": [
+                    {
+                        "start": <start of the incident, in seconds after the start of the data (int/float)>,
+                        "duration": <duration of the incident, in seconds (int/float)>,
+                        "availability": <probability that the website answers (float, defaults to 1)>,
+                        "responseTime": <median response time during the incident (int/float, optional)>
+                    },
+                    ...
+                ]
+            },
+            ...
+        ]
+    }
+    The copies of a website are named <URL>/<number of the copy> (when there are several of them).
+
+    Args:
+        spec (dict): Specification of the data points.
+
+    Yields:
+        Data points, as dictionaries in the format of Monitor.get.
+
+    """
+
+    start = datetime.fromisoformat(spec['start'])
+    duration = spec['duration']
+    generator = random.Random(spec.get('seed'))
+
+    def website(URL, description):
+        # Data points of a website, in time order
+        interval = description.get('checkInterval', 2)
+        jitter = description.get('jitter', 0.2)
+        incidents = description.get('incidents', [])
+        t = 0
+        while t < duration:
+            responseTime = description.get('responseTime', 100)
+            availability = 1
+            for incident in incidents:
+                if incident['start'] <= t < incident['start'] + incident['duration']:
+                    responseTime = incident.get('responseTime', responseTime)
+                    availability = incident.get('availability', availability)
+
+            sample = { 'timestamp': (start + timedelta(seconds=t)).strftime(SAMPLE_TIMESTAMP_FORMAT), 'host': URL }
+            if generator.random() < availability:
+                sample.update({ 'available': True, 'status': 200,
+                    'responseTime': responseTime * generator.lognormvariate(0, jitter), 'failure': None })
+            else:
+                sample.update({ 'available': False, 'status': None, 'responseTime': None, 'failure': 'timeout' })
+            yield sample
+            t += interval
+
+    websites = []
+    for description in spec['websites']:
+        copies = description.get('copies', 1)
+        for i in range(copies):
+            URL = description['URL'] if copies == 1 else '{}/{}'.format(description['URL'], i)
+            websites.append(website(URL, description))
+
+    # The timestamps have the same format, so they are merged as strings
+    return heapq.merge(*websites, key=lambda sample: sample['timestamp'])
+
+def loadSpec(fileName):
+    """Loads a specification of synthetic data points (see syntheticSamples) from a JSON file.
+
+    Args:
+        fileName (str): Path to the specification file.
+
+    Returns:
+        The specification, as a dictionary.
+
+    """
+
+    with open(fileName) as file:
+        return json.load(file)
+
+class Replay():
+    """Replays data points through the aggregation and alerting logic of the monitoring mode, under a virtual clock.
+
+    Attributes:
+        printInterval (int/float): Interval between two alert checks (and stats aggregations), in seconds of data,
+        clock (VirtualClock): Clock giving the date of the data being replayed,
+        storage (MemoryBackend): Storage of the replayed data points and of the notifications,
+        retrievers (dict of str:Retriever): Retriever of each website,
+        detectors (dict of str:LatencyDetector): Detector of the latency alerts of each website,
+        samples (int): Number of data points replayed,
+        checks (int): Number of alert checks (and stats aggregations) done.
+
+    """
+
+    def __init__(self, printInterval=10):
+        """Initializes an empty pipeline.
+
+        Args:
+            printInterval (int/float, optional): Interval between two alert checks, in seconds of data (the
+                interval between two stat prints of the monitoring mode).
+
+        """
+
+        self.printInterval = printInterval
+        self.clock = VirtualClock()
+        self.storage = MemoryBackend()
+        self.retrievers = {}
+        self.detectors = {}
+        self.samples = 0
+        self.checks = 0
+
+    def __check(self, countdownToNextMinute):
+        """Aggregates the stats of all the websites and checks their alert status, as the monitoring mode does.
+
+        Args:
+            countdownToNextMinute (int): Number of checks to go before the next aggregation of the hourly stats.
+
+        """
+
+        now = self.clock()
+        self.storage.bulkWindowAggregate(self.retrievers, 2, now)
+        self.storage.bulkWindowAggregate(self.retrievers, 10, now)
+        if countdownToNextMinute == 0:
+            self.storage.bulkWindowAggregate(self.retrievers, 60, now)
+        for retriever in self.retrievers.values():
+            retriever.checkAlert()
+        self.checks += 1
+
+    def run(self, samples):
+        """Replays data points, in time order.
+
+        Args:
+            samples (iterable): Data points to replay, as dictionaries in the format of Monitor.get, in time order.
+
+        Returns:
+            A dictionary containing:
+                samples (int): Number of data points replayed,
+                websites (int): Number of websites,
+                notifications (list): Notifications raised, in the format of StorageBackend.iterAlerts,
+                dataSeconds (float): Duration of the replayed data, in seconds,
+                wallSeconds (float): Duration of the replay, in seconds.
+
+        """
+
+        start = perf_counter()
+        first = nextCheck = None
+        countdownToNextMinute = 5
+
+        for sample in samples:
+            date = datetime.fromisoformat(sample['timestamp'])
+            if first is None:
+                first = date
+                nextCheck = date + timedelta(seconds=self.printInterval)
+
+            # Run the alert checks due before the data point
+            while nextCheck <= date:
+                self.clock.now = nextCheck
+                self.__check(countdownToNextMinute)
+                countdownToNextMinute = countdownToNextMinute - 1 if countdownToNextMinute > 0 else 5
+                nextCheck += timedelta(seconds=self.printInterval)
+
+            self.clock.now = date
+            host = sample['host']
+            if host not in self.retrievers:
+                self.retrievers[host] = Retriever(host, self.storage, clock=self.clock)
+                self.detectors[host] = LatencyDetector(host, self.storage, clock=self.clock)
+            self.storage.appendSample(sample)
+            self.detectors[host].add(sample)
+            self.samples += 1
+
+        if first is not None:
+            # A last alert check at the end of the data
+            self.__check(countdownToNextMinute)
+
+        return {
+            'samples': self.samples,
+            'websites': len(self.retrievers),
+            'notifications': list(self.storage.iterAlerts()),
+            'dataSeconds': (self.clock() - first).total_seconds() if first is not None else 0,
+            'wallSeconds': perf_counter() - start,
+        }
+
+def printReport(report):
+    """Prints the notifications raised by a replay, then its throughput and the number of notifications of each type.
+
+    Args:
+        report (dict): Report of the replay (see Replay.run).
+
+    """
+
+    for timestamp, host, type, startDate, endDate, value in report['notifications']:
+        alertData = { 'URL': host, 'type': type, 'startDate': startDate, 'endDate': endDate }
+        # The last column of the latency notifications is the response time instead of the availability
+        alertData['responseTime' if type in ALERT_TYPES['latency'] else 'availability'] = value
+        print(formatAlert(alertData))
+    print(formatReplay(report))
@@ -1,7 +1,5 @@
-from collections import Counter
 from datetime import datetime
-from utils import formatTime
-from dbutils import queryValues, queryLastValue, insertValue
+from storage import openBackend
 
 class Retriever():
     """Class whose goal is to get a website's monitoring data and compute interesting metrics about it.
@@ -9,25 +7,44 @@ class Retriever():
 
     Attributes:
         URL (str): URL of the monitored website,
-        dbName (str): Name of the database to use,
+        storage (StorageBackend): Storage backend to use,
+        clock (callable): Function returning the current UTC date,
+        dispatcher (notifications.Dispatcher): Dispatcher the new notifications are submitted to (None if there is none),
         isOnAlert (bool): Indicates alert status locally.
     """
 
-    def __init__(self, URL, dbName):
-        """Sets the URL and database name as speficied in the parameters.
+    def __init__(self, URL, storage, clock=datetime.utcnow, dispatcher=None):
+        """Sets the URL and storage as speficied in the parameters.
 
         Args:
             URL (str): URL of the monitored website,
-            dbName (str): Name of the database to use.
+            storage (str or StorageBackend): Storage backend to use, or its URI (see storage.openBackend),
+            clock (callable, optional): Function returning the current UTC date (datetime.datetime),
+            dispatcher (notifications.Dispatcher, optional): Dispatcher the new notifications are submitted to, to be
+                delivered to external receivers.
 
         """
 
         self.URL = URL
         self.isOnAlert = False
-        self.dbName = dbName
+        self.storage = openBackend(storage)
+        self.clock = clock
+        self.dispatcher = dispatcher
+
+    def restore(self, lastAlert):
+        """Restores the local alert state from the most recent notification about the website, so that
+        a restarted app carries on with the alerts raised before it stopped.
+
+        Args:
+            lastAlert (tuple): Most recent notification about the website (see StorageBackend.lastAlert),
+                or None if there is none.
+
+        """
+
+        self.isOnAlert = lastAlert is not None and lastAlert[2] == 'alert'
 
     def getStats(self, minutes):
-        """Retrieves data about the monitored website from the database.
+        """Retrieves data about the monitored website from the storage.
         The data retrieved is only the data recorded during the last {minutes} minutes;
 
         Args:
@@ -45,48 +62,50 @@ class Retriever():
 
         """
 
-        # First, query the database
-        queryData = {
-            "host": self.URL,
-            "minutes": minutes
-        }
-        data = queryValues(self.dbName, 'website_monitoring', queryData)
+        # The aggregation itself is done by the storage backend
+        return self.storage.windowAggregate(self.URL, minutes, self.clock())
 
-        if len(data) > 0:
-            # If there is available data
-            # Create a counter of number of times the site was available or not
-            availables = Counter([elt[1] for elt in data if elt[1] is not None])
+    def alertStatus(self, lastAlert, availability):
+        """Gives the alert status of the website from data loaded beforehand (for example for all the websites at
+        once), as long as no notification has to be sent: in that case, checkAlert must be called, so that the
+        notification is decided from the current data and stored.
 
-            # Create a counter of status codes
-            statusCodes = Counter([elt[2] for elt in data])
+        Args:
+            lastAlert (tuple): Most recent notification about the website (see StorageBackend.lastAlert),
+                or None if there is none,
+            availability (float): Availability of the website over the last 2 minutes, or None if there is
+                no data about the website over this timeframe.
 
-            # Create an array containing all the (not None) response times
-            responseTimes = [elt[3] for elt in data if elt[3] is not None]
-        else:
-            # If there is no data available, return that there is no data available
-            return False, {}
-
-        # Compute some interesting statistics
-        nRT = len(responseTimes)
-        minRT = min(responseTimes, default=float('inf'))
-        maxRT = max(responseTimes, default=float('inf'))
-        try:
-            avgRT = sum(responseTimes) / nRT
-        except:
-            avgRT = float('inf')
-
-        # Compute the availability
-        n = sum(availables.values())
-        availability = availables[True] / n
-
-        # And return these stats in a dictionary
-        return True, {
+        Returns:
+            The alert status (see checkAlert), or None if a notification may have to be sent.
+
+        """
+
+        if availability is None:
+            # It is not possible to assert the site's status
+            return { 'type': None }
+
+        if self.isOnAlert and availability >= 0.8:
+            # The website has recovered: a recovery signal has to be sent
+            return None
+
+        if lastAlert is not None and lastAlert[2] == 'alert':
+            # If the website was in alert status and still is, send a downtime signal
+            # Change the local alert state to True
+            self.isOnAlert = True
+            return {
+                'type': 'alert',
+                'URL': self.URL,
                 'availability': availability,
-                'statusCodes': statusCodes,
-                'avgRT': avgRT,
-                'minRT': minRT,
-                'maxRT': maxRT,
-                }
+                'startDate': lastAlert[3]
+            }
+
+        if availability < 0.8:
+            # The website is now down: an alert has to be sent
+            return None
+
+        # If there's no problem, only send that type is None
+        return { 'type': None }
 
     def checkAlert(self):
         """Checks if an availability alert (or recovery) message should be sent, and also stores the notification data in
@@ -104,10 +123,7 @@ class Retriever():
         """
 
         # First, get the last notification about the website in order to know its current status
-        queryData = {
-            'host': self.URL,
-        }
-        data = queryLastValue(self.dbName, 'website_alerts', queryData)
+        data = self.storage.lastAlert(self.URL)
 
         if data is None:
             # There are no notifications about the website in the database
@@ -124,23 +140,19 @@ class Retriever():
                 endDate = data[4]
 
         # Then, retrieve the website's data on the last 2 minutes
-        queryData = {
-            "host": self.URL,
-            "minutes": 2
-        }
-        data = queryValues(self.dbName, 'website_monitoring', queryData)
-
-        availables = Counter([elt[1] for elt in data])
-        n = sum(availables.values())
-        if n == 0:
+        now = self.clock()
+        availableStats, stats = self.storage.windowAggregate(self.URL, 2, now)
+        if not availableStats:
             # If there is no data about the website in the past 2 minutes, it is not possible to
             # assert the site's status, we return that there is no new notification
             return { 'type': None }
 
-        # Compute the site's availability
-        availability = availables[True] / n
-        currentDate = datetime.utcnow().strftime('%d/%m/%Y %H:%M:%S')
-
+        # Get the site's availability, and the status of the website if there is no notification to send
+        availability = stats['availability']
+        currentDate = now.strftime('%d/%m/%Y %H:%M:%S')
+        status = self.alertStatus(data, availability)
+        if status is not None:
+            return status
 
         if isOnAlert and self.isOnAlert and availability >= 0.8:
             # If the website was in alert status locally and in the database but has recovered,
@@ -157,7 +169,9 @@ class Retriever():
                 'endDate': currentDate,
                 'availability': availability,
             }
-            insertValue(self.dbName, 'website_alerts', queryData)
+            self.storage.appendAlert(queryData)
+            if self.dispatcher is not None:
+                self.dispatcher.submit(queryData)
 
             # Return data about the recovery
             return {
@@ -183,19 +197,6 @@ class Retriever():
                 'endDate': endDate
             }
 
-        if isOnAlert:
-            # If the website was in alert status and still is, send a downtime signal
-            # Change the local alert state to True
-            self.isOnAlert = True
-
-            # Return data about the alert
-            return {
-                'type': 'alert',
-                'URL': self.URL,
-                'availability': availability,
-                'startDate': startDate
-            }
-
         if not(isOnAlert) and availability < 0.8:
             # If the website is now down, update the alert values and then send a downtime signal
             # Also write the alert notification in the database
@@ -211,7 +212,9 @@ class Retriever():
                 'endDate': None,
                 'availability': availability,
             }
-            insertValue(self.dbName, 'website_alerts', queryData)
+            self.storage.appendAlert(queryData)
+            if self.dispatcher is not None:
+                self.dispatcher.submit(queryData)
 
             return {
                 'type': 'alert',
@@ -219,6 +222,3 @@ class Retriever():
                 'availability': availability,
                 'startDate': currentDate,
             }
-
-        # If there's no problem, only send that type is None
-        return { 'type': None }
@@ -0,0 +1,137 @@
+from time import monotonic
+
+"""Module dedicated to the scheduling of the checks of the monitored websites.
+
+    A website can be checked at a fixed interval, or at an adaptive interval: while the website is
+    healthy, the interval backs off towards a maximum interval, and as soon as a check fails (or its
+    response time spikes), the website is checked at its base interval again.
+
+"""
+
+# Time during which a website is checked at its base interval after a problem, in seconds:
+# the alerting window of Retriever.checkAlert, so that an availability window containing a problem
+# is always as dense as with a fixed interval
+HOLD_TIME = 120
+
+# Factor by which the interval grows after each healthy check, once the hold time is over
+BACKOFF_FACTOR = 1.5
+
+# A response time is a spike if it is more than this factor times the average response time
+SPIKE_FACTOR = 3
+
+# Weight of the last response time in the (exponentially weighted) average response time
+SMOOTHING = 0.1
+
+class CheckSchedule():
+    """Interval between the checks of a website, adapted to the health of the website.
+    With a maximum interval equal to the base interval, the website is checked at a fixed interval.
+
+    A problem appearing while the interval is backed off is seen at most maxInterval seconds after
+    it started (instead of checkInterval with a fixed interval), and from then on the website is
+    checked at its base interval. As the availability window then contains fewer healthy data points,
+    an alert needs fewer failed checks to be raised than with a fixed interval.
+
+    Attributes:
+        checkInterval (float): Base interval between two checks, in seconds,
+        maxInterval (float): Maximum interval between two checks, in seconds,
+        clock (callable): Function returning the current time, in seconds,
+        interval (float): Current interval between two checks, in seconds,
+        lastCheck (float): Time of the last check (None if there was none),
+        lastProblem (float): Time of the last failed or slow check (None if there was none),
+        averageRT (float): Exponentially weighted average of the response times of the healthy checks, in milliseconds.
+
+    """
+
+    def __init__(self, checkInterval, maxInterval=None, clock=monotonic):
+        """Sets the intervals of the schedule.
+
+        Args:
+            checkInterval (int/float): Base interval between two checks, in seconds,
+            maxInterval (int/float, optional): Maximum interval between two checks, in seconds (defaults to
+                checkInterval, i.e. a fixed interval),
+            clock (callable, optional): Function returning the current time, in seconds.
+
+        """
+
+        self.checkInterval = checkInterval
+        self.maxInterval = max(maxInterval or checkInterval, checkInterval)
+        self.clock = clock
+        self.interval = checkInterval
+        self.lastCheck = None
+        self.lastProblem = None
+        self.averageRT = None
+
+    def isAdaptive(self):
+        """Returns whether the interval of the schedule can change.
+
+        """
+
+        return self.maxInterval > self.checkInterval
+
+    def isDue(self):
+        """Returns whether the website should be checked now, and if so, records the time of the check.
+        It is meant to be called every checkInterval seconds: the current interval is then rounded to
+        the nearest multiple of checkInterval.
+
+        """
+
+        now = self.clock()
+        if self.lastCheck is not None and now - self.lastCheck < self.interval - self.checkInterval / 2:
+            return False
+        self.lastCheck = now
+        return True
+
+    def restore(self, recentStats):
+        """Restores the state of the schedule from the recent stats of the website, so that a restarted app
+        doesn't start by backing off from a website which was failing when it stopped.
+
+        Args:
+            recentStats (tuple): Stats of the website over the hold time (see Retriever.getStats).
+
+        """
+
+        availableStats, stats = recentStats
+        if not availableStats:
+            return
+
+        if stats['avgRT'] != float('inf'):
+            self.averageRT = stats['avgRT']
+        if stats['availability'] < 1:
+            # A problem happened during the hold time: check the website at the base interval
+            self.lastProblem = self.clock()
+            self.interval = self.checkInterval
+
+    def next(self, sample):
+        """Updates the interval with the result of a check.
+
+        Args:
+            sample (dict): Data point stored by the check (see Monitor.get), with at least its
+                availability (available (bool)) and response time (responseTime (float)).
+
+        Returns:
+            The interval before the next check, in seconds.
+
+        """
+
+        if not self.isAdaptive():
+            return self.checkInterval
+
+        now = self.clock()
+        responseTime = sample.get('responseTime')
+
+        if not sample['available'] or responseTime is None:
+            problem = True
+        else:
+            # The response time is compared to the average response time of the healthy checks
+            problem = self.averageRT is not None and responseTime > SPIKE_FACTOR * self.averageRT
+            if not problem:
+                self.averageRT = responseTime if self.averageRT is None else SMOOTHING * responseTime + (1 - SMOOTHING) * self.averageRT
+
+        if problem:
+            # Go back to the base interval, and stay there during the hold time
+            self.lastProblem = now
+            self.interval = self.checkInterval
+        elif self.lastProblem is None or now - self.lastProblem >= HOLD_TIME:
+            self.interval = min(self.interval * BACKOFF_FACTOR, self.maxInterval)
+
+        return self.interval
@@ -0,0 +1,312 @@
+import os
+import mmap
+import math
+import struct
+import calendar
+import threading
+from bisect import bisect_right
+from datetime import datetime, timedelta
+from urllib.parse import quote, unquote
+import failures
+from contentCheck import CONTENT_RESULTS
+
+"""Module dedicated to the storage of the website_monitoring data in append-only segment files.
+
+    Each website has its own directory, containing segment files of fixed-width binary records.
+    A segment file is named after the timestamp of its first record, which gives a sparse time
+    index of the segments of a website: a window lookup only opens the segments which may contain
+    records of the window, and finds the first record of the window by binary search on time
+    inside the memory-mapped segment.
+
+"""
+
+# Fields of a data point stored as floats in a record (NaN if None), after the fixed fields
+FLOAT_FIELDS = ('responseTime', 'transferTime', 'dnsTime', 'connectTime', 'tlsTime', 'firstByteTime', 'downloadTime')
+
+# Classes of failures, stored as their index in this tuple (0 for None)
+FAILURE_CLASSES = (None,) + failures.FAILURE_CLASSES
+
+# Binary layout of a record: timestamp (float, seconds since epoch), status (short, -1 if None),
+# available (signed char, -1 if None), failure (signed char, index in FAILURE_CLASSES), the FLOAT_FIELDS,
+# then the size of the body (long long, -1 if None) and the result of the content check (signed char, index
+# in CONTENT_RESULTS, -1 if None)
+RECORD = struct.Struct('<dhbb' + 'd' * len(FLOAT_FIELDS) + 'qb')
+
+# Name of the file describing the record layout of the segments of a directory
+LAYOUT_FILE = 'layout'
+
+# Number of records after which a new segment file is started
+SEGMENT_RECORDS = 4096
+
+# Format of the timestamps used in the website_monitoring table
+TIMESTAMP_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+def toEpoch(timestamp):
+    """Converts a website_monitoring timestamp (UTC) to a number of seconds since epoch.
+
+    Args:
+        timestamp (str): String representing a date in the format "%Y-%m-%d %H:%M:%S".
+
+    Returns:
+        The corresponding number of seconds since epoch (float).
+
+    """
+
+    return float(calendar.timegm(datetime.strptime(timestamp, TIMESTAMP_FORMAT).timetuple()))
+
+def fromEpoch(epoch):
+    """Converts a number of seconds since epoch to a website_monitoring timestamp (UTC).
+
+    Args:
+        epoch (float): Number of seconds since epoch.
+
+    Returns:
+        A string representing the date in the format "%Y-%m-%d %H:%M:%S".
+
+    """
+
+    return datetime.utcfromtimestamp(epoch).strftime(TIMESTAMP_FORMAT)
+
+def toRow(record):
+    """Converts a binary record to a row in the same format as the website_monitoring table queries.
+
+    Args:
+        record (tuple): Unpacked record (<timestamp (float)>, <status (int)>, <available (int)>, <failure (int)>,
+            <FLOAT_FIELDS (float)>..., <bodyBytes (int)>, <contentCheck (int)>).
+
+    Returns:
+        A tuple (<timestamp (str)>, <available (bool)>, <status (int)>, <FLOAT_FIELDS (float)>..., <failure (str)>,
+        <bodyBytes (int)>, <contentCheck (str)>).
+
+    """
+
+    timestamp, status, available, failure = record[:4]
+    bodyBytes, contentCheck = record[-2:]
+    return (
+        fromEpoch(timestamp),
+        bool(available) if available >= 0 else None,
+        status if status >= 0 else None,
+    ) + tuple(value if not math.isnan(value) else None for value in record[4:-2]) + (
+        FAILURE_CLASSES[failure],
+        bodyBytes if bodyBytes >= 0 else None,
+        CONTENT_RESULTS[contentCheck] if contentCheck >= 0 else None,
+    )
+
+class SegmentStore():
+    """Storage engine for the website_monitoring data, based on memory-mapped append-only segment files.
+    It is used by the segments storage backend (see storage.py) for the website_monitoring data.
+    A single instance is meant to be shared by all the threads of the app.
+
+    Attributes:
+        directory (str): Directory in which the segments are stored,
+        segments (dict of str:list): Sorted start timestamps of the segments of each website,
+        counts (dict of str:int): Number of records in the last segment of each website,
+        lastTimestamps (dict of str:float): Timestamp of the last record of each website,
+        lock (threading.Lock): Lock protecting the segments index and the appends.
+
+    """
+
+    def __init__(self, directory):
+        """Sets the storage directory and loads the segments index from it.
+
+        Args:
+            directory (str): Directory in which the segments are stored (created if it does not exist).
+
+        """
+
+        self.directory = directory
+        self.segments = {}
+        self.counts = {}
+        self.lastTimestamps = {}
+        self.lock = threading.Lock()
+
+        os.makedirs(directory, exist_ok=True)
+
+        # Check that the existing segments have the same record layout (a directory without
+        # layout file but with segments was written by the first version of the store)
+        layoutPath = os.path.join(directory, LAYOUT_FILE)
+        if os.path.exists(layoutPath):
+            with open(layoutPath) as layoutFile:
+                layout = layoutFile.read().strip()
+        elif any(os.path.isdir(os.path.join(directory, name)) for name in os.listdir(directory)):
+            layout = '<ddhbx'
+        else:
+            layout = RECORD.format
+            with open(layoutPath, 'w') as layoutFile:
+                layoutFile.write(layout)
+        if layout != RECORD.format:
+            raise ValueError('The segments in {} use another record layout ({}), use a new directory'.format(directory, layout))
+
+        for hostDir in os.listdir(directory):
+            if not os.path.isdir(os.path.join(directory, hostDir)):
+                continue
+
+            # For each website directory, rebuild the sparse index from the segment file names
+            host = unquote(hostDir)
+            starts = sorted(float(name[:-4]) for name in os.listdir(os.path.join(directory, hostDir)) if name.endswith('.seg'))
+            if starts:
+                self.segments[host] = starts
+                self.counts[host] = os.path.getsize(self.__segmentPath(host, starts[-1])) // RECORD.size
+                record = self.__lastRecord(host, starts[-1])
+                self.lastTimestamps[host] = record[0] if record is not None else starts[-1]
+
+    def __segmentPath(self, host, start):
+        """Returns the path of a segment file.
+
+        Args:
+            host (str): Name of the website,
+            start (float): Timestamp of the first record of the segment.
+
+        Returns:
+            The path of the segment file.
+
+        """
+
+        return os.path.join(self.directory, quote(host, safe=''), '{:017.6f}.seg'.format(start))
+
+    def insertSample(self, data):
+        """Appends a data point to the last segment of a website, starting a new segment if needed.
+
+        Args:
+            data (dict): Dictionary containing the data to insert:
+                timestamp (str): String representing the date at which the measurement was taken,
+                host (str): Name of the monitored website,
+                available (bool): Stores whether the site is available or not,
+                status (int): Response status code of the site,
+                FLOAT_FIELDS (float, optional): Other measurements of the data point,
+                failure (str, optional): Class of the failure of the request (one of FAILURE_CLASSES),
+                bodyBytes (int, optional): Number of bytes of the body read,
+                contentCheck (str, optional): Result of the content check (one of CONTENT_RESULTS).
+
+        """
+
+        host = data['host']
+        timestamp = toEpoch(data['timestamp'])
+        fields = (
+            data['status'] if data['status'] is not None else -1,
+            int(data['available']) if data['available'] is not None else -1,
+            FAILURE_CLASSES.index(data.get('failure'))
+        ) + tuple(data[field] if data.get(field) is not None else math.nan for field in FLOAT_FIELDS) + (
+            data['bodyBytes'] if data.get('bodyBytes') is not None else -1,
+            CONTENT_RESULTS.index(data['contentCheck']) if data.get('contentCheck') is not None else -1,
+        )
+
+        with self.lock:
+            # Keep the records of a website in time order (required by the binary search):
+            # a late append (from a slower probe thread) is stored at the time of the previous record
+            timestamp = max(timestamp, self.lastTimestamps.get(host, timestamp))
+            record = RECORD.pack(timestamp, *fields)
+
+            starts = self.segments.setdefault(host, [])
+            if not starts or self.counts[host] >= SEGMENT_RECORDS:
+                # Rotate: start a new segment named after the timestamp of its first record
+                # (shifted by a microsecond if the previous segment started at the same time)
+                os.makedirs(os.path.join(self.directory, quote(host, safe='')), exist_ok=True)
+                starts.append(max(timestamp, starts[-1] + 1e-6) if starts else timestamp)
+                self.counts[host] = 0
+
+            # Append the record to the current segment
+            with open(self.__segmentPath(host, starts[-1]), 'ab') as segment:
+                segment.write(record)
+            self.counts[host] += 1
+            self.lastTimestamps[host] = timestamp
+
+    def __lastRecord(self, host, start):
+        """Reads the last complete record of a segment.
+
+        Args:
+            host (str): Name of the website,
+            start (float): Timestamp of the first record of the segment.
+
+        Returns:
+            The unpacked record, or None if the segment is empty.
+
+        """
+
+        with open(self.__segmentPath(host, start), 'rb') as segment:
+            n = os.fstat(segment.fileno()).st_size // RECORD.size
+            if n == 0:
+                return None
+            segment.seek((n - 1) * RECORD.size)
+            return RECORD.unpack(segment.read(RECORD.size))
+
+    def __iterSegment(self, host, start, since):
+        """Yields the records of a segment which timestamps are strictly after a date.
+
+        Args:
+            host (str): Name of the website,
+            start (float): Timestamp of the first record of the segment,
+            since (float): Only the records after this timestamp are returned.
+
+        Yields:
+            Unpacked records (<timestamp (float)>, <status (int)>, <available (int)>, <failure (int)>, <FLOAT_FIELDS (float)>...,
+            <bodyBytes (int)>, <contentCheck (int)>).
+
+        """
+
+        with open(self.__segmentPath(host, start), 'rb') as segment:
+            # Only consider complete records (an append may be in progress)
+            n = os.fstat(segment.fileno()).st_size // RECORD.size
+            if n == 0:
+                return
+
+            with mmap.mmap(segment.fileno(), n * RECORD.size, access=mmap.ACCESS_READ) as records:
+                # Binary search of the first record after the given date
+                low, high = 0, n
+                while low < high:
+                    middle = (low + high) // 2
+                    if RECORD.unpack_from(records, middle * RECORD.size)[0] > since:
+                        high = middle
+                    else:
+                        low = middle + 1
+
+                for i in range(low, n):
+                    yield RECORD.unpack_from(records, i * RECORD.size)
+
+    def iterSamples(self, host, minutes, now=None):
+        """Get the data points of a website for the past few minutes, as a stream of rows.
+
+        Args:
+            host (str): Name of the website the query is about,
+            minutes (int): Restricts the query to results which timestamp is less than this number of minutes old,
+            now (datetime.datetime, optional): Current UTC date (defaults to datetime.utcnow()).
+
+        Yields:
+            Tuples (<timestamp (str)>, <available (bool)>, <status (int)>, <FLOAT_FIELDS (float)>..., <failure (str)>,
+            <bodyBytes (int)>, <contentCheck (str)>), in ascending timestamp order.
+
+        """
+
+        since = float(calendar.timegm(((now or datetime.utcnow()) - timedelta(minutes=minutes)).timetuple()))
+
+        with self.lock:
+            starts = list(self.segments.get(host, []))
+
+        # Skip the segments which only contain records older than the window,
+        # i.e. all the segments before the last one starting before the window
+        first = max(bisect_right(starts, since) - 1, 0)
+        for start in starts[first:]:
+            for record in self.__iterSegment(host, start, since):
+                yield toRow(record)
+
+    def queryLastSample(self, host):
+        """Get the most recent data point of a website.
+
+        Args:
+            host (str): Name of the website the query is about.
+
+        Returns:
+            A tuple (<timestamp (str)>, <available (bool)>, <status (int)>, <FLOAT_FIELDS (float)>..., <failure (str)>,
+            <bodyBytes (int)>, <contentCheck (str)>), or None if there is no data about the website.
+
+        """
+
+        with self.lock:
+            starts = list(self.segments.get(host, []))
+
+        for start in reversed(starts):
+            # Only the last record of the most recent non empty segment is needed
+            record = self.__lastRecord(host, start)
+            if record is not None:
+                return toRow(record)
+        return None
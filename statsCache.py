@@ -0,0 +1,290 @@
+import sys
+import threading
+from collections import OrderedDict
+from datetime import datetime
+from storage import StorageBackend, openBackend
+
+"""Module dedicated to the caching of the stats computed by the storage backends.
+
+    The stats of a website over a window are computed several times per print cycle (for the stats
+    printing, and for the alert check of each website), always from the same data points. A window
+    only depends on its end date to the second (the timestamps of the data points are stored to the
+    second), so the stats of a window are cached by (website, duration, end date to the second): a
+    query in the same second as a previous one reuses its result, and a query a second later is a
+    different window. The results of a website are also invalidated when a data point about it is
+    stored, so the cached stats are always the same as the recomputed ones (except for the data
+    points written by other processes during the same second).
+
+    The last notification of each kind about a website is read for each alert check too: it is cached
+    by (website, kind of notification) in a second cache, whose results of a website are invalidated
+    when a notification about it is stored (the stored data points don't change them).
+
+    The caches are bounded: the least recently used results are evicted first.
+
+"""
+
+def sizeOf(value):
+    """Estimates the memory used by a value, including the containers and strings it contains.
+
+    Args:
+        value: Value to measure (a stats tuple, see storage.aggregateGroups).
+
+    Returns:
+        The estimated size, in bytes.
+
+    """
+
+    size = sys.getsizeof(value)
+    if isinstance(value, dict):
+        size += sum(sizeOf(key) + sizeOf(item) for key, item in value.items())
+    elif isinstance(value, (list, tuple)):
+        size += sum(sizeOf(item) for item in value)
+    return size
+
+class StatsCache():
+    """Least recently used cache of the stats of the websites, invalidated website by website.
+
+    Attributes:
+        maxEntries (int): Maximum number of results kept,
+        entries (collections.OrderedDict): Cached results by key (<host (str)>, <minutes (int)>, <end of the window
+            (datetime.datetime)>), as (<result (tuple)>, <size (int)>) pairs, the least recently used first,
+        keysByHost (dict of str:set): Keys of the cached results of each website,
+        versions (dict of str:int): Number of invalidations of each website, so that a result computed before
+            an invalidation is not cached after it,
+        hits (int): Number of lookups which found a result,
+        misses (int): Number of lookups which found no result,
+        invalidations (int): Number of results dropped because a data point was stored,
+        evictions (int): Number of results dropped because the cache was full,
+        bytes (int): Estimated memory used by the cached results,
+        lock (threading.Lock): Lock protecting the cache.
+
+    """
+
+    def __init__(self, maxEntries=4096):
+        self.maxEntries = maxEntries
+        self.entries = OrderedDict()
+        self.keysByHost = {}
+        self.versions = {}
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self.evictions = 0
+        self.bytes = 0
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        """Looks up a result.
+
+        Args:
+            key (tuple): Key of the result (see entries).
+
+        Returns:
+            The result, or None if it is not cached.
+
+        """
+
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def version(self, host):
+        """Returns the version of the results of a website, to be given to put.
+
+        Args:
+            host (str): Name of the website.
+
+        Returns:
+            The number of invalidations of the website.
+
+        """
+
+        with self.lock:
+            return self.versions.get(host, 0)
+
+    def put(self, key, result, version):
+        """Caches a result, evicting the least recently used ones if the cache is full.
+        The result is not cached if the website was invalidated since it was computed.
+
+        Args:
+            key (tuple): Key of the result (see entries),
+            result (tuple): Result to cache,
+            version (int): Version of the results of the website when the result was computed (see version).
+
+        """
+
+        size = sizeOf(result)
+        with self.lock:
+            if self.versions.get(key[0], 0) != version:
+                return
+            self.__drop(key)
+            self.entries[key] = (result, size)
+            self.keysByHost.setdefault(key[0], set()).add(key)
+            self.bytes += size
+            while len(self.entries) > self.maxEntries:
+                self.__drop(next(iter(self.entries)))
+                self.evictions += 1
+
+    def __drop(self, key):
+        """Drops a result from the cache (the lock must be held).
+
+        Args:
+            key (tuple): Key of the result.
+
+        Returns:
+            True if the result was cached.
+
+        """
+
+        entry = self.entries.pop(key, None)
+        if entry is None:
+            return False
+        self.bytes -= entry[1]
+        keys = self.keysByHost[key[0]]
+        keys.discard(key)
+        if not keys:
+            del self.keysByHost[key[0]]
+        return True
+
+    def invalidate(self, host):
+        """Drops the cached results of a website.
+
+        Args:
+            host (str): Name of the website.
+
+        """
+
+        with self.lock:
+            self.versions[host] = self.versions.get(host, 0) + 1
+            for key in list(self.keysByHost.get(host, ())):
+                self.__drop(key)
+                self.invalidations += 1
+
+    def stats(self):
+        """Returns the counters of the cache.
+
+        Returns:
+            A dictionary containing the hits, misses, invalidations, evictions, entries (number of cached
+            results) and bytes (estimated memory used by the cached results).
+
+        """
+
+        with self.lock:
+            return { 'hits': self.hits, 'misses': self.misses, 'invalidations': self.invalidations,
+                'evictions': self.evictions, 'entries': len(self.entries), 'bytes': self.bytes }
+
+class CachedBackend(StorageBackend):
+    """Storage backend caching the window stats computed by another backend, and the last notifications it
+    stores (see the module description). The other methods are forwarded to the other backend.
+
+    Attributes:
+        backend (StorageBackend): Backend computing the stats,
+        cache (StatsCache): Cache of the stats,
+        alertCache (StatsCache): Cache of the last notifications, by (<host (str)>, <kind (str)>) (the cached
+            results are 1-tuples, so that a website without notification is cached too).
+
+    """
+
+    def __init__(self, backend, maxEntries=4096):
+        """Sets the backend to cache.
+
+        Args:
+            backend (str or StorageBackend): Storage backend to cache, or its URI (see storage.openBackend),
+            maxEntries (int, optional): Maximum number of results kept (by each cache).
+
+        """
+
+        self.backend = openBackend(backend)
+        self.cache = StatsCache(maxEntries)
+        self.alertCache = StatsCache(maxEntries)
+
+    def initStorage(self):
+        self.backend.initStorage()
+
+    def appendSample(self, data):
+        self.backend.appendSample(data)
+        # The window stats of the website now include the new data point
+        self.cache.invalidate(data['host'])
+
+    def iterSamples(self, host, minutes, now=None):
+        return self.backend.iterSamples(host, minutes, now)
+
+    def windowAggregate(self, host, minutes, now=None):
+        # The windows ending in the same second are the same
+        now = (now or datetime.utcnow()).replace(microsecond=0)
+        key = (host, minutes, now)
+        result = self.cache.get(key)
+        if result is None:
+            version = self.cache.version(host)
+            result = self.backend.windowAggregate(host, minutes, now)
+            self.cache.put(key, result, version)
+        return result
+
+    def bulkWindowAggregate(self, hosts, minutes, now=None):
+        now = (now or datetime.utcnow()).replace(microsecond=0)
+        results = {}
+        missing = []
+        for host in hosts:
+            result = self.cache.get((host, minutes, now))
+            if result is None:
+                missing.append(host)
+            else:
+                results[host] = result
+
+        # The stats of the websites not cached are computed with a single query, and cached
+        if missing:
+            versions = { host: self.cache.version(host) for host in missing }
+            for host, result in self.backend.bulkWindowAggregate(missing, minutes, now).items():
+                self.cache.put((host, minutes, now), result, versions[host])
+                results[host] = result
+        return results
+
+    def bulkIterSamples(self, hosts, minutes, now=None):
+        return self.backend.bulkIterSamples(hosts, minutes, now)
+
+    def lastAlert(self, host, kind='availability'):
+        key = (host, kind)
+        result = self.alertCache.get(key)
+        if result is None:
+            version = self.alertCache.version(host)
+            result = (self.backend.lastAlert(host, kind),)
+            self.alertCache.put(key, result, version)
+        return result[0]
+
+    def bulkLastAlert(self, hosts, kind='availability'):
+        results = {}
+        missing = []
+        for host in hosts:
+            result = self.alertCache.get((host, kind))
+            if result is None:
+                missing.append(host)
+            elif result[0] is not None:
+                results[host] = result[0]
+
+        # The last notifications of the websites not cached are loaded with a single query, and cached
+        # (including the absence of notification)
+        if missing:
+            versions = { host: self.alertCache.version(host) for host in missing }
+            alerts = self.backend.bulkLastAlert(missing, kind)
+            for host in missing:
+                self.alertCache.put((host, kind), (alerts.get(host),), versions[host])
+            results.update(alerts)
+        return results
+
+    def appendAlert(self, data):
+        self.backend.appendAlert(data)
+        # The last notifications of the website now include the new one
+        self.alertCache.invalidate(data['host'])
+
+    def iterAlerts(self, startDate=None):
+        return self.backend.iterAlerts(startDate)
+
+    def pageAlerts(self, limit, beforeId=None, host=None, since=None, until=None):
+        return self.backend.pageAlerts(limit, beforeId, host, since, until)
+
+    def iterAlertsAfter(self, afterId, host=None):
+        return self.backend.iterAlertsAfter(afterId, host)
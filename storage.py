@@ -0,0 +1,609 @@
+import os
+import threading
+from bisect import bisect_right
+from collections import Counter
+from datetime import datetime, timedelta
+from urllib.parse import parse_qs
+from segmentStore import SegmentStore
+import dbutils
+
+"""Module dedicated to the storage backends of the app.
+
+    A storage backend stores the data points of the monitored websites (website_monitoring)
+    and the alerts and recoveries notifications (website_alerts).
+    The backend to use is described by a URI (see openBackend):
+        - sqlite://<databaseFileName> (or simply <databaseFileName>): sqlite database,
+        - memory:// (or memory://<name>): in-memory storage, shared by the whole process,
+        - segments://<directory>[?alerts=<databaseFileName>]: data points in segment files,
+          notifications in a sqlite database (<directory>/alerts.db by default).
+
+"""
+
+# Format of the timestamps of the data points
+SAMPLE_TIMESTAMP_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+# Format of the timestamps of the notifications
+ALERT_TIMESTAMP_FORMAT = '%d/%m/%Y %H:%M:%S'
+
+# Types of the notifications of each kind of alert: availability alerts (see Retriever.checkAlert)
+# and latency alerts (see latency.LatencyDetector)
+ALERT_TYPES = {
+    'availability': ('alert', 'recovery'),
+    'latency': ('latencyAlert', 'latencyRecovery'),
+}
+
+# Kind of alert of each type of notification
+ALERT_KINDS = { type: kind for kind, types in ALERT_TYPES.items() for type in types }
+
+# Fields of the data points returned by the backends, in order
+SAMPLE_FIELDS = ('timestamp', 'available', 'status', 'responseTime', 'transferTime',
+                 'dnsTime', 'connectTime', 'tlsTime', 'firstByteTime', 'downloadTime', 'failure', 'bodyBytes', 'contentCheck')
+
+# Fields of the data points containing the durations of the phases of the requests
+PHASE_FIELDS = ('dnsTime', 'connectTime', 'tlsTime', 'firstByteTime', 'downloadTime')
+
+def aggregateGroups(groups):
+    """Computes the stats of a website from aggregated groups of data points.
+
+    Args:
+        groups (iterable): Iterable of tuples (<available (bool)>, <status (int)>, <failure (str)>, <count (int)>,
+            <number of response times (int)>, <sum of response times (float)>, <min response time (float)>,
+            <max response time (float)>, <phases (tuple)>), each describing a group of data points,
+            phases being a (<number of durations (int)>, <sum of durations (float)>) tuple for each of the PHASE_FIELDS.
+
+    Returns:
+        A tuple composed of:
+            - a boolean (False if there is no data point, True otherwise),
+            - a dictionary containing interesting stats about the website:
+                availability (float): Availability of the website,
+                statusCodes (collections.Counter): Counts of the different response codes from requests on the website,
+                failures (collections.Counter): Counts of the different classes of failures of the requests without response,
+                avgRT (float): Average response time,
+                minRT (float): Minimum response time,
+                maxRT (float): Maximum response time,
+                phases (dict of str:float): Average duration of each of the PHASE_FIELDS (None if it was never measured).
+
+    """
+
+    # Create a counter of number of times the site was available or not
+    availables = Counter()
+    # Create a counter of status codes
+    statusCodes = Counter()
+    # Create a counter of failure classes
+    failures = Counter()
+    # Keep track of the number, sum, min and max of the (not None) response times
+    nRT = 0
+    sumRT = 0
+    minRT = float('inf')
+    maxRT = float('inf')
+    # Keep track of the number and sum of the durations of each phase
+    phaseCounts = [0] * len(PHASE_FIELDS)
+    phaseSums = [0] * len(PHASE_FIELDS)
+
+    for available, status, failure, count, groupNRT, groupSumRT, groupMinRT, groupMaxRT, groupPhases in groups:
+        if available is not None:
+            availables[bool(available)] += count
+        statusCodes[status] += count
+        if failure is not None:
+            failures[failure] += count
+        if groupNRT > 0:
+            minRT = groupMinRT if nRT == 0 else min(minRT, groupMinRT)
+            maxRT = groupMaxRT if nRT == 0 else max(maxRT, groupMaxRT)
+            sumRT += groupSumRT
+            nRT += groupNRT
+        for i, (phaseCount, phaseSum) in enumerate(groupPhases):
+            phaseCounts[i] += phaseCount
+            phaseSums[i] += phaseSum
+
+    if sum(statusCodes.values()) == 0:
+        # If there is no data available, return that there is no data available
+        return False, {}
+
+    # Compute some interesting statistics
+    try:
+        avgRT = sumRT / nRT
+    except:
+        avgRT = float('inf')
+
+    # Compute the availability
+    n = sum(availables.values())
+    availability = availables[True] / n
+
+    # And return these stats in a dictionary
+    return True, {
+            'availability': availability,
+            'statusCodes': statusCodes,
+            'failures': failures,
+            'avgRT': avgRT,
+            'minRT': minRT,
+            'maxRT': maxRT,
+            'phases': {
+                phase: phaseSums[i] / phaseCounts[i] if phaseCounts[i] > 0 else None
+                for i, phase in enumerate(PHASE_FIELDS)
+            },
+            }
+
+def aggregateSamples(samples):
+    """Computes the stats of a website from a stream of data points.
+
+    Args:
+        samples (iterable): Iterable of data points (tuples of the SAMPLE_FIELDS).
+
+    Returns:
+        The same tuple as aggregateGroups.
+
+    """
+
+    # The data points are first grouped by (available, status, failure) in a single pass, so that
+    # aggregateGroups only sees a few groups
+    phaseIndexes = [SAMPLE_FIELDS.index(phase) for phase in PHASE_FIELDS]
+    failureIndex = SAMPLE_FIELDS.index('failure')
+    groups = {}
+    for sample in samples:
+        key = (sample[1], sample[2], sample[failureIndex])
+        group = groups.get(key)
+        if group is None:
+            # [count, number of response times, sum of response times, min, max, phase counts, phase sums]
+            group = groups[key] = [0, 0, 0, None, None, [0] * len(phaseIndexes), [0] * len(phaseIndexes)]
+        group[0] += 1
+
+        responseTime = sample[3]
+        if responseTime is not None:
+            if group[1] == 0:
+                group[3] = group[4] = responseTime
+            elif responseTime < group[3]:
+                group[3] = responseTime
+            elif responseTime > group[4]:
+                group[4] = responseTime
+            group[1] += 1
+            group[2] += responseTime
+
+        for j, i in enumerate(phaseIndexes):
+            duration = sample[i]
+            if duration is not None:
+                group[5][j] += 1
+                group[6][j] += duration
+
+    return aggregateGroups(
+        key + (count, nRT, sumRT, minRT, maxRT, tuple(zip(phaseCounts, phaseSums)))
+        for key, (count, nRT, sumRT, minRT, maxRT, phaseCounts, phaseSums) in groups.items()
+    )
+
+class StorageBackend():
+    """Interface of the storage backends.
+    A backend instance is shared by all the threads of the app, so its methods must be thread-safe.
+
+    """
+
+    def initStorage(self):
+        """Creates the storage structures (if they do not exist).
+
+        """
+
+        raise NotImplementedError
+
+    def appendSample(self, data):
+        """Stores a data point about a website.
+
+        Args:
+            data (dict): Dictionary containing the data to insert:
+                timestamp (str): String representing the date at which the measurement was taken,
+                host (str): Name of the monitored website,
+                available (bool): Stores whether the site is available or not,
+                status (int): Response status code of the site,
+                responseTime (float): Time the site took to answer a request (time to first byte),
+                transferTime (float, optional): Time the site took to answer a request and send the (read part of the) body.
+
+        """
+
+        raise NotImplementedError
+
+    def iterSamples(self, host, minutes, now=None):
+        """Get the data points of a website recorded during the past few minutes, as a stream.
+
+        Args:
+            host (str): Name of the website the query is about,
+            minutes (int): Number of minutes in the past over which data is retrieved,
+            now (datetime.datetime, optional): Current UTC date, end of the window (defaults to the current date).
+
+        Returns:
+            An iterator over the data points (tuples of the SAMPLE_FIELDS), in ascending timestamp order.
+
+        """
+
+        raise NotImplementedError
+
+    def windowAggregate(self, host, minutes, now=None):
+        """Computes the stats of a website over the past few minutes.
+        By default, the data points of the window are streamed and aggregated on the fly.
+
+        Args:
+            host (str): Name of the website the query is about,
+            minutes (int): Number of minutes in the past over which data is aggregated,
+            now (datetime.datetime, optional): Current UTC date, end of the window (defaults to the current date).
+
+        Returns:
+            The same tuple as aggregateGroups.
+
+        """
+
+        return aggregateSamples(self.iterSamples(host, minutes, now))
+
+    def bulkWindowAggregate(self, hosts, minutes, now=None):
+        """Computes the stats of several websites over the past few minutes.
+        By default, the stats of each website are computed separately.
+
+        Args:
+            hosts (iterable): Names of the websites the query is about,
+            minutes (int): Number of minutes in the past over which data is aggregated,
+            now (datetime.datetime, optional): Current UTC date, end of the window (defaults to the current date).
+
+        Returns:
+            A dictionary (str: tuple) containing the stats of each website (the same tuple as aggregateGroups).
+
+        """
+
+        return { host: self.windowAggregate(host, minutes, now) for host in hosts }
+
+    def bulkIterSamples(self, hosts, minutes, now=None):
+        """Get the data points of several websites recorded during the past few minutes, as a stream.
+        By default, the data points of each website are streamed one website after the other.
+
+        Args:
+            hosts (iterable): Names of the websites the query is about,
+            minutes (int): Number of minutes in the past over which data is retrieved,
+            now (datetime.datetime, optional): Current UTC date, end of the window (defaults to the current date).
+
+        Returns:
+            An iterator over (<host (str)>, <sample (tuple)>) pairs, sample being a tuple of the SAMPLE_FIELDS.
+
+        """
+
+        return ((host, sample) for host in hosts for sample in self.iterSamples(host, minutes, now))
+
+    def lastAlert(self, host, kind='availability'):
+        """Get the most recent notification of a kind of alert about a website.
+
+        Args:
+            host (str): Name of the website the query is about,
+            kind (str, optional): Kind of alert of the notification (one of ALERT_TYPES).
+
+        Returns:
+            A tuple (<timestamp (str)>, <host (str)>, <type (str)>, <startDate (str)>, <endDate (str)>, <availability (float)>),
+            or None if there is no notification about the website.
+
+        """
+
+        raise NotImplementedError
+
+    def bulkLastAlert(self, hosts, kind='availability'):
+        """Get the most recent notification of a kind of alert about several websites.
+        By default, the notification of each website is retrieved separately.
+
+        Args:
+            hosts (iterable): Names of the websites the query is about,
+            kind (str, optional): Kind of alert of the notifications (one of ALERT_TYPES).
+
+        Returns:
+            A dictionary (str: tuple) containing the most recent notification about each website (see lastAlert),
+            without the websites without notification.
+
+        """
+
+        lastAlerts = {}
+        for host in hosts:
+            alert = self.lastAlert(host, kind)
+            if alert is not None:
+                lastAlerts[host] = alert
+        return lastAlerts
+
+    def appendAlert(self, data):
+        """Stores a notification about a website.
+
+        Args:
+            data (dict): Dictionary containing the data to insert:
+                timestamp (str): String representing the date of the notification,
+                host (str): Name of the monitored website,
+                type (str): Type of notification,
+                startDate (str): String representing the date of start of the alert,
+                endDate (str, optional): String representing the date of end of the alert,
+                availability (float): Availability of the website.
+
+        """
+
+        raise NotImplementedError
+
+    def iterAlerts(self, startDate=None):
+        """Get the notifications, optionally only the ones after a given date, as a stream.
+
+        Args:
+            startDate (str, optional): Restricts the query to notifications which timestamp are after this date
+                (in the ALERT_TIMESTAMP_FORMAT).
+
+        Returns:
+            An iterator over tuples (<timestamp (str)>, <host (str)>, <type (str)>, <startDate (str)>, <endDate (str)>,
+            <availability (float)>), in ascending timestamp order.
+
+        """
+
+        raise NotImplementedError
+
+    def pageAlerts(self, limit, beforeId=None, host=None, since=None, until=None):
+        """Get a page of the most recent notifications, optionally filtered by website and date.
+
+        Args:
+            limit (int): Maximum number of notifications in the page,
+            beforeId (int, optional): Only get the notifications older than the one with this id (to get the next page),
+            host (str, optional): Only get the notifications about this website,
+            since (datetime.datetime, optional): Only get the notifications from this date,
+            until (datetime.datetime, optional): Only get the notifications before this date.
+
+        Returns:
+            An array of tuples (<id (int)>, <timestamp (str)>, <host (str)>, <type (str)>, <startDate (str)>,
+            <endDate (str)>, <availability (float)>), in descending time order.
+            The ids increase with time.
+
+        """
+
+        raise NotImplementedError
+
+    def iterAlertsAfter(self, afterId, host=None):
+        """Get the notifications recorded after a given notification, as a stream.
+
+        Args:
+            afterId (int): Only get the notifications more recent than the one with this id (0 for all of them),
+            host (str, optional): Only get the notifications about this website.
+
+        Returns:
+            An iterator over tuples (<id (int)>, <timestamp (str)>, <host (str)>, <type (str)>, <startDate (str)>,
+            <endDate (str)>, <availability (float)>), in ascending time order.
+
+        """
+
+        raise NotImplementedError
+
+class SqliteBackend(StorageBackend):
+    """Storage backend using a sqlite database (see dbutils).
+
+    Attributes:
+        dbName (str): Name of the database to use.
+
+    """
+
+    def __init__(self, dbName):
+        """Sets the database name as speficied in the parameters.
+
+        Args:
+            dbName (str): Name of the database to use.
+
+        """
+
+        self.dbName = dbName
+
+    def initStorage(self):
+        dbutils.initDatabase(self.dbName)
+
+    def appendSample(self, data):
+        dbutils.insertSample(self.dbName, data)
+
+    def iterSamples(self, host, minutes, now=None):
+        return dbutils.iterSamples(self.dbName, host, minutes, now)
+
+    def windowAggregate(self, host, minutes, now=None):
+        # Let the database do the aggregation
+        return aggregateGroups(dbutils.aggregateSamples(self.dbName, host, minutes, now))
+
+    def bulkWindowAggregate(self, hosts, minutes, now=None):
+        # A single query for all the websites, grouped by website
+        groups = { host: [] for host in hosts }
+        for host, group in dbutils.aggregateAllSamples(self.dbName, minutes, now):
+            if host in groups:
+                groups[host].append(group)
+        return { host: aggregateGroups(hostGroups) for host, hostGroups in groups.items() }
+
+    def bulkIterSamples(self, hosts, minutes, now=None):
+        # A single query for all the websites
+        hosts = set(hosts)
+        return ((row[0], row[1:]) for row in dbutils.iterAllSamples(self.dbName, minutes, now) if row[0] in hosts)
+
+    def lastAlert(self, host, kind='availability'):
+        return dbutils.queryLastAlert(self.dbName, host, ALERT_TYPES[kind])
+
+    def bulkLastAlert(self, hosts, kind='availability'):
+        hosts = set(hosts)
+        return { alert[1]: alert for alert in dbutils.queryLastAlerts(self.dbName, ALERT_TYPES[kind]) if alert[1] in hosts }
+
+    def appendAlert(self, data):
+        dbutils.insertAlert(self.dbName, data)
+
+    def iterAlerts(self, startDate=None):
+        return dbutils.iterAlerts(self.dbName, startDate)
+
+    def pageAlerts(self, limit, beforeId=None, host=None, since=None, until=None):
+        return dbutils.pageAlerts(self.dbName, limit, beforeId, host, since, until)
+
+    def iterAlertsAfter(self, afterId, host=None):
+        return dbutils.iterAlertsAfter(self.dbName, afterId, host)
+
+class MemoryBackend(StorageBackend):
+    """Storage backend keeping all the data in memory, without any I/O.
+    Data points older than the retention period are dropped as new ones are appended.
+
+    Attributes:
+        retentionMinutes (int): Number of minutes during which the data points are kept,
+        sampleTimes (dict of str:list): Sorted timestamps of the data points of each website,
+        samples (dict of str:list): Data points of each website, in the same order as sampleTimes,
+        alerts (list): Notifications, in insertion order,
+        lastAlerts (dict of tuple:tuple): Most recent notification of each (website, kind of alert) pair,
+        lock (threading.Lock): Lock protecting the data.
+
+    """
+
+    def __init__(self, retentionMinutes=60):
+        """Initializes the empty storage.
+
+        Args:
+            retentionMinutes (int, optional): Number of minutes during which the data points are kept.
+
+        """
+
+        self.retentionMinutes = retentionMinutes
+        self.sampleTimes = {}
+        self.samples = {}
+        self.alerts = []
+        self.lastAlerts = {}
+        self.lock = threading.Lock()
+
+    def initStorage(self):
+        pass
+
+    def appendSample(self, data):
+        host = data['host']
+
+        with self.lock:
+            times = self.sampleTimes.setdefault(host, [])
+            samples = self.samples.setdefault(host, [])
+
+            # Insert the data point at its place in time order (usually at the end)
+            i = bisect_right(times, data['timestamp'])
+            times.insert(i, data['timestamp'])
+            samples.insert(i, tuple(data.get(field) for field in SAMPLE_FIELDS))
+
+            # Drop the data points older than the retention period (relative to the most recent data point)
+            cutoff = datetime.fromisoformat(times[-1]) - timedelta(minutes=self.retentionMinutes)
+            expired = bisect_right(times, cutoff.strftime(SAMPLE_TIMESTAMP_FORMAT))
+            if expired > 0:
+                del times[:expired]
+                del samples[:expired]
+
+    def iterSamples(self, host, minutes, now=None):
+        since = ((now or datetime.utcnow()) - timedelta(minutes=minutes)).strftime(SAMPLE_TIMESTAMP_FORMAT)
+
+        with self.lock:
+            # Copy the window so that the stream is not affected by concurrent appends
+            times = self.sampleTimes.get(host, [])
+            window = self.samples.get(host, [])[bisect_right(times, since):]
+        return iter(window)
+
+    def lastAlert(self, host, kind='availability'):
+        with self.lock:
+            return self.lastAlerts.get((host, kind))
+
+    def appendAlert(self, data):
+        alert = (data['timestamp'], data['host'], data['type'], data['startDate'], data['endDate'], data['availability'])
+        with self.lock:
+            self.alerts.append(alert)
+            self.lastAlerts[(data['host'], ALERT_KINDS[data['type']])] = alert
+
+    def iterAlerts(self, startDate=None):
+        with self.lock:
+            alerts = list(self.alerts)
+        if startDate is None:
+            return iter(alerts)
+
+        # The timestamps of the notifications do not sort chronologically as strings
+        since = datetime.strptime(startDate, ALERT_TIMESTAMP_FORMAT)
+        return (alert for alert in alerts if datetime.strptime(alert[0], ALERT_TIMESTAMP_FORMAT) > since)
+
+    def pageAlerts(self, limit, beforeId=None, host=None, since=None, until=None):
+        # The id of a notification is its position in the alerts list, plus one
+        page = []
+        with self.lock:
+            end = len(self.alerts) if beforeId is None else min(beforeId - 1, len(self.alerts))
+            for i in range(end - 1, -1, -1):
+                if len(page) == limit:
+                    break
+                alert = self.alerts[i]
+                if host is not None and alert[1] != host:
+                    continue
+                if since is not None or until is not None:
+                    date = datetime.strptime(alert[0], ALERT_TIMESTAMP_FORMAT)
+                    if (since is not None and date < since) or (until is not None and date >= until):
+                        continue
+                page.append((i + 1,) + alert)
+        return page
+
+    def iterAlertsAfter(self, afterId, host=None):
+        with self.lock:
+            alerts = self.alerts[afterId:]
+        return ((afterId + i + 1,) + alert for i, alert in enumerate(alerts) if host is None or alert[1] == host)
+
+class SegmentBackend(SqliteBackend):
+    """Storage backend storing the data points in segment files (see segmentStore.py)
+    and the notifications in a sqlite database.
+
+    Attributes:
+        dbName (str): Name of the database used for the notifications,
+        sampleStore (SegmentStore): Segment store used for the data points.
+
+    """
+
+    def __init__(self, directory, dbName=None):
+        """Opens the segment store and sets the database name.
+
+        Args:
+            directory (str): Directory in which the segments are stored,
+            dbName (str, optional): Name of the database used for the notifications (defaults to <directory>/alerts.db).
+
+        """
+
+        self.sampleStore = SegmentStore(directory)
+        SqliteBackend.__init__(self, dbName if dbName is not None else os.path.join(directory, 'alerts.db'))
+
+    def appendSample(self, data):
+        self.sampleStore.insertSample(data)
+
+    def iterSamples(self, host, minutes, now=None):
+        return self.sampleStore.iterSamples(host, minutes, now)
+
+    def windowAggregate(self, host, minutes, now=None):
+        # The data points are not in the database: aggregate them on the fly
+        return StorageBackend.windowAggregate(self, host, minutes, now)
+
+    def bulkWindowAggregate(self, hosts, minutes, now=None):
+        return StorageBackend.bulkWindowAggregate(self, hosts, minutes, now)
+
+    def bulkIterSamples(self, hosts, minutes, now=None):
+        return StorageBackend.bulkIterSamples(self, hosts, minutes, now)
+
+# Stateful backends by URI, so that every component of the process opening the same URI shares the same instance
+# (the same data for memory://<name>, the same segments index for segments://<directory>)
+sharedBackends = {}
+sharedBackendsLock = threading.Lock()
+
+def openBackend(uri):
+    """Returns the storage backend described by a URI.
+
+    Args:
+        uri (str or StorageBackend): URI of the storage (see the module description), or a database file name.
+            If a StorageBackend is given, it is returned as is.
+
+    Returns:
+        A StorageBackend instance.
+
+    """
+
+    if isinstance(uri, StorageBackend):
+        return uri
+
+    if '://' not in uri:
+        # A simple file name designates a sqlite database
+        return SqliteBackend(uri)
+
+    scheme, location = uri.split('://', 1)
+    path, _, query = location.partition('?')
+
+    if scheme == 'sqlite':
+        return SqliteBackend(path)
+
+    if scheme not in ('memory', 'segments'):
+        raise ValueError('Unknown storage URI scheme: {}'.format(scheme))
+
+    with sharedBackendsLock:
+        if uri not in sharedBackends:
+            if scheme == 'memory':
+                sharedBackends[uri] = MemoryBackend()
+            else:
+                alerts = parse_qs(query).get('alerts')
+                sharedBackends[uri] = SegmentBackend(path, alerts[0] if alerts else None)
+        return sharedBackends[uri]
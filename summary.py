@@ -0,0 +1,183 @@
+import math
+import heapq
+from collections import Counter
+
+"""Module dedicated to the summary of the monitored websites: global totals, and ranking of the worst websites.
+
+    The data points of the window are streamed once, and summarized into a few counters per website.
+    The response times are counted in logarithmic buckets (each bucket is 10% wider than the previous
+    one), from which the 95th percentile is estimated with a relative error of at most 10%, without
+    keeping the response times in memory.
+    The worst websites are then selected with a heap: only the top N websites are sorted and printed.
+
+"""
+
+# Ratio between the upper bounds of two consecutive response time buckets
+BUCKET_RATIO = 1.1
+
+# Ways of ranking the websites, with the key used to select the worst ones and whether the worst
+# websites are the ones with the smallest key (True) or the largest key (False)
+RANKINGS = {
+    'availability': (lambda site: site['availability'], True),
+    'p95': (lambda site: site['p95RT'] if site['p95RT'] is not None else -1, False),
+    '5xx': (lambda site: site['serverErrors'], False),
+}
+
+def bucketOf(responseTime):
+    """Returns the response time bucket of a response time.
+
+    Args:
+        responseTime (float): Response time, in milliseconds.
+
+    Returns:
+        The index of the bucket (the bucket i contains the response times in ]BUCKET_RATIO^(i-1), BUCKET_RATIO^i]).
+
+    """
+
+    if responseTime <= 1:
+        return 0
+    return math.ceil(math.log(responseTime, BUCKET_RATIO))
+
+def percentile(buckets, fraction):
+    """Estimates a percentile of response times from their buckets.
+
+    Args:
+        buckets (collections.Counter): Number of response times in each bucket,
+        fraction (float): Fraction of the response times below the percentile (0.95 for the 95th percentile).
+
+    Returns:
+        The upper bound of the bucket containing the percentile (None if there is no response time).
+
+    """
+
+    n = sum(buckets.values())
+    if n == 0:
+        return None
+
+    seen = 0
+    for bucket in sorted(buckets):
+        seen += buckets[bucket]
+        if seen >= fraction * n:
+            return BUCKET_RATIO ** bucket
+
+class SiteSummary():
+    """Counters of the data points of a website over a window.
+
+    Attributes:
+        checks (int): Number of data points,
+        available (int): Number of data points where the website was available,
+        serverErrors (int): Number of 5xx responses,
+        buckets (collections.Counter): Number of response times in each bucket (see bucketOf),
+        recentChecks (int): Number of data points at the end of the window (see summarize),
+        recentAvailable (int): Number of data points at the end of the window where the website was available.
+
+    """
+
+    def __init__(self):
+        self.checks = 0
+        self.available = 0
+        self.serverErrors = 0
+        self.buckets = Counter()
+        self.recentChecks = 0
+        self.recentAvailable = 0
+
+    def add(self, available, status, responseTime, recent=False):
+        """Counts a data point.
+
+        Args:
+            available (bool): Whether the website was available,
+            status (int): Response status code (None if there was no response),
+            responseTime (float): Response time, in milliseconds (None if there was no response),
+            recent (bool, optional): Whether the data point is at the end of the window.
+
+        """
+
+        self.checks += 1
+        if available:
+            self.available += 1
+        if recent:
+            self.recentChecks += 1
+            if available:
+                self.recentAvailable += 1
+        if status is not None and 500 <= status < 600:
+            self.serverErrors += 1
+        if responseTime is not None:
+            self.buckets[bucketOf(responseTime)] += 1
+
+    def stats(self):
+        """Returns the stats of the website.
+
+        Returns:
+            A dictionary containing:
+                checks (int): Number of data points,
+                availability (float): Availability of the website,
+                serverErrors (int): Number of 5xx responses,
+                p95RT (float): Estimated 95th percentile of the response times (None if there was no response),
+                recentAvailability (float): Availability of the website at the end of the window (None if there
+                    was no data point at the end of the window).
+
+        """
+
+        return {
+            'checks': self.checks,
+            'availability': self.available / self.checks,
+            'serverErrors': self.serverErrors,
+            'p95RT': percentile(self.buckets, 0.95),
+            'recentAvailability': self.recentAvailable / self.recentChecks if self.recentChecks > 0 else None,
+        }
+
+def summarize(samples, recentSince=None):
+    """Summarizes the data points of several websites.
+
+    Args:
+        samples (iterable): Iterable of (<host (str)>, <sample (tuple)>) pairs, sample being a tuple of the
+            storage.SAMPLE_FIELDS (see StorageBackend.bulkIterSamples),
+        recentSince (str, optional): The data points after this date (in the format of the timestamps of the
+            samples) are also counted in the availability at the end of the window of each website (for
+            example over the timeframe of the alert checks, which is then known without another query).
+
+    Returns:
+        A tuple composed of:
+            - a dictionary (str: dict) containing the stats of each website with data points (see SiteSummary.stats),
+            - a dictionary containing the totals over all the websites:
+                sites (int): Number of websites with data points,
+                checks (int): Number of data points,
+                availability (float): Availability over all the data points (None if there is no data point),
+                serverErrors (int): Number of 5xx responses,
+                downSites (int): Number of websites with an availability under 80%.
+
+    """
+
+    summaries = {}
+    for host, sample in samples:
+        summary = summaries.get(host)
+        if summary is None:
+            summary = summaries[host] = SiteSummary()
+        summary.add(sample[1], sample[2], sample[3], recentSince is not None and sample[0] > recentSince)
+
+    sites = { host: summary.stats() for host, summary in summaries.items() }
+    checks = sum(summary.checks for summary in summaries.values())
+    return sites, {
+        'sites': len(sites),
+        'checks': checks,
+        'availability': sum(summary.available for summary in summaries.values()) / checks if checks > 0 else None,
+        'serverErrors': sum(summary.serverErrors for summary in summaries.values()),
+        'downSites': sum(1 for site in sites.values() if site['availability'] < 0.8),
+    }
+
+def worstSites(sites, ranking, n):
+    """Selects the worst websites according to a ranking, with a heap (in O(number of websites * log(n))).
+
+    Args:
+        sites (dict of str:dict): Stats of each website (see summarize),
+        ranking (str): Way of ranking the websites (one of RANKINGS),
+        n (int): Number of websites to select.
+
+    Returns:
+        An array of (<host (str)>, <stats (dict)>) pairs of the n worst websites, the worst first.
+
+    """
+
+    key, smallestFirst = RANKINGS[ranking]
+    select = heapq.nsmallest if smallestFirst else heapq.nlargest
+    return select(n, sites.items(), key=lambda item: key(item[1]))
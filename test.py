@@ -1,30 +1,1531 @@
-import time
 import os
+import sys
+import json
+import time
+import random
+import socket
+import sqlite3
 import logging
-from multiprocessing import Process
+import tempfile
+import unittest
+import threading
+import contextlib
+import statistics
+import subprocess
+from io import StringIO
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+import requests
+import probe
+import segmentStore
+import notifications
+from collections import Counter
+from urllib.parse import quote
+from datetime import datetime, timedelta
 from utils import formatAlert
-from flask import Flask
-from monitor import Monitor
+from monitor import Monitor, CONNECT_TIMEOUT, READ_TIMEOUT
+from contentCheck import ContentCheck
 from retriever import Retriever
-from dbutils import initDatabase, dropTables
+from storage import MemoryBackend, SqliteBackend, SegmentBackend, ALERT_TYPES
+from scheduling import CheckSchedule
+from summary import summarize, worstSites
+from latency import LatencyDetector, ALERT_COUNT, RECOVERY_COUNT
+import dbutils
+from dbutils import initDatabase, dropTables, insertSample, insertAlert, iterRows, migrateDatabase
+from archive import exportArchive, importArchive
+from alertWatcher import AlertWatcher
+from replay import Replay, recordedSamples, syntheticSamples
+from notifications import Dispatcher, WebhookSink, CommandSink
+from statsCache import CachedBackend
+
+def createLegacyDatabase(dbName, samples, columns=dbutils.SAMPLE_COLUMNS):
+    """Creates a database in the layout of the previous versions of the app (a website_monitoring table
+    with the host names and text timestamps, indexed by timestamp), with some data points.
+
+    Args:
+        dbName (str): Name of the database to create,
+        samples (iterable): Data points, as tuples of the columns,
+        columns (list, optional): Columns of the website_monitoring table, with their types.
+
+    """
+
+    connection = sqlite3.connect(dbName)
+    connection.execute("CREATE TABLE website_monitoring ({})".format(', '.join('{} {}'.format(*column) for column in columns)))
+    connection.execute("CREATE INDEX website_monitoring_timestamp ON website_monitoring (timestamp)")
+    connection.executemany("INSERT INTO website_monitoring VALUES ({})".format(', '.join('?' for _ in columns)), samples)
+    connection.commit()
+    connection.close()
+
+class FakeClock():
+    """Clock whose time only changes when it is told to, to be injected in Monitors and Retrievers.
+
+    Attributes:
+        now (datetime.datetime): Current (fake) UTC date.
+
+    """
+
+    def __init__(self, now=datetime(2018, 1, 1)):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+    def advance(self, seconds):
+        self.now += timedelta(seconds=seconds)
+
+class StubResponse():
+    """Minimal requests.Response replacement returned by StubTransport.
+
+    Attributes:
+        status_code (int): Response status code,
+        elapsed (datetime.timedelta): Response time,
+        body (bytes): Body of the response,
+        chunkDelay (float): Time taken to receive each chunk of the body, in seconds,
+        bytesRead (int): Number of bytes of the body read so far,
+        closed (bool): Whether the response was closed.
+
+    """
+
+    def __init__(self, status_code, elapsed, body=b'', chunkDelay=0):
+        self.status_code = status_code
+        self.elapsed = elapsed
+        self.body = body
+        self.chunkDelay = chunkDelay
+        self.bytesRead = 0
+        self.closed = False
+
+    def iter_content(self, chunk_size=1):
+        while self.bytesRead < len(self.body) and not self.closed:
+            chunk = self.body[self.bytesRead:self.bytesRead + chunk_size]
+            self.bytesRead += len(chunk)
+            if self.chunkDelay:
+                time.sleep(self.chunkDelay)
+            yield chunk
+
+    def close(self):
+        self.closed = True
+
+class StubTransport():
+    """In-process replacement of requests.request, to be injected in Monitors.
+    When the stub server is down, requests fail as if the connection was refused.
+
+    Attributes:
+        up (bool): Whether the stub server is up,
+        status (int): Status code of the responses,
+        responseTime (float): Response time of the responses, in milliseconds,
+        body (bytes): Body of the responses to GET requests,
+        phases (dict): Durations (in seconds) of the connection setup phases reported to the Monitors,
+        error (type): Exception raised by the requests when the stub server is down,
+        chunkDelay (float): Time taken to receive each chunk of the bodies, in seconds,
+        gate (threading.Event): If set, the requests wait for this event before being answered,
+        redirects (list): Response times of the redirections followed before the responses, in milliseconds,
+        requests (list): (method, response) pairs of the requests received,
+        lastKwargs (dict): Keyword arguments of the last request received,
+        active (list): URLs of the requests waiting to be answered,
+        maxActive (int): Maximum number of requests waiting to be answered at the same time.
+
+    """
+
+    def __init__(self, up=True, status=200, responseTime=20, body=b'Hello', phases=None, error=requests.ConnectionError):
+        self.up = up
+        self.status = status
+        self.responseTime = responseTime
+        self.body = body
+        self.phases = phases or {}
+        self.error = error
+        self.chunkDelay = 0
+        self.redirects = []
+        self.gate = None
+        self.requests = []
+        self.lastKwargs = None
+        self.active = []
+        self.maxActive = 0
+        self.lock = threading.Lock()
+
+    def __call__(self, method, URL, timings=None, **kwargs):
+        self.lastKwargs = kwargs
+        if timings is not None:
+            timings.update(self.phases)
+        if self.gate is not None:
+            with self.lock:
+                self.active.append(URL)
+                self.maxActive = max(self.maxActive, len(self.active))
+            self.gate.wait()
+            with self.lock:
+                self.active.remove(URL)
+        if not self.up:
+            raise self.error('Stub server {} is down'.format(URL))
+        response = StubResponse(self.status, timedelta(milliseconds=self.responseTime), self.body if method == 'GET' else b'', self.chunkDelay)
+        response.history = [StubResponse(301, timedelta(milliseconds=responseTime)) for responseTime in self.redirects]
+        self.requests.append((method, response))
+        return response
+
+class StubReceiver():
+    """Local HTTP server receiving the notifications posted by webhook sinks, in a background thread.
+
+    Attributes:
+        failures (int): Number of the next requests answered with an error,
+        gate (threading.Event): If set, the requests wait for this event before being answered,
+        batches (list): Notifications received, one list per request answered successfully,
+        requests (int): Number of requests received,
+        active (int): Number of requests waiting to be answered,
+        maxActive (int): Maximum number of requests waiting to be answered at the same time,
+        URL (str): URL of the server.
+
+    """
+
+    def __init__(self):
+        self.failures = 0
+        self.gate = None
+        self.batches = []
+        self.requests = 0
+        self.active = 0
+        self.maxActive = 0
+        self.lock = threading.Lock()
+
+        receiver = self
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+                with receiver.lock:
+                    receiver.requests += 1
+                    receiver.active += 1
+                    receiver.maxActive = max(receiver.maxActive, receiver.active)
+                    failed = receiver.failures > 0
+                    receiver.failures -= failed
+                if receiver.gate is not None:
+                    receiver.gate.wait()
+                with receiver.lock:
+                    receiver.active -= 1
+                    if not failed:
+                        receiver.batches.append(body)
+                self.send_response(500 if failed else 204)
+                self.end_headers()
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(('localhost', 0), Handler)
+        self.URL = 'http://localhost:{}/'.format(self.server.server_address[1])
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+class IncrementalAlertModel():
+    """Reference model of the alerting logic, updated incrementally with each data point instead of
+    querying the storage. Used to check the query-based logic of Retriever.checkAlert.
+
+    Attributes:
+        window (list): (date, available) pairs of the data points, in time order,
+        startDate (str): Start date of the current alert (None if there is no alert).
+
+    """
+
+    def __init__(self):
+        self.window = []
+        self.startDate = None
+
+    def add(self, date, available):
+        self.window.append((date.replace(microsecond=0), available))
+
+    def check(self, now):
+        # Only keep the data points of the past 2 minutes
+        since = now.replace(microsecond=0) - timedelta(minutes=2)
+        self.window = [(date, available) for date, available in self.window if date > since]
+        if not self.window:
+            return { 'type': None }
+
+        availability = sum(available for _, available in self.window) / len(self.window)
+        if self.startDate is not None and availability >= 0.8:
+            startDate, self.startDate = self.startDate, None
+            return { 'type': 'recovery', 'availability': availability, 'startDate': startDate }
+        if self.startDate is None and availability < 0.8:
+            self.startDate = now.strftime('%d/%m/%Y %H:%M:%S')
+        if self.startDate is not None:
+            return { 'type': 'alert', 'availability': availability, 'startDate': self.startDate }
+        return { 'type': None }
+
+class AlertingLogicTest(unittest.TestCase):
+    """Deterministic tests of the alerting logic, with a fake clock and a stub transport.
+    No server is started and no time is spent waiting, so these tests run in a fraction of a second.
+
+    """
+
+    URL = 'http://stub.test'
+
+    def createSite(self, storage):
+        """Creates a fake clock, a stub transport and the Monitor and Retriever of the stub site.
+
+        Args:
+            storage (StorageBackend): Storage backend to use.
+
+        """
+
+        self.clock = FakeClock()
+        self.transport = StubTransport()
+        self.monitor = Monitor(self.URL, storage, clock=self.clock, transport=self.transport)
+        self.retriever = Retriever(self.URL, storage, clock=self.clock)
+
+    def measure(self, n, up):
+        """Takes n measurements, one second apart, with the stub server up or down.
+
+        """
+
+        self.transport.up = up
+        for _ in range(n):
+            self.clock.advance(1)
+            self.monitor.get()
+
+    def check(self):
+        """Runs an alert check one second after the last measurement.
+
+        """
+
+        self.clock.advance(1)
+        return self.retriever.checkAlert()
+
+    def runScenario(self):
+        """Same scenario as liveTest: up, down, recovery and down again.
+
+        """
+
+        self.measure(2, True)
+        self.assertEqual(self.check()['type'], None)
+
+        self.measure(2, False)
+        alertStatus = self.check()
+        self.assertEqual(alertStatus['type'], 'alert')
+        self.assertAlmostEqual(alertStatus['availability'], 0.5)
+
+        self.measure(6, True)
+        alertStatus = self.check()
+        self.assertEqual(alertStatus['type'], 'recovery')
+        self.assertAlmostEqual(alertStatus['availability'], 0.8)
+
+        self.measure(2, False)
+        alertStatus = self.check()
+        self.assertEqual(alertStatus['type'], 'alert')
+        self.assertAlmostEqual(alertStatus['availability'], 2 / 3)
+
+    def testScenarioMemory(self):
+        self.createSite(MemoryBackend())
+        self.runScenario()
+        self.assertEqual([alert[2] for alert in self.monitor.storage.iterAlerts()], ['alert', 'recovery', 'alert'])
+
+    def testScenarioSqlite(self):
+        # Use a temporary database, so that several test runs do not interfere
+        with tempfile.TemporaryDirectory() as directory:
+            storage = SqliteBackend(os.path.join(directory, 'test.db'))
+            storage.initStorage()
+            self.createSite(storage)
+            self.runScenario()
+            self.assertEqual([alert[2] for alert in storage.iterAlerts()], ['alert', 'recovery', 'alert'])
+
+    def testAlertsSince(self):
+        # The notifications after a date are selected chronologically, across month boundaries
+        # (their timestamps, in the "%d/%m/%Y %H:%M:%S" format, don't sort chronologically as strings)
+        with tempfile.TemporaryDirectory() as directory:
+            for storage in [MemoryBackend(), SqliteBackend(os.path.join(directory, 'test.db'))]:
+                storage.initStorage()
+                timestamps = ['30/12/2017 10:00:00', '31/01/2018 12:00:00', '01/02/2018 00:00:00', '02/02/2018 08:00:00']
+                for timestamp in timestamps:
+                    storage.appendAlert({'host': self.URL, 'timestamp': timestamp, 'type': 'alert', 'startDate': timestamp,
+                        'endDate': None, 'availability': 0.5})
+                self.assertEqual([alert[0] for alert in storage.iterAlerts('31/01/2018 12:00:00')], timestamps[2:])
+                self.assertEqual([alert[0] for alert in storage.iterAlerts('01/01/2018 00:00:00')], timestamps[1:])
+                self.assertEqual([alert[0] for alert in storage.iterAlerts()], timestamps)
+
+    def testWindowExpiry(self):
+        # Failures older than 2 minutes are not taken into account anymore
+        self.createSite(MemoryBackend())
+        self.measure(5, False)
+        self.assertEqual(self.check()['type'], 'alert')
+        self.clock.advance(120)
+        self.assertEqual(self.check()['type'], None)
+        self.measure(1, True)
+        self.assertEqual(self.check()['type'], 'recovery')
+
+    def testProbeMethods(self):
+        # Each probe method reads only what it needs of the body, and records the transfer time
+        storage = MemoryBackend()
+        for probeMethod, method, bytesRead in [('get', 'GET', 100000), ('head', 'HEAD', 0), ('headers', 'GET', 0), ('capped', 'GET', 10000)]:
+            transport = StubTransport(body=b'x' * 100000)
+            monitor = Monitor(self.URL, storage, probeMethod, 10000, clock=FakeClock(), transport=transport)
+            monitor.get()
+            self.assertEqual(transport.requests[0][0], method, probeMethod)
+            self.assertEqual(transport.requests[0][1].bytesRead, bytesRead, probeMethod)
+            self.assertTrue(transport.requests[0][1].closed, probeMethod)
+
+        sample = list(storage.iterSamples(self.URL, 2, FakeClock()()))[-1]
+        self.assertTrue(sample[1])
+        self.assertEqual(sample[3], 20)
+        self.assertGreaterEqual(sample[4], sample[3])
+
+    def testContentChecks(self):
+        # The body is checked as it is streamed, and only read until the result of the check is known
+        storage = MemoryBackend()
+        body = b'x' * 20000 + b'<title>Service unavailable</title>' + b'y' * 80000
+        for content, available, result, bodyBytes in [
+            ({'contains': 'Service unavailable'}, True, 'ok', 24576),
+            ({'contains': 'Welcome'}, False, 'missing', 100034),
+            ({'matches': r'<title>Service \w+</title>'}, True, 'ok', 24576),
+            ({'matches': r'<title>Welcome</title>'}, False, 'mismatch', 100034),
+            ({'contains': 'Service', 'maxBodySize': 10000}, False, 'tooLarge', 10001),
+            ({'contains': 'Service', 'maxBodySize': 200000}, True, 'ok', 100034),
+        ]:
+            transport = StubTransport(body=body)
+            monitor = Monitor(self.URL, storage, content=content, clock=FakeClock(), transport=transport)
+            sample = monitor.get()
+            self.assertEqual((sample['available'], sample['contentCheck'], sample['bodyBytes']), (available, result, bodyBytes), content)
+            self.assertEqual(transport.requests[0][1].bytesRead, bodyBytes, content)
+            self.assertEqual(sample.get('failure'), None if available else 'content', content)
+
+        # A string spanning two chunks is found
+        for size in range(8180, 8200):
+            evaluation = ContentCheck('needle in a haystack').start()
+            chunks = [(b'h' * size + b'needle in a haystack')[i:i + 8192] for i in range(0, size + 20, 8192)]
+            self.assertEqual([evaluation.feed(chunk) for chunk in chunks][-1], 'ok', size)
+
+        # A string spanning several chunks shorter than it is found
+        for chunks in [[b'abcdefghijklmno', b'pqrst'], [bytes([c]) for c in b'xxabcdefghijklmnopqrstxx'], [b'xab', b'c', b'def', b'ghijklmnopqrs', b't']]:
+            evaluation = ContentCheck('abcdefghijklmnopqrst').start()
+            results = [evaluation.feed(chunk) for chunk in chunks]
+            self.assertIn('ok', results, chunks)
+            self.assertEqual(evaluation.result(), 'ok', chunks)
+        evaluation = ContentCheck('abcdefghijklmnopqrst').start()
+        for chunk in [b'abcdefghij', b'klmno', b'pqrs']:
+            evaluation.feed(chunk)
+        self.assertEqual(evaluation.result(), 'missing')
+        evaluation = ContentCheck('!').start()
+        self.assertEqual([evaluation.feed(chunk) for chunk in [b'a', b'b', b'!']], [None, None, 'ok'])
+
+        # The results of the content checks are stored, and the failed ones are counted as failures
+        with tempfile.TemporaryDirectory() as directory:
+            for storage in [SqliteBackend(os.path.join(directory, 'test.db')), SegmentBackend(os.path.join(directory, 'segments'))]:
+                storage.initStorage()
+                self.createSite(storage)
+                self.monitor = Monitor(self.URL, storage, content={'contains': 'Hello'}, clock=self.clock, transport=self.transport)
+                self.measure(2, True)
+                self.transport.body = b'Error'
+                self.measure(1, True)
+                availableStats, stats = self.retriever.getStats(2)
+                self.assertEqual(stats['failures'], Counter({'content': 1}))
+                self.assertEqual([sample[-2:] for sample in storage.iterSamples(self.URL, 2, self.clock())],
+                    [(5, 'ok'), (5, 'ok'), (5, 'missing')])
+
+        with self.assertRaises(ValueError):
+            Monitor(self.URL, storage, 'head', content={'contains': 'Hello'})
+
+    def testStatsCache(self):
+        # The stats are computed once per second and website, until a data point about the website is stored
+        with tempfile.TemporaryDirectory() as directory:
+            for backend in [MemoryBackend(), SqliteBackend(os.path.join(directory, 'test.db'))]:
+                backend.initStorage()
+                storage = CachedBackend(backend, maxEntries=3)
+                self.createSite(storage)
+                other = Monitor('http://other.test', storage, clock=self.clock, transport=self.transport)
+                self.measure(3, True)
+                other.get()
+                now = self.clock()
+
+                self.assertEqual(storage.bulkWindowAggregate([self.URL, 'http://other.test'], 2, now), backend.bulkWindowAggregate([self.URL, 'http://other.test'], 2, now))
+                self.assertEqual(self.retriever.getStats(2), backend.windowAggregate(self.URL, 2, now))
+                self.assertEqual(self.retriever.checkAlert()['type'], None)
+                self.assertEqual((storage.cache.hits, storage.cache.misses), (2, 2))
+                self.assertGreater(storage.cache.bytes, 0)
+
+                # A new data point only invalidates the stats of its website
+                self.transport.up = False
+                self.monitor.get()
+                self.assertEqual(self.retriever.getStats(2), backend.windowAggregate(self.URL, 2, now))
+                self.assertEqual(self.retriever.getStats(2)[1]['availability'], 0.75)
+                storage.windowAggregate('http://other.test', 2, now)
+                self.assertEqual((storage.cache.hits, storage.cache.misses, storage.cache.invalidations), (4, 3, 1))
+
+                # A window ending a second later is another result, and the least recently used result is evicted
+                storage.windowAggregate(self.URL, 10, now)
+                self.clock.advance(1)
+                storage.windowAggregate(self.URL, 2, self.clock())
+                self.assertEqual((len(storage.cache.entries), storage.cache.evictions), (3, 1))
+                self.assertNotIn((self.URL, 2, now), storage.cache.entries)
+                self.assertIn(('http://other.test', 2, now), storage.cache.entries)
+
+                # The last notification of a website (or its absence) is cached until a notification about it is stored
+                self.assertIsNone(storage.lastAlert(self.URL))
+                storage.appendAlert({'host': self.URL, 'timestamp': '01/01/2018 00:00:05', 'type': 'alert',
+                    'startDate': '01/01/2018 00:00:05', 'endDate': None, 'availability': 0.5})
+                self.assertEqual(storage.lastAlert(self.URL), backend.lastAlert(self.URL))
+                for _ in range(2):
+                    self.assertEqual(storage.bulkLastAlert([self.URL, 'http://other.test']), backend.bulkLastAlert([self.URL, 'http://other.test']))
+                self.assertIsNone(storage.lastAlert(self.URL, 'latency'))
+                self.assertEqual((storage.alertCache.hits, storage.alertCache.misses, storage.alertCache.invalidations), (4, 4, 1))
+                self.assertEqual(storage.alertCache.stats()['entries'], 3)
+
+    def testPhaseTimings(self):
+        # The phases of the requests are stored and averaged over the window, by every backend
+        with tempfile.TemporaryDirectory() as directory:
+            for storage in [MemoryBackend(), SqliteBackend(os.path.join(directory, 'test.db'))]:
+                storage.initStorage()
+                self.createSite(storage)
+                self.transport.phases = {'dns': 0.002, 'connect': 0.004}
+                self.measure(2, True)
+                self.transport.phases = {'dns': 0.004, 'connect': 0.006, 'tls': 0.001}
+                self.measure(1, True)
+                self.measure(1, False)
+
+                availableStats, stats = self.retriever.getStats(2)
+                self.assertTrue(availableStats)
+                self.assertAlmostEqual(stats['phases']['dnsTime'], 8 / 3)
+                self.assertAlmostEqual(stats['phases']['connectTime'], 14 / 3)
+                self.assertAlmostEqual(stats['phases']['tlsTime'], 1)
+                # The first byte time is what remains of the response time after the connection setup
+                self.assertAlmostEqual(stats['phases']['firstByteTime'], (14 + 14 + 9) / 3)
+
+        # The timings of a redirected request all cover the redirections
+        self.createSite(MemoryBackend())
+        self.transport.phases = {'dns': 0.002, 'connect': 0.004}
+        self.transport.redirects = [30]
+        self.transport.chunkDelay = 0.01
+        sample = self.monitor.get()
+        self.assertAlmostEqual(sample['firstByteTime'], 44)
+        self.assertAlmostEqual(sample['transferTime'], 50 + sample['downloadTime'])
+        self.assertGreaterEqual(sample['transferTime'], sample['dnsTime'] + sample['connectTime'] + sample['firstByteTime'] + sample['downloadTime'] - 1e-6)
+
+    def testFailureClasses(self):
+        # The failures of the requests are stored with their class, and counted over the window
+        with tempfile.TemporaryDirectory() as directory:
+            for storage in [MemoryBackend(), SqliteBackend(os.path.join(directory, 'test.db'))]:
+                storage.initStorage()
+                self.createSite(storage)
+                self.measure(1, True)
+                self.transport.error = probe.DNSError
+                self.measure(2, False)
+                self.transport.error = requests.Timeout
+                self.measure(1, False)
+
+                availableStats, stats = self.retriever.getStats(2)
+                self.assertTrue(availableStats)
+                self.assertEqual(stats['failures'], Counter({'dns': 2, 'timeout': 1}))
+                self.assertAlmostEqual(stats['availability'], 0.25)
+
+    def testWarmStart(self):
+        # A restarted retriever carries on with the alert stored before the restart
+        with tempfile.TemporaryDirectory() as directory:
+            for storage in [MemoryBackend(), SqliteBackend(os.path.join(directory, 'test.db'))]:
+                storage.initStorage()
+                self.createSite(storage)
+                self.measure(4, False)
+                self.assertEqual(self.check()['type'], 'alert')
+                self.measure(20, True)
+
+                # The stats of several websites are loaded at once, and are the same as the stats of each website
+                other = Monitor('http://other.test', storage, clock=self.clock, transport=StubTransport(responseTime=50))
+                other.get()
+                hosts = [self.URL, 'http://other.test', 'http://unknown.test']
+                self.assertEqual(storage.bulkWindowAggregate(hosts, 2, self.clock()),
+                    { host: storage.windowAggregate(host, 2, self.clock()) for host in hosts })
+                lastAlerts = storage.bulkLastAlert(hosts)
+                self.assertEqual(list(lastAlerts), [self.URL])
+
+                # The last notification of each kind is the same when loaded for all the websites at once
+                for i, type in enumerate(['latencyAlert', 'alert', 'latencyRecovery', 'alert', 'recovery', 'latencyAlert']):
+                    storage.appendAlert({'host': 'http://{}.test'.format('aab'[i % 3]), 'timestamp': '01/01/2018 00:00:0{}'.format(i),
+                        'type': type, 'startDate': '01/01/2018 00:00:00', 'endDate': None, 'availability': i})
+                alertHosts = hosts + ['http://a.test', 'http://b.test']
+                for kind in ['availability', 'latency']:
+                    self.assertEqual(storage.bulkLastAlert(alertHosts, kind),
+                        { host: storage.lastAlert(host, kind) for host in alertHosts if storage.lastAlert(host, kind) is not None })
+                self.assertEqual(storage.bulkLastAlert(alertHosts)['http://a.test'][5], 4)
+                self.assertNotIn('http://b.test', storage.bulkLastAlert(alertHosts))
+
+                # The recovery is raised by the first check after the restart
+                self.retriever = Retriever(self.URL, storage, clock=self.clock)
+                self.retriever.restore(lastAlerts.get(self.URL))
+                self.assertEqual(self.check()['type'], 'recovery')
+                self.assertEqual(storage.lastAlert(self.URL)[2], 'recovery')
+
+    def testSingleFlight(self):
+        # A check is skipped (counted, and stored as a failure) while the previous check of the website is still in progress
+        with tempfile.TemporaryDirectory() as directory:
+            for storage in [MemoryBackend(), SegmentBackend(os.path.join(directory, 'segments'))]:
+                storage.initStorage()
+                self.createSite(storage)
+                self.transport.gate = threading.Event()
+                thread = threading.Thread(target=self.monitor.get)
+                thread.start()
+                while not self.transport.active:
+                    time.sleep(0.001)
+                skipped = self.monitor.get()
+                self.assertEqual((skipped['available'], skipped['status'], skipped['failure']), (False, None, 'skipped'))
+                self.assertEqual(self.monitor.skippedChecks, 1)
+                self.transport.gate.set()
+                thread.join()
+
+                self.assertTrue(self.monitor.get()['available'])
+                self.assertEqual(len(self.transport.requests), 2)
+                self.assertEqual(self.transport.lastKwargs['timeout'], (CONNECT_TIMEOUT, READ_TIMEOUT))
+                availableStats, stats = self.retriever.getStats(2)
+                self.assertEqual((stats['availability'], stats['failures']), (2 / 3, {'skipped': 1}))
+
+    def testConcurrencyLimits(self):
+        # The checks in progress are limited in total and for each host
+        limiter = probe.ConcurrencyLimiter(maxTotal=3, maxPerHost=2)
+        transport = StubTransport()
+        transport.gate = threading.Event()
+        threads = []
+        for host in ('a.test', 'b.test'):
+            for i in range(4):
+                site = Monitor('http://{}/{}'.format(host, i), MemoryBackend(), clock=FakeClock(), transport=transport, limiter=limiter)
+                threads.append(threading.Thread(target=site.get))
+        for thread in threads:
+            thread.start()
+        while len(transport.active) < 3:
+            time.sleep(0.001)
+        time.sleep(0.05)
+        hosts = Counter(URL.split('/')[2] for URL in transport.active)
+        transport.gate.set()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(len(transport.requests), 8)
+        self.assertEqual(sorted(hosts.values()), [1, 2])
+        self.assertEqual(transport.maxActive, 3)
+
+    def testBodyDeadline(self):
+        # A body sent too slowly makes the check fail with a timeout
+        self.createSite(MemoryBackend())
+        self.monitor.readTimeout = 0.01
+        self.transport.body = b'x' * 100000
+        self.transport.chunkDelay = 0.005
+        sample = self.monitor.get()
+        self.assertFalse(sample['available'])
+        self.assertEqual(sample['failure'], 'timeout')
+
+    def testAlertHistory(self):
+        # The notifications history is read backwards page by page, and filtered by website and date
+        with tempfile.TemporaryDirectory() as directory:
+            for storage in [MemoryBackend(), SqliteBackend(os.path.join(directory, 'test.db'))]:
+                storage.initStorage()
+                for i in range(30):
+                    # One notification every 12 hours, alternating between two websites
+                    date = (datetime(2017, 12, 25) + timedelta(hours=12 * i)).strftime('%d/%m/%Y %H:%M:%S')
+                    storage.appendAlert({'host': 'http://{}.test'.format('ab'[i % 2]), 'timestamp': date, 'type': 'alert',
+                        'startDate': date, 'endDate': None, 'availability': i / 100})
+
+                firstPage = storage.pageAlerts(10)
+                secondPage = storage.pageAlerts(10, firstPage[-1][0])
+                self.assertEqual([alert[6] for alert in firstPage + secondPage], [i / 100 for i in range(29, 9, -1)])
+
+                page = storage.pageAlerts(10, host='http://a.test', since=datetime(2018, 1, 1), until=datetime(2018, 1, 3))
+                self.assertEqual([alert[6] for alert in page], [0.16, 0.14])
+
+                self.assertEqual([alert[6] for alert in storage.iterAlertsAfter(firstPage[3][0], 'http://b.test')], [0.27, 0.29])
+                self.assertEqual(storage.pageAlerts(10, secondPage[-1][0] - 10), [])
+
+    def testLatencyAlerts(self):
+        # A sustained jump of the response time raises a latency alert, stored apart from the availability alerts
+        with tempfile.TemporaryDirectory() as directory:
+            for storage in [MemoryBackend(), SqliteBackend(os.path.join(directory, 'test.db'))]:
+                storage.initStorage()
+                detector = LatencyDetector(self.URL, storage, clock=FakeClock())
+                noise = random.Random(1)
+                types = []
+                for i in range(200):
+                    # A noisy baseline around 80ms with isolated spikes, then 4s response times, then back to normal
+                    if 100 <= i < 120:
+                        responseTime = 4000
+                    elif i % 25 == 0:
+                        responseTime = 400
+                    else:
+                        responseTime = noise.uniform(60, 100)
+                    types.append(detector.add({'available': True, 'responseTime': responseTime})['type'])
+                    detector.add({'available': False, 'responseTime': None})
+
+                self.assertEqual([(i, type) for i, type in enumerate(types) if type is not None],
+                    [(100 + ALERT_COUNT - 1, 'latencyAlert'), (120 + RECOVERY_COUNT - 1, 'latencyRecovery')])
+                self.assertTrue(60 <= detector.baseline() <= 100)
+                self.assertEqual(storage.lastAlert(self.URL, 'latency')[2], 'latencyRecovery')
+                self.assertIsNone(storage.lastAlert(self.URL))
+
+                # A website staying slow (15 minutes of checks every 2 seconds) stays on alert until it recovers:
+                # the slow response times don't widen the baseline, which would end the alert while it is still slow
+                detector = LatencyDetector(self.URL, storage, clock=FakeClock())
+                types = [detector.add({'available': True, 'responseTime': noise.uniform(60, 100)})['type'] for _ in range(100)]
+                types += [detector.add({'available': True, 'responseTime': noise.uniform(800, 1200)})['type'] for _ in range(450)]
+                types += [detector.add({'available': True, 'responseTime': noise.uniform(60, 100)})['type'] for _ in range(50)]
+                self.assertEqual([(i, type) for i, type in enumerate(types) if type is not None],
+                    [(100 + ALERT_COUNT - 1, 'latencyAlert'), (550 + RECOVERY_COUNT - 1, 'latencyRecovery')])
+
+                # A restarted detector learns the baseline again from the response times stored before the alert, keeps
+                # the alert while the website is still slow, and ends it when the website is fast again
+                start = datetime.utcnow() - timedelta(minutes=30)
+                for i in range(100):
+                    storage.appendSample({'host': self.URL, 'timestamp': (start + timedelta(seconds=10 * i)).strftime('%Y-%m-%d %H:%M:%S'),
+                        'available': True, 'status': 200, 'responseTime': noise.uniform(60, 100) if i < 98 else 4000})
+                storage.appendAlert({'host': self.URL, 'timestamp': (start + timedelta(seconds=980)).strftime('%d/%m/%Y %H:%M:%S'),
+                    'type': 'latencyAlert', 'startDate': (start + timedelta(seconds=980)).strftime('%d/%m/%Y %H:%M:%S'),
+                    'endDate': None, 'availability': 4000})
+                detector = LatencyDetector(self.URL, storage, clock=FakeClock())
+                detector.restore(storage.bulkLastAlert([self.URL], 'latency').get(self.URL))
+                self.assertEqual(detector.status()['type'], 'latencyAlert')
+                self.assertTrue(60 <= detector.baseline() <= 100)
+                types = [detector.add({'available': True, 'responseTime': 4000})['type'] for _ in range(3 * RECOVERY_COUNT)]
+                types += [detector.add({'available': True, 'responseTime': 80})['type'] for _ in range(RECOVERY_COUNT)]
+                self.assertEqual(types, [None] * (4 * RECOVERY_COUNT - 1) + ['latencyRecovery'])
+
+                # Without stored response times, the alert isn't ended before the baseline is learned again
+                detector = LatencyDetector('http://other.test', storage, clock=FakeClock())
+                detector.restore(('01/01/2018 00:00:00', 'http://other.test', 'latencyAlert', '01/01/2018 00:00:00', None, 4000))
+                types = [detector.add({'available': True, 'responseTime': 4000})['type'] for _ in range(RECOVERY_COUNT)]
+                self.assertEqual(types, [None] * RECOVERY_COUNT)
+                self.assertEqual(detector.status()['type'], 'latencyAlert')
+
+    def testArchive(self):
+        # The old rows are moved to the archive, and imported back unchanged
+        with tempfile.TemporaryDirectory() as directory:
+            dbName = os.path.join(directory, 'test.db')
+            initDatabase(dbName)
+            for i in range(96):
+                # One data point every hour during 4 days, and one notification every 12 hours
+                date = datetime(2018, 1, 1) + timedelta(hours=i)
+                insertSample(dbName, {'timestamp': date, 'host': 'http://{}.test'.format('ab'[i % 2]), 'available': i % 5 != 0,
+                    'status': 200 if i % 5 != 0 else None, 'responseTime': i * 1.5 if i % 5 != 0 else None,
+                    'dnsTime': 0.25, 'failure': 'timeout' if i % 5 == 0 else None})
+                if i % 12 == 0:
+                    insertAlert(dbName, {'host': 'http://a.test', 'timestamp': date.strftime('%d/%m/%Y %H:%M:%S'), 'type': 'alert',
+                        'startDate': str(date), 'endDate': None, 'availability': i / 100})
+
+            samplesQuery = "SELECT * FROM website_monitoring ORDER BY timestamp"
+            alertsQuery = "SELECT * FROM website_alerts ORDER BY rowid"
+            samples = list(iterRows(dbName, samplesQuery))
+            alerts = list(iterRows(dbName, alertsQuery))
+
+            archive = os.path.join(directory, 'archive')
+            self.assertEqual(exportArchive(dbName, archive, datetime(2018, 1, 3)), (48, 4))
+            self.assertEqual(sorted(os.listdir(os.path.join(archive, 'website_monitoring'))), ['2018-01-01.arc', '2018-01-02.arc'])
+            self.assertEqual(list(iterRows(dbName, samplesQuery)), samples[48:])
+            self.assertEqual(list(iterRows(dbName, alertsQuery)), alerts[4:])
+
+            self.assertEqual(importArchive(dbName, archive), (48, 4))
+            self.assertEqual(list(iterRows(dbName, samplesQuery)), samples)
+            self.assertEqual(list(iterRows(dbName, alertsQuery)), alerts)
+            storage = SqliteBackend(dbName)
+            self.assertEqual(storage.lastAlert('http://a.test'), (alerts[-1][1],) + alerts[-1][:1] + alerts[-1][2:])
+            self.assertEqual([alert[1:] for alert in storage.pageAlerts(8)], [(alert[1], alert[0]) + alert[2:] for alert in reversed(alerts)])
+
+            # An archive can't be imported before the notifications older than it
+            with self.assertRaises(ValueError):
+                importArchive(dbName, archive)
+            self.assertEqual(list(iterRows(dbName, alertsQuery)), alerts)
+
+            otherDbName = os.path.join(directory, 'other.db')
+            self.assertEqual(importArchive(otherDbName, archive, since=datetime(2018, 1, 2, 6)), (24, 2))
+            self.assertEqual(list(iterRows(otherDbName, samplesQuery)), samples[24:48])
+
+    def testMigration(self):
+        # A database of a previous version of the app (without the timing columns) is only used once converted on
+        # request, and its data points are then read back unchanged through the website_monitoring view
+        with tempfile.TemporaryDirectory() as directory:
+            dbName = os.path.join(directory, 'legacy.db')
+            samples = [('http://{}.test'.format('ab'[i % 2]), '2018-01-01 00:{:02d}:{:02d}'.format(i // 8, i % 4),
+                i % 3 != 0, 200, i * 1.5) for i in range(80)]
+            createLegacyDatabase(dbName, samples + [('http://a.test', 'garbage', True, 200, 1.0)], dbutils.SAMPLE_COLUMNS[:5])
+
+            with self.assertRaises(ValueError):
+                initDatabase(dbName)
+            with self.assertRaises(ValueError):
+                list(recordedSamples(dbName))
+            self.assertEqual(migrateDatabase(dbName), 80)
+            self.assertIsNone(migrateDatabase(dbName))
+            initDatabase(dbName)
+            expected = [sample + (None,) * (len(dbutils.SAMPLE_COLUMNS) - 5) for sample in sorted(samples, key=lambda sample: (sample[1], sample[0]))]
+            rows = list(iterRows(dbName, "SELECT * FROM website_monitoring ORDER BY timestamp, host"))
+            self.assertEqual(sorted(rows), sorted(expected))
+
+            # Both data points recorded during the same second are kept
+            self.assertEqual(len(list(dbutils.iterSamples(dbName, 'http://a.test', 11, datetime(2018, 1, 1, 0, 10)))), 40)
+            insertSample(dbName, {'timestamp': '2018-01-01 00:09:00', 'host': 'http://c.test', 'available': True, 'status': 200})
+            counts = Counter()
+            for host, group in dbutils.aggregateAllSamples(dbName, 5, datetime(2018, 1, 1, 0, 10)):
+                counts[host] += group[3]
+            self.assertEqual(counts, {'http://a.test': 18, 'http://b.test': 20, 'http://c.test': 1})
+
+    def testMergedAlertFeed(self):
+        # The notifications of several storages are printed in a single feed, in time order
+        with tempfile.TemporaryDirectory() as directory:
+            storages = [MemoryBackend(), SqliteBackend(os.path.join(directory, 'a.db')), SqliteBackend(os.path.join(directory, 'b.db'))]
+            for storage in storages:
+                storage.initStorage()
+
+            def append(i):
+                # Notification i is stored in the storage i % 3, with a timestamp i hours after the start of 2018
+                date = (datetime(2018, 1, 1) + timedelta(hours=i)).strftime('%d/%m/%Y %H:%M:%S')
+                storages[i % 3].appendAlert({'host': 'http://{}.test'.format(i), 'timestamp': date, 'type': 'alert',
+                    'startDate': date, 'endDate': None, 'availability': 0.5})
+
+            def printed(function):
+                # Numbers of the notifications printed by the function
+                output = StringIO()
+                with contextlib.redirect_stdout(output):
+                    function()
+                return [int(line.split('http://')[1].split('.')[0]) for line in output.getvalue().splitlines() if 'http://' in line]
 
-# Mock server for testing purposes
-# Only has one route which responds to GET requests
-app = Flask(__name__)
+            for i in range(20):
+                append(i)
+            watcher = AlertWatcher(storages, pageSize=8)
+            watcher.lastIds = [storage.pageAlerts(1)[0][0] for storage in storages]
+            self.assertEqual(printed(watcher.printPage), list(range(12, 20)))
+            self.assertEqual(printed(watcher.printPage), list(range(4, 12)))
+            self.assertEqual(printed(watcher.printPage), list(range(0, 4)))
+            self.assertEqual(printed(watcher.printPage), [])
 
-@app.route('/')
-def hello_world():
-    return 'Hello'
+            for i in range(21, 26):
+                append(i)
+            self.assertEqual(printed(watcher.printNew), [21, 22, 23, 24, 25])
+            append(30)
+            self.assertEqual(printed(watcher.printNew), [30])
+            self.assertEqual(printed(watcher.printNew), [])
 
-def testServer():
-    """Test script for the alerting logic.
+    def testLazyImports(self):
+        # The alert mode doesn't import the dependencies of the other modes
+        with tempfile.TemporaryDirectory() as directory:
+            _, _, modules = measureStartup(['-a', '-db', os.path.join(directory, 'test.db'), '--until', '2000-01-01'])
+        self.assertIn('alertWatcher', modules)
+        self.assertFalse({'requests', 'flask', 'test', 'app'} & modules)
+
+    def testReplay(self):
+        # Synthetic data points, and the same data points recorded in a database, raise the same notifications
+        spec = {'start': '2018-01-01', 'duration': 1200, 'seed': 1, 'websites': [
+            {'URL': 'http://stable.test', 'copies': 2},
+            {'URL': 'http://down.test', 'incidents': [{'start': 300, 'duration': 300, 'availability': 0}]},
+        ]}
+        report = Replay().run(syntheticSamples(spec))
+        self.assertEqual((report['samples'], report['websites'], report['dataSeconds']), (1800, 3, 1198))
+        self.assertEqual([(alert[1], alert[2], alert[0]) for alert in report['notifications']], [
+            ('http://down.test', 'alert', '01/01/2018 00:05:30'),
+            ('http://down.test', 'recovery', '01/01/2018 00:11:40'),
+        ])
+
+        with tempfile.TemporaryDirectory() as directory:
+            storage = SqliteBackend(os.path.join(directory, 'test.db'))
+            storage.initStorage()
+            for sample in syntheticSamples(spec):
+                storage.appendSample(sample)
+            self.assertEqual(Replay().run(recordedSamples(storage.dbName))['notifications'], report['notifications'])
+            self.assertEqual(Replay().run(recordedSamples(storage.dbName, until=datetime(2018, 1, 1, 0, 8)))['notifications'],
+                report['notifications'][:1])
+
+    def testSummary(self):
+        # The worst websites are ranked by availability, 95th percentile of the response times or 5xx responses
+        with tempfile.TemporaryDirectory() as directory:
+            for storage in [MemoryBackend(), SqliteBackend(os.path.join(directory, 'test.db'))]:
+                storage.initStorage()
+                clock = FakeClock()
+                sites = {
+                    'http://up.test': [(True, 200, 10 + i) for i in range(100)],
+                    'http://slow.test': [(True, 200, 10 * (i + 1)) for i in range(100)],
+                    'http://flaky.test': [(i % 2 == 0, 200 if i % 2 == 0 else None, 20) for i in range(10)],
+                    'http://broken.test': [(False, 503, 5)] * 3 + [(True, 200, 5)] * 7,
+                }
+                for host, sequence in sites.items():
+                    transport = StubTransport()
+                    site = Monitor(host, storage, clock=clock, transport=transport)
+                    for up, status, responseTime in sequence:
+                        transport.up, transport.status, transport.responseTime = up or status is not None, status, responseTime
+                        site.get()
+
+                stats, totals = summarize(storage.bulkIterSamples(list(sites) + ['http://unknown.test'], 10, clock()))
+                self.assertEqual(totals['sites'], 4)
+                self.assertEqual(totals['checks'], 220)
+                self.assertEqual(totals['serverErrors'], 3)
+                self.assertEqual(totals['downSites'], 2)
+                self.assertAlmostEqual(stats['http://up.test']['availability'], 1)
+                # The percentiles are estimated with a relative error of at most 10%
+                self.assertTrue(950 <= stats['http://slow.test']['p95RT'] <= 950 * 1.1)
+                self.assertIsNone(summarize([])[1]['availability'])
+                self.assertIsNone(stats['http://up.test']['recentAvailability'])
+                recent = summarize(storage.bulkIterSamples(sites, 10, clock()), '2017-12-31 23:58:00')[0]
+                self.assertEqual([recent[host]['recentAvailability'] for host in sites], [1, 1, 0.5, 0.7])
+
+                self.assertEqual([host for host, _ in worstSites(stats, 'availability', 2)], ['http://flaky.test', 'http://broken.test'])
+                self.assertEqual([host for host, _ in worstSites(stats, 'p95', 1)], ['http://slow.test'])
+                self.assertEqual([host for host, _ in worstSites(stats, '5xx', 1)], ['http://broken.test'])
+
+    def testSummaryAlerts(self):
+        # In summary mode, the alert status is computed from the streamed data points and the last notifications,
+        # and the alert of a website is only checked on its own when a notification may have to be sent
+        self.createSite(MemoryBackend())
+        storage = self.monitor.storage
+        other = Retriever(self.URL, storage, clock=self.clock)
+
+        def bulkCheck(retriever):
+            now = self.clock()
+            sites, _ = summarize(storage.bulkIterSamples([self.URL], 10, now), (now - timedelta(minutes=2)).strftime('%Y-%m-%d %H:%M:%S'))
+            availability = sites[self.URL]['recentAvailability'] if self.URL in sites else None
+            alertStatus = retriever.alertStatus(storage.bulkLastAlert([self.URL]).get(self.URL), availability)
+            return (alertStatus, False) if alertStatus is not None else (retriever.checkAlert(), True)
+
+        self.measure(200, True)
+        self.measure(2, False)
+        self.assertEqual(bulkCheck(self.retriever)[0]['type'], None)
+        self.measure(40, False)
+        alertStatus, checked = bulkCheck(self.retriever)
+        self.assertEqual((alertStatus['type'], checked), ('alert', True))
+        self.assertAlmostEqual(alertStatus['availability'], 78 / 120)
+        self.assertEqual([(alertStatus['type'], checked) for alertStatus, checked in [bulkCheck(self.retriever), bulkCheck(other)]],
+            [('alert', False), ('alert', False)])
+
+        # The recovery is stored once, and the other retriever only notices it
+        self.measure(120, True)
+        self.assertEqual([(alertStatus['type'], checked) for alertStatus, checked in [bulkCheck(self.retriever), bulkCheck(other)]],
+            [('recovery', True), ('recovery', True)])
+        self.assertEqual([(bulkCheck(self.retriever)[0]['type']), bulkCheck(other)[0]['type']], [None, None])
+        self.assertEqual([alert[2] for alert in storage.iterAlerts()], ['alert', 'recovery'])
+
+        # Without data points over the last 2 minutes, the alert status is unknown
+        self.clock.advance(300)
+        self.assertEqual(bulkCheck(self.retriever), ({'type': None}, False))
+
+    def simulate(self, checkInterval, maxCheckInterval, outageStart, duration):
+        """Monitors the stub site with a check schedule, checking the alert status every 10 seconds as the app does.
+        The stub site is up until outageStart, and down afterwards.
+
+        Returns:
+            A tuple containing the number of checks of the site before the outage, and the time between the start
+            of the outage and the first alert, in seconds (None if there was no alert).
+
+        """
+
+        self.createSite(MemoryBackend())
+        start = self.clock()
+        schedule = CheckSchedule(checkInterval, maxCheckInterval, clock=lambda: (self.clock() - start).total_seconds())
+
+        nextCheck, nextAlertCheck = checkInterval, 10
+        checks, alertDelay = 0, None
+        while min(nextCheck, nextAlertCheck) < duration and alertDelay is None:
+            t = min(nextCheck, nextAlertCheck)
+            self.clock.now = start + timedelta(seconds=t)
+            if t == nextCheck:
+                self.transport.up = t < outageStart
+                checks += self.transport.up
+                nextCheck = t + schedule.next(self.monitor.get())
+            else:
+                if self.retriever.checkAlert()['type'] == 'alert':
+                    alertDelay = t - outageStart
+                nextAlertCheck = t + 10
+        return checks, alertDelay
+
+    def testAdaptiveInterval(self):
+        # A stable site is checked much less often, and an outage is still detected as fast
+        fixedChecks, fixedDelay = self.simulate(2, None, 3600, 4000)
+        adaptiveChecks, adaptiveDelay = self.simulate(2, 30, 3600, 4000)
+        self.assertEqual(fixedChecks, 1799)
+        self.assertLess(adaptiveChecks, fixedChecks / 10)
+        self.assertIsNotNone(adaptiveDelay)
+        self.assertLessEqual(adaptiveDelay, fixedDelay)
+
+    def testAdaptiveIntervalSpikes(self):
+        # Failures and response time spikes bring the interval back to the base interval during the hold time
+        clock = FakeClock()
+        schedule = CheckSchedule(2, 60, clock=lambda: clock().timestamp())
+        intervals = []
+        for available, responseTime in [(True, 20)] * 10 + [(True, 100), (True, 20), (False, None)] + [(True, 20)] * 60:
+            intervals.append(schedule.next({'available': available, 'responseTime': responseTime}))
+            clock.advance(intervals[-1])
+        self.assertEqual(intervals[9], 60)
+        self.assertEqual(intervals[10:13], [2, 2, 2])
+        # The base interval is kept until the last problem is two minutes old
+        self.assertEqual(intervals[13:72], [2] * 59)
+        self.assertGreater(intervals[72], 2)
+
+    def testRandomSequences(self):
+        # Property test: for random availability sequences and check times, the query-based
+        # alerting logic gives the same results as the incremental reference model
+        rand = random.Random(0)
+        for sequence in range(2000):
+            self.createSite(MemoryBackend())
+            model = IncrementalAlertModel()
+            upProbability = rand.random()
+
+            for step in range(rand.randint(5, 40)):
+                action = rand.random()
+                if action < 0.6:
+                    # Take a measurement
+                    self.transport.up = rand.random() < upProbability
+                    self.monitor.get()
+                    model.add(self.clock(), self.transport.up)
+                elif action < 0.8:
+                    # Let some time pass
+                    self.clock.advance(rand.randint(1, 60))
+                else:
+                    # Check the alert status with both logics
+                    expected = model.check(self.clock())
+                    alertStatus = self.retriever.checkAlert()
+                    message = 'sequence {}, step {}'.format(sequence, step)
+                    self.assertEqual(alertStatus['type'], expected['type'], message)
+                    if expected['type'] is not None:
+                        self.assertAlmostEqual(alertStatus['availability'], expected['availability'], msg=message)
+                        self.assertEqual(alertStatus['startDate'], expected['startDate'], message)
+                self.clock.advance(1)
+
+class DNSCacheTest(unittest.TestCase):
+    """Tests of the DNS cache of the probes, with a fake clock and a stub resolver.
+
+    """
+
+    ADDRESSES = [(socket.AF_INET, socket.SOCK_STREAM, socket.IPPROTO_TCP, '', ('192.0.2.1', 80))]
+
+    def setUp(self):
+        self.clock = FakeClock()
+        self.ttl = 30
+        self.up = True
+        self.lookups = 0
+        self.cache = probe.DNSCache(defaultTTL=60, maxStale=300, resolver=self.resolve, clock=lambda: self.clock().timestamp())
+
+    def resolve(self, host, port, timeout=None):
+        self.lookups += 1
+        if not self.up:
+            raise socket.gaierror(socket.EAI_AGAIN, 'Temporary failure in name resolution')
+        return self.ADDRESSES, self.ttl
+
+    def testTTL(self):
+        # Answers are served from the cache until their TTL expires
+        self.assertEqual(self.cache.resolve('example.com', 80), self.ADDRESSES)
+        self.clock.advance(29)
+        self.cache.resolve('example.com', 80)
+        self.assertEqual(self.lookups, 1)
+        self.clock.advance(2)
+        self.cache.resolve('example.com', 80)
+        self.assertEqual(self.lookups, 2)
+
+        # Without TTL, answers are kept defaultTTL seconds
+        self.ttl = None
+        self.cache.resolve('example.org', 80)
+        self.clock.advance(59)
+        self.cache.resolve('example.org', 80)
+        self.assertEqual(self.lookups, 3)
+        self.assertEqual(self.cache.stats(), {'hits': 2, 'misses': 3, 'stale': 0, 'failures': 0, 'size': 2})
+
+    def testServeStale(self):
+        # When the resolver fails, expired answers are served during maxStale seconds
+        self.cache.resolve('example.com', 80)
+        self.up = False
+        self.clock.advance(200)
+        self.assertEqual(self.cache.resolve('example.com', 80), self.ADDRESSES)
+        self.clock.advance(200)
+        with self.assertRaises(socket.gaierror):
+            self.cache.resolve('example.com', 80)
+        with self.assertRaises(socket.gaierror):
+            self.cache.resolve('example.net', 80)
+        stats = self.cache.stats()
+        self.assertEqual((stats['stale'], stats['failures']), (1, 2))
+
+        # The resolver is queried again as soon as it is back
+        self.up = True
+        self.cache.resolve('example.net', 80)
+        self.assertEqual(self.lookups, 5)
+
+    def testConcurrentLookups(self):
+        # Concurrent lookups of the same name only query the resolver once
+        started = threading.Event()
+        release = threading.Event()
+
+        def slowResolve(host, port, timeout=None):
+            started.set()
+            release.wait()
+            return self.resolve(host, port)
+
+        self.cache.resolver = slowResolve
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(self.cache.resolve('example.com', 80))) for _ in range(5)]
+        threads[0].start()
+        started.wait()
+        for thread in threads[1:]:
+            thread.start()
+        # Let the other threads reach the pending lookup before releasing the resolver
+        while self.cache.stats()['hits'] < 4:
+            time.sleep(0.001)
+        release.set()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(results, [self.ADDRESSES] * 5)
+        self.assertEqual(self.lookups, 1)
+        self.assertEqual(self.cache.stats()['misses'], 1)
+
+    def testTimeout(self):
+        # A lookup is bounded by the timeout given by the caller, also when it waits for the lookup of another thread
+        started = threading.Event()
+        release = threading.Event()
+        timeouts = []
+
+        def slowResolve(host, port, timeout=None):
+            timeouts.append(timeout)
+            started.set()
+            if not release.wait(timeout):
+                raise socket.timeout('timed out')
+            return self.resolve(host, port)
+
+        self.cache.resolver = slowResolve
+        owner = threading.Thread(target=lambda: self.cache.resolve('example.com', 80))
+        owner.start()
+        started.wait()
+        with self.assertRaises(socket.timeout):
+            self.cache.resolve('example.com', 80, 0.01)
+        release.set()
+        owner.join()
+
+        # A resolver timing out is a failure of the resolver: the expired answer is served if there is one
+        release.clear()
+        self.clock.advance(60)
+        self.assertEqual(self.cache.resolve('example.com', 80, 0.01), self.ADDRESSES)
+        with self.assertRaises(socket.timeout):
+            self.cache.resolve('example.net', 80, 0.01)
+        self.assertEqual(timeouts, [None, 0.01, 0.01])
+        stats = self.cache.stats()
+        self.assertEqual((stats['stale'], stats['failures']), (1, 1))
+
+        # The requests give their connect timeout to the lookup, and a lookup timing out is a timeout of the check
+        resolver, probe.dnsCache.resolver = probe.dnsCache.resolver, slowResolve
+        try:
+            sample = Monitor('http://slow-resolver.test/', MemoryBackend(), connectTimeout=0.02).get()
+        finally:
+            probe.dnsCache.resolver = resolver
+        self.assertEqual(timeouts[-1], 0.02)
+        self.assertEqual((sample['available'], sample['failure']), (False, 'timeout'))
+
+class NotificationsTest(unittest.TestCase):
+    """Tests of the delivery of the notifications to external receivers, against a local stub receiver.
+
+    """
+
+    def setUp(self):
+        self.receiver = StubReceiver()
+        self.directory = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.receiver.close()
+        self.directory.cleanup()
+
+    def notification(self, host, type, availability=0.5):
+        return { 'host': host, 'timestamp': '01/01/2018 00:00:00', 'type': type, 'startDate': '01/01/2018 00:00:00',
+            'endDate': None if type == 'alert' else '01/01/2018 00:05:00', 'availability': availability }
+
+    def testBatchesAndRetries(self):
+        # The pending notifications about a website are coalesced, and delivered in a batch, after two failed deliveries
+        self.receiver.failures = 2
+        dispatcher = Dispatcher([WebhookSink('hook', self.receiver.URL)], self.directory.name, batchDelay=0.2, retryDelay=0.05)
+        dispatcher.start()
+        dispatcher.submit(self.notification('http://a.test', 'alert'))
+        dispatcher.submit(self.notification('http://b.test', 'alert'))
+        dispatcher.submit(self.notification('http://a.test', 'recovery', 0.9))
+        dispatcher.submit(self.notification('http://a.test', 'latencyAlert', 250))
+        self.assertTrue(dispatcher.flush(5))
+        dispatcher.stop()
+
+        self.assertEqual(self.receiver.requests, 3)
+        self.assertEqual([(notification['URL'], notification['type']) for notification in self.receiver.batches[0]],
+            [('http://b.test', 'alert'), ('http://a.test', 'recovery'), ('http://a.test', 'latencyAlert')])
+        self.assertEqual(self.receiver.batches[0][2]['responseTime'], 250)
+        stats = dispatcher.stats()
+        self.assertEqual((stats['delivered'], stats['coalesced'], stats['failures'], stats['pending']), (3, 1, 2, 0))
+
+    def testJournal(self):
+        # The notifications not delivered when the dispatcher stops are delivered by the next one
+        self.receiver.failures = 1000
+        dispatcher = Dispatcher([WebhookSink('hook', self.receiver.URL)], self.directory.name, batchDelay=0, retryDelay=10)
+        dispatcher.start()
+        dispatcher.submit(self.notification('http://a.test', 'alert'))
+        self.assertFalse(dispatcher.flush(0.5))
+        self.assertIn('hook', dispatcher.stats()['failing'])
+        dispatcher.stop()
+
+        self.receiver.failures = 0
+        dispatcher = Dispatcher([WebhookSink('hook', self.receiver.URL)], self.directory.name, batchDelay=0)
+        self.assertEqual(dispatcher.stats()['pending'], 1)
+        dispatcher.start()
+        self.assertTrue(dispatcher.flush(5))
+        dispatcher.stop()
+        dispatcher = Dispatcher([WebhookSink('hook', self.receiver.URL)], self.directory.name)
+        self.assertEqual(dispatcher.stats()['pending'], 0)
+        dispatcher.stop()
+        self.assertEqual(self.receiver.batches, [[{ 'URL': 'http://a.test', 'timestamp': '01/01/2018 00:00:00', 'type': 'alert',
+            'startDate': '01/01/2018 00:00:00', 'endDate': None, 'availability': 0.5 }]])
+
+    def testJournalCompaction(self):
+        # The journal is rewritten with only the notifications not yet delivered once the delivered ones make up most of it
+        compaction = notifications.JOURNAL_COMPACTION
+        notifications.JOURNAL_COMPACTION = 10
+        journalPath = os.path.join(self.directory.name, notifications.JOURNAL_FILE)
+        try:
+            dispatcher = Dispatcher([WebhookSink('hook', self.receiver.URL)], self.directory.name, batchDelay=0)
+            dispatcher.start()
+            for i in range(100):
+                dispatcher.submit(self.notification('http://{}.test'.format(i), 'alert'))
+                self.assertTrue(dispatcher.flush(5))
+                with open(journalPath) as journal:
+                    self.assertLessEqual(len(journal.readlines()), 2 * notifications.JOURNAL_COMPACTION)
+            dispatcher.stop()
+
+            # The notifications coalesced while the receiver fails are dropped, the newest ones are kept
+            self.receiver.failures = 1000
+            dispatcher = Dispatcher([WebhookSink('hook', self.receiver.URL)], self.directory.name, batchDelay=0, retryDelay=10)
+            dispatcher.start()
+            for availability in (0.1, 0.2, 0.3):
+                for i in range(10):
+                    dispatcher.submit(self.notification('http://{}.test'.format(i), 'alert', availability))
+            with open(journalPath) as journal:
+                self.assertLess(len(journal.readlines()), 30)
+            dispatcher.stop()
+        finally:
+            notifications.JOURNAL_COMPACTION = compaction
+
+        with open(journalPath) as journal:
+            records = [json.loads(line) for line in journal]
+        pending = {}
+        for record in records:
+            if 'done' in record:
+                for id in record['done']:
+                    pending.pop(id)
+            else:
+                pending[record['id']] = record['notification']
+        self.assertEqual(sorted((notification['URL'], notification['availability']) for notification in pending.values()),
+            sorted(('http://{}.test'.format(i), 0.3) for i in range(10)))
+        dispatcher = Dispatcher([WebhookSink('hook', self.receiver.URL)], self.directory.name)
+        self.assertEqual(dispatcher.stats()['pending'], 10)
+        dispatcher.stop()
+
+    def testAlertsSubmitted(self):
+        # The new notifications of the Retrievers are submitted to the dispatcher, the ongoing alerts are not
+        dispatcher = Dispatcher([WebhookSink('hook', self.receiver.URL)], batchDelay=0)
+        clock = FakeClock()
+        transport = StubTransport()
+        storage = MemoryBackend()
+        monitor = Monitor('http://stub.test', storage, clock=clock, transport=transport)
+        retriever = Retriever('http://stub.test', storage, clock=clock, dispatcher=dispatcher)
+        for up in [False, False, False, True, True, True, True, True, True, True, True, True, True, True, True, True]:
+            transport.up = up
+            clock.advance(1)
+            monitor.get()
+            retriever.checkAlert()
+        dispatcher.start()
+        self.assertTrue(dispatcher.flush(5))
+        dispatcher.stop()
+        self.assertEqual([notification['type'] for batch in self.receiver.batches for notification in batch], ['recovery'])
+        self.assertEqual(dispatcher.stats()['coalesced'], 1)
+
+    def testConcurrencyAndSlowReceiver(self):
+        # Submitting doesn't wait for a slow receiver, and the deliveries in progress are limited per sink
+        self.receiver.gate = threading.Event()
+        output = os.path.join(self.directory.name, 'command.log')
+        command = [sys.executable, '-c', 'import sys; open(sys.argv[1], "a").write(sys.stdin.read() + "\\n")', output]
+        dispatcher = Dispatcher([WebhookSink('hook', self.receiver.URL, batchSize=1, concurrency=2), CommandSink('command', command)],
+            batchDelay=0)
+        dispatcher.start()
+        start = time.perf_counter()
+        for i in range(6):
+            dispatcher.submit(self.notification('http://{}.test'.format(i), 'alert'))
+        self.assertLess(time.perf_counter() - start, 0.1)
+
+        time.sleep(0.3)
+        self.assertEqual(self.receiver.maxActive, 2)
+        self.receiver.gate.set()
+        self.assertTrue(dispatcher.flush(5))
+        dispatcher.stop()
+        self.assertEqual(len(self.receiver.batches), 6)
+        with open(output) as file:
+            self.assertEqual(sum(len(json.loads(line)) for line in file), 6)
+
+class SegmentStoreTest(unittest.TestCase):
+    """Deterministic tests of the segment files storage engine, with small segments so that they rotate."""
+
+    URL = 'http://segments.test/health?full=1'
+
+    def setUp(self):
+        self.recordsPerSegment = segmentStore.SEGMENT_RECORDS
+        segmentStore.SEGMENT_RECORDS = 8
+        self.directory = tempfile.TemporaryDirectory()
+        self.store = segmentStore.SegmentStore(self.directory.name)
+        # One data point every 10 seconds, the last one 5 seconds ago: the windows start between two data points
+        self.start = datetime.utcnow().replace(microsecond=0) - timedelta(seconds=495)
+        for i in range(50):
+            self.store.insertSample({'host': self.URL, 'timestamp': self.timestamp(10 * i), 'available': i % 7 != 0,
+                'status': 200 if i % 7 != 0 else None, 'responseTime': i if i % 7 != 0 else None})
+
+    def tearDown(self):
+        segmentStore.SEGMENT_RECORDS = self.recordsPerSegment
+        self.directory.cleanup()
+
+    def timestamp(self, seconds):
+        return (self.start + timedelta(seconds=seconds)).strftime('%Y-%m-%d %H:%M:%S')
+
+    def segmentNames(self):
+        return sorted(os.listdir(os.path.join(self.directory.name, quote(self.URL, safe=''))))
+
+    def testRotation(self):
+        # 50 data points in 7 segments of 8 records, named after their first data point
+        names = self.segmentNames()
+        self.assertEqual([float(name[:-4]) - float(names[0][:-4]) for name in names], [80.0 * i for i in range(7)])
+        hostDirectory = os.path.join(self.directory.name, quote(self.URL, safe=''))
+        self.assertEqual([os.path.getsize(os.path.join(hostDirectory, name)) // segmentStore.RECORD.size for name in names],
+            [8] * 6 + [2])
+
+    def testWindows(self):
+        # Windows starting in the last segment, in the middle of older segments and before all the data points
+        for minutes, first in [(1, 44), (2, 38), (5, 20), (10, 0)]:
+            rows = list(self.store.iterSamples(self.URL, minutes))
+            self.assertEqual([row[0] for row in rows], [self.timestamp(10 * i) for i in range(first, 50)], minutes)
+            self.assertEqual([row[1] for row in rows], [i % 7 != 0 for i in range(first, 50)], minutes)
+            self.assertEqual([row[3] for row in rows], [i if i % 7 != 0 else None for i in range(first, 50)], minutes)
+        self.assertEqual(list(self.store.iterSamples('http://unknown.test', 10)), [])
+        self.assertIsNone(self.store.queryLastSample('http://unknown.test'))
+
+    def testReopen(self):
+        # The index, the size of the last segment and the last timestamp are rebuilt from the files
+        reopened = segmentStore.SegmentStore(self.directory.name)
+        for minutes in [1, 2, 5, 10]:
+            self.assertEqual(list(reopened.iterSamples(self.URL, minutes)), list(self.store.iterSamples(self.URL, minutes)))
+        self.assertEqual(reopened.queryLastSample(self.URL)[0], self.timestamp(490))
+
+        # The last segment is filled up before a new one is started
+        for i in range(7):
+            reopened.insertSample({'host': self.URL, 'timestamp': self.timestamp(500 + i), 'available': True, 'status': 200, 'responseTime': 1})
+        self.assertEqual(len(self.segmentNames()), 8)
+        self.assertEqual(reopened.queryLastSample(self.URL)[0], self.timestamp(506))
+
+    def testLateAppends(self):
+        # A late data point is stored at the time of the previous one, so that the segments stay in time order;
+        # the segments starting at the same time get different names
+        for i in range(20):
+            self.store.insertSample({'host': self.URL, 'timestamp': self.timestamp(300), 'available': True, 'status': 200, 'responseTime': 100 + i})
+        names = self.segmentNames()
+        self.assertEqual(len(names), 9)
+        self.assertEqual(float(names[-2][:-4]) - float(names[0][:-4]), 490.0)
+        self.assertGreater(float(names[-1][:-4]), float(names[-2][:-4]))
+        rows = list(self.store.iterSamples(self.URL, 1))
+        self.assertEqual([row[0] for row in rows], [self.timestamp(10 * i) for i in range(44, 50)] + [self.timestamp(490)] * 20)
+        self.assertEqual([row[3] for row in rows][6:], list(range(100, 120)))
+
+    def testLayout(self):
+        # A directory written with another record layout is refused
+        layoutPath = os.path.join(self.directory.name, segmentStore.LAYOUT_FILE)
+        with open(layoutPath, 'w') as layoutFile:
+            layoutFile.write('<dhbb')
+        with self.assertRaises(ValueError):
+            segmentStore.SegmentStore(self.directory.name)
+        os.remove(layoutPath)
+        with self.assertRaises(ValueError):
+            segmentStore.SegmentStore(self.directory.name)
+
+def runTests():
+    """Runs the deterministic tests of the alerting logic and of the DNS cache, and prints the result.
+
+    Returns:
+        True if all the tests passed, False otherwise.
+
+    """
+
+    suite = unittest.TestSuite(unittest.defaultTestLoader.loadTestsFromTestCase(testCase) for testCase in (AlertingLogicTest, SegmentStoreTest, DNSCacheTest, NotificationsTest))
+    result = unittest.TextTestRunner(verbosity=2).run(suite)
+    if result.wasSuccessful():
+        print('\033[1;92mAll checks for the alerting logic are OK\033[0m')
+    else:
+        print('\033[1;91mAlerting logic checks did not go as expected\033[0m')
+    return result.wasSuccessful()
+
+def measureStartup(arguments):
+    """Starts the app with some arguments, until it prints its first line.
+
+    Args:
+        arguments (list): Arguments of monitoringApp.py.
+
+    Returns:
+        A tuple composed of:
+            - the time spent importing modules before the first line, in milliseconds,
+            - the time between the start of the process and the first line, in milliseconds,
+            - the set of the names of the modules imported before the first line.
+
+    """
+
+    # The output is unbuffered, and the import times (-X importtime) are printed along with it
+    script = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'monitoringApp.py')
+    start = time.perf_counter()
+    process = subprocess.Popen([sys.executable, '-u', '-X', 'importtime', script] + arguments,
+        stdin=subprocess.DEVNULL, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True)
+
+    importTime = 0
+    modules = set()
+    try:
+        for line in process.stdout:
+            if not line.startswith('import time:'):
+                break
+            # Line format: import time: <self (us)> | <cumulative (us)> | <indentation><module>
+            _, cumulative, name = line.split('|')
+            modules.add(name.strip())
+            if cumulative.strip().isdigit() and not name[1:].startswith(' '):
+                # Only count the top-level imports, whose cumulative time includes their own imports
+                importTime += int(cumulative) / 1000
+        firstOutput = (time.perf_counter() - start) * 1000
+    finally:
+        process.kill()
+        process.wait()
+        process.stdout.close()
+
+    return importTime, firstOutput, modules
+
+def startupBenchmark(runs=5):
+    """Measures the startup of each mode of the app (import time and time to first output, median of several
+    runs), and prints the results with the heavy dependencies imported by each mode.
+
+    Args:
+        runs (int, optional): Number of runs of each mode.
+
+    """
+
+    with tempfile.TemporaryDirectory() as directory:
+        configFile = os.path.join(directory, 'config.json')
+        with open(configFile, 'w') as file:
+            json.dump({'websites': [{'URL': 'http://localhost:9'}], 'defaultCheckInterval': 60}, file)
+        dbName = os.path.join(directory, 'startup.db')
+
+        modes = {
+            '-m': ['-m', '-c', configFile, '-db', dbName],
+            '-a': ['-a', '-db', dbName, '--until', '2000-01-01'],
+            '-t': ['-t'],
+        }
+        print('\033[94;1mMode   Import time   First output   Heavy dependencies\033[0m')
+        for mode, arguments in modes.items():
+            results = [measureStartup(arguments) for _ in range(runs)]
+            heavy = sorted({'requests', 'dns', 'flask', 'multiprocessing'} & results[0][2])
+            print('{:<6} {:>8.1f}ms   {:>10.1f}ms   {}'.format(mode, statistics.median(result[0] for result in results),
+                statistics.median(result[1] for result in results), ', '.join(heavy) or '-'))
+
+def schemaBenchmark(hosts=200, samples=2000):
+    """Measures the size and scan speed of the data points in the layout of the previous versions of the app,
+    then converts the database to the compact layout (see dbutils.migrateDatabase) and measures them again.
+
+    Args:
+        hosts (int, optional): Number of websites,
+        samples (int, optional): Number of data points of each website (one every 10 seconds).
+
+    """
+
+    with tempfile.TemporaryDirectory() as directory:
+        dbName = os.path.join(directory, 'schema.db')
+        start = datetime(2018, 1, 1)
+        generator = random.Random(0)
+        createLegacyDatabase(dbName, (
+            ('https://website-{}.example.com/health'.format(host), str(start + timedelta(seconds=10 * i)), True, 200,
+                generator.uniform(50, 500), None, 1.5, 10.25, 20.5, 30.75, 2.0, None)
+            for i in range(samples) for host in range(hosts)))
+        sqlite3.connect(dbName).execute('VACUUM').close()
+        now = start + timedelta(seconds=10 * samples)
+
+        def measure(fullScan, windowScan):
+            # Bytes per data point, and durations of an aggregation of all the data points and of the
+            # aggregation of the last 10 minutes of each website, in milliseconds
+            size = os.path.getsize(dbName) / (hosts * samples)
+            begin = time.perf_counter()
+            list(fullScan())
+            full = (time.perf_counter() - begin) * 1000
+            begin = time.perf_counter()
+            for host in range(hosts):
+                list(windowScan('https://website-{}.example.com/health'.format(host)))
+            window = (time.perf_counter() - begin) * 1000
+            return size, full, window
+
+        # Queries of the previous versions of the app
+        before = measure(
+            lambda: iterRows(dbName, 'SELECT host, {} FROM website_monitoring GROUP BY host, available, status, failure'.format(
+                dbutils.AGGREGATE_COLUMNS)),
+            lambda host: iterRows(dbName, "SELECT {} FROM website_monitoring \
+                WHERE host = ? AND datetime(timestamp) > datetime(?, '-10 minutes') \
+                GROUP BY available, status, failure".format(dbutils.AGGREGATE_COLUMNS), (host, dbutils.sqlDate(now))))
+
+        begin = time.perf_counter()
+        migrateDatabase(dbName)
+        migration = time.perf_counter() - begin
+
+        after = measure(
+            lambda: dbutils.aggregateAllSamples(dbName, 10 * samples, now),
+            lambda host: dbutils.aggregateSamples(dbName, host, 10, now))
+
+        print('\033[94;1m{} data points of {} websites (converted in {:.1f}s)\033[0m'.format(hosts * samples, hosts, migration))
+        print('\033[94;1mLayout    Bytes/point   Full aggregation   Windows of all websites\033[0m')
+        for name, (size, full, window) in (('Previous', before), ('Compact', after)):
+            print('{:<9} {:>11.1f}   {:>14.1f}ms   {:>21.1f}ms'.format(name, size, full, window))
+
+def alertsBenchmark(hosts=2000, alerts=1000000):
+    """Measures the time taken to load the most recent notification of every website (see App.__warmStart) from
+    a long notifications history, with the query of the previous versions of the app and with the current one.
 
     Args:
-        retriever (Retriever): Retriever of the test server.
-        monitor (Monitor): Monitor of the test server.
+        hosts (int, optional): Number of websites,
+        alerts (int, optional): Number of notifications in the history.
 
     """
 
+    with tempfile.TemporaryDirectory() as directory:
+        dbName = os.path.join(directory, 'alerts.db')
+        initDatabase(dbName)
+        generator = random.Random(0)
+        connection = sqlite3.connect(dbName)
+        connection.executemany('INSERT INTO website_alerts VALUES (?, ?, ?, ?, ?, ?)', (
+            ('https://website-{}.example.com/health'.format(generator.randrange(hosts)), '01/01/2018 00:00:00',
+                generator.choice(['alert', 'recovery', 'latencyAlert', 'latencyRecovery']), '01/01/2018 00:00:00', None, 0.5)
+            for _ in range(alerts)))
+        connection.commit()
+
+        def measure(query):
+            # Duration of the loading of the last notification of every website for both kinds of alerts, in milliseconds
+            begin = time.perf_counter()
+            results = [sorted(query(types)) for types in ALERT_TYPES.values()]
+            return results, (time.perf_counter() - begin) * 1000
+
+        # Query and indexes of the previous versions of the app (the whole host index was scanned, and every notification read)
+        connection.execute('DROP INDEX website_alerts_host_type')
+        connection.close()
+        before, previous = measure(lambda types: iterRows(dbName, 'SELECT timestamp, host, type, startDate, endDate, availability \
+            FROM website_alerts WHERE rowid IN (SELECT MAX(rowid) FROM website_alerts WHERE type IN ({}) GROUP BY host)'.format(
+            ', '.join('?' for _ in types)), tuple(types)))
+        initDatabase(dbName)
+        after, current = measure(lambda types: dbutils.queryLastAlerts(dbName, types))
+        assert before == after
+
+        print('\033[94;1m{} notifications of {} websites\033[0m'.format(alerts, hosts))
+        print('\033[94;1mQuery      Last notifications of all websites\033[0m')
+        for name, duration in (('Previous', previous), ('Current', current)):
+            print('{:<10} {:>30.1f}ms'.format(name, duration))
+
+def liveTest():
+    """End-to-end test script for the alerting logic, against a real local server.
+    It takes about 15 seconds: for a quick check of the alerting logic, see runTests.
+    It isn't named like a test, so that the test runners don't collect it.
+
+    Returns:
+        True if all the checks passed, False otherwise.
+
+    """
+
+    # Flask is only needed by this test, so it is only imported here
+    from multiprocessing import Process
+    from flask import Flask
+
+    # Mock server for testing purposes
+    # Only has one route which responds to GET requests
+    app = Flask(__name__)
+
+    @app.route('/')
+    def hello_world():
+        return 'Hello'
+
+    # Find a free port for the server
+    with socket.socket() as sock:
+        sock.bind(('localhost', 0))
+        port = sock.getsockname()[1]
+    URL = "http://localhost:{}".format(port)
+
     # First, remove flask's logs to avoid cluttering the screen
     log = logging.getLogger('werkzeug')
     log.setLevel(logging.ERROR)
@@ -36,11 +1537,11 @@ def testServer():
     initDatabase("test.db")
 
     # Create a Monitor and Retriever for the local server
-    monitor = Monitor("http://localhost:7000", "test.db")
-    retriever = Retriever("http://localhost:7000", "test.db")
+    monitor = Monitor(URL, "test.db")
+    retriever = Retriever(URL, "test.db")
 
     # Start the server
-    server = Process(target=app.run, kwargs={'port':7000})
+    server = Process(target=app.run, kwargs={'port':port})
     server.start()
     print('Starting the server, waiting for first alert check...\n')
 
@@ -84,7 +1585,7 @@ def testServer():
         res.append(True)
 
     # Restart the server
-    server = Process(target=app.run, kwargs={'port':7000})
+    server = Process(target=app.run, kwargs={'port':port})
     server.start()
 
     # Take some measurements
@@ -117,6 +1618,7 @@ def testServer():
 
     # We shut down the server for the last time
     server.terminate()
+    server.join()
     print('Shutting down the server and waiting for alert event...\n')
 
     # Take some measurements
@@ -137,8 +1639,10 @@ def testServer():
 
     if len(res) == 4:
         print('\033[1;92mAll checks for the alerting logic are OK\033[0m')
-        os._exit(0)
     else:
         print('\033[1;91mAlerting logic checks did not go as expected\033[0m')
-        os._exit(1)
+    return len(res) == 4
+
 
+if __name__ == '__main__':
+    unittest.main()
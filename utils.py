@@ -1,4 +1,5 @@
 from datetime import datetime
+from collections import Counter
 
 def formatTime(time):
     """Takes a string representation of a date compatible with the database and returns a string representing it in a better format.
@@ -48,9 +49,11 @@ def formatStats(minutes, stats):
         stats (dict): Stats to be printed:
             availability (float): Availability of the website,
             statusCodes (collections.Counter): Counts of the different response codes from requests on the website,
+            failures (collections.Counter, optional): Counts of the different classes of failures of the requests without response,
             avgRT (float): Average response time,
             minRT (float): Minimum response time,
-            maxRT (float): Maximum response time.
+            maxRT (float): Maximum response time,
+            phases (dict, optional): Average durations of the phases of the requests.
 
     Returns:
         A pretty string representation of the stats.
@@ -59,9 +62,154 @@ def formatStats(minutes, stats):
 
     return '\n\033[4;93mFor the past {} minutes:\033[0m'.format(minutes) + \
     '\n\tMin/Avg/Max response time: {:.2f}/{:.2f}/{:.2f} ms'.format(stats['minRT'], stats['avgRT'], stats['maxRT']) + \
+    formatPhases(stats.get('phases', {})) + \
     '\n\tResponse counts: {}'.format(printCounter(stats['statusCodes'])) + \
+    formatFailures(stats.get('failures')) + \
     formatUptime(stats['availability'])
 
+def formatFailures(failures):
+    """Takes the counts of the classes of failures and returns a string representing them in a user-friendly format.
+
+    Args:
+        failures (collections.Counter): Counts of the different classes of failures.
+
+    Returns:
+        A pretty string representation of the counts, or an empty string if there was no failure.
+
+    """
+
+    if not failures:
+        return ''
+
+    return '\n\tFailures: (\033[91m{}\033[0m)'.format('; '.join('{}: {}'.format(failure, count) for failure, count in failures.most_common()))
+
+def formatPhases(phases):
+    """Takes the average durations of the phases of the requests and returns a string representing them in a user-friendly format.
+
+    Args:
+        phases (dict of str:float): Average duration of each phase (None if it was never measured).
+
+    Returns:
+        A pretty string representation of the durations, or an empty string if no phase was measured.
+
+    """
+
+    names = [('dnsTime', 'DNS'), ('connectTime', 'connect'), ('tlsTime', 'TLS'), ('firstByteTime', 'first byte'), ('downloadTime', 'download')]
+    measured = [(label, phases[phase]) for phase, label in names if phases.get(phase) is not None]
+    if not measured:
+        return ''
+
+    return '\n\tAvg {} time: {} ms'.format('/'.join(label for label, _ in measured), '/'.join('{:.2f}'.format(value) for _, value in measured))
+
+def formatDNSCache(stats):
+    """Takes the counters of the DNS cache and returns a string representing them in a user-friendly format.
+
+    Args:
+        stats (dict): Counters of the cache (hits, misses, stale, failures and size).
+
+    Returns:
+        A pretty string representation of the counters.
+
+    """
+
+    lookups = stats['hits'] + stats['misses']
+    hitRate = stats['hits'] / lookups if lookups > 0 else 0
+    return '\n\033[37mDNS cache: {} names, {} hits / {} misses ({:.2%} hit rate), {} stale answers served, {} failures\033[0m'.format(
+        stats['size'], stats['hits'], stats['misses'], hitRate, stats['stale'], stats['failures'])
+
+def formatStatsCache(stats, name='Stats cache'):
+    """Takes the counters of a cache of the storage and returns a string representing them in a user-friendly format.
+
+    Args:
+        stats (dict): Counters of the cache (hits, misses, invalidations, evictions, entries and bytes, see statsCache.StatsCache.stats),
+        name (str, optional): Name of the cache.
+
+    Returns:
+        A pretty string representation of the counters.
+
+    """
+
+    lookups = stats['hits'] + stats['misses']
+    hitRate = stats['hits'] / lookups if lookups > 0 else 0
+    return '\n\033[37m{}: {} results ({:.1f} kB), {} hits / {} misses ({:.2%} hit rate), {} invalidations, {} evictions\033[0m'.format(
+        name, stats['entries'], stats['bytes'] / 1024, stats['hits'], stats['misses'], hitRate, stats['invalidations'], stats['evictions'])
+
+def formatNotifications(stats):
+    """Takes the counters of the notifications dispatcher and returns a string representing them in a user-friendly format.
+
+    Args:
+        stats (dict): Counters of the dispatcher (pending, delivered, coalesced, failures and failing, see notifications.Dispatcher.stats).
+
+    Returns:
+        A pretty string representation of the counters.
+
+    """
+
+    resString = '\n\033[37mNotifications: {} delivered, {} pending, {} coalesced, {} failed deliveries\033[0m'.format(
+        stats['delivered'], stats['pending'], stats['coalesced'], stats['failures'])
+    for name, error in stats['failing'].items():
+        resString += '\n\033[93mNotifications to {} are failing (retrying): {}\033[0m'.format(name, error)
+    return resString
+
+def formatSummary(minutes, totals, monitored, onAlert):
+    """Takes the totals of the summary of the websites and returns a string representing them in a user-friendly format.
+
+    Args:
+        minutes (int): Timeframe of the summary,
+        totals (dict): Totals over all the websites (see summary.summarize),
+        monitored (int): Number of monitored websites,
+        onAlert (int): Number of websites on alert.
+
+    Returns:
+        A pretty string representation of the totals.
+
+    """
+
+    resString = '\n\n\033[4;93mSummary of the past {} minutes:\033[0m'.format(minutes) + \
+    '\n\t{} websites monitored, {} without data, \033[91m{} on alert\033[0m, {} under 80% uptime'.format(
+        monitored, monitored - totals['sites'], onAlert, totals['downSites']) + \
+    '\n\t{} checks, {} 5xx responses'.format(totals['checks'], totals['serverErrors'])
+    if totals['availability'] is not None:
+        resString += formatUptime(totals['availability'])
+    return resString
+
+def formatReplay(report):
+    """Takes the report of a replay and returns a string representing it in a user-friendly format.
+
+    Args:
+        report (dict): Report of the replay (see replay.Replay.run).
+
+    Returns:
+        A pretty string representation of the report.
+
+    """
+
+    types = Counter(notification[2] for notification in report['notifications'])
+    wallSeconds = max(report['wallSeconds'], 1e-9)
+    return '\n\n\033[4;93mReplay of {:.1f} hours of data:\033[0m'.format(report['dataSeconds'] / 3600) + \
+    '\n\t{} data points of {} websites replayed in {:.2f}s: {:.0f} data points/s ({:.0f} times faster than real time)'.format(
+        report['samples'], report['websites'], report['wallSeconds'], report['samples'] / wallSeconds, report['dataSeconds'] / wallSeconds) + \
+    '\n\t\033[91m{} alerts\033[0m, \033[92m{} recoveries\033[0m, \033[91m{} latency alerts\033[0m, \033[92m{} latency recoveries\033[0m'.format(
+        types['alert'], types['recovery'], types['latencyAlert'], types['latencyRecovery'])
+
+def formatSiteSummary(rank, URL, stats):
+    """Takes the summary of a website and returns a string representing it in a user-friendly format (on one line).
+
+    Args:
+        rank (int): Rank of the website,
+        URL (str): URL of the website,
+        stats (dict): Summary of the website (see summary.SiteSummary.stats).
+
+    Returns:
+        A pretty string representation of the summary.
+
+    """
+
+    p95RT = '{:.0f} ms'.format(stats['p95RT']) if stats['p95RT'] is not None else '-'
+    color = '\033[92m' if stats['availability'] >= 0.9 else '\033[93m' if stats['availability'] >= 0.8 else '\033[91m'
+    return '\n{:>4}. \033[94m{}\033[0m: uptime {}{:.2%}\033[0m, p95 response time {}, {} 5xx responses ({} checks)'.format(
+        rank, URL, color, stats['availability'], p95RT, stats['serverErrors'], stats['checks'])
+
 def formatUptime(uptime):
     """Takes uptime returns a string representing it in a user-friendly format.
 
@@ -88,7 +236,8 @@ def formatAlert(alertData):
             type (str): Type of notification (or None if there is no notification; in that case, the following
             fields do not exist),
             URL (str): Website URL,
-            availability (float): Availability of the website at the time of notification,
+            availability (float): Availability of the website at the time of notification (availability alerts only),
+            responseTime (float): Response time which raised or ended the alert (latency alerts only),
             startDate (datetime.datetime): Date of alert,
             endDate (datetime.datetime, optional): Date of recovery (only in case of a recovery),
 
@@ -102,6 +251,10 @@ def formatAlert(alertData):
             return "\n\033[91mWebsite {} is down. Uptime: {:.2%}\nStart date: {}. \033[0m".format(alertData['URL'], alertData['availability'], formatTime(alertData['startDate']))
         elif alertData['type'] == 'recovery':
             return "\n\033[92mWebsite {} recovered from alert. Uptime: {:.2%}\nStart date: {},\nEnd date: {}\033[0m".format(alertData['URL'], alertData['availability'], formatTime(alertData['startDate']), formatTime(alertData['endDate']))
+        elif alertData['type'] == 'latencyAlert':
+            return "\n\033[91mWebsite {} is slow. Response time: {:.0f}ms\nStart date: {}. \033[0m".format(alertData['URL'], alertData['responseTime'], formatTime(alertData['startDate']))
+        elif alertData['type'] == 'latencyRecovery':
+            return "\n\033[92mWebsite {} recovered from slowness. Response time: {:.0f}ms\nStart date: {},\nEnd date: {}\033[0m".format(alertData['URL'], alertData['responseTime'], formatTime(alertData['startDate']), formatTime(alertData['endDate']))
         else:
             return ""
     except KeyError: